@@ -36,21 +36,9 @@ class CustomUser(AbstractUser):
     
     def has_permission(self, permission_type, resource=None):
         """Check if user has specific permission."""
-        from apps.permissions.models import Permission, RolePermission
+        from apps.permissions.engine import permission_engine
         
-        user_roles = self.get_roles().values_list('role', flat=True)
-        permissions = RolePermission.objects.filter(
-            role__in=user_roles,
-            permission__permission_type=permission_type
-        ).select_related('permission')
-        
-        if resource:
-            permissions = permissions.filter(
-                models.Q(permission__resource=resource) | 
-                models.Q(permission__resource='all')
-            )
-        
-        return permissions.exists()
+        return permission_engine.has_permission(self, permission_type, resource)
 
 class UserProfile(models.Model):
     """Additional profile information for users."""
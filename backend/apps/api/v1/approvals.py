@@ -11,7 +11,7 @@ from django.db import models
 from apps.approvals.models import ApprovalRequest, ApprovalStep
 from apps.approvals.serializers import ApprovalRequestSerializer, ApprovalStepSerializer
 from apps.approvals.services import submit_request, approve_step, reject_step
-from apps.permissions.models import UserRole
+from apps.permissions.context import get_authz
 
 User = get_user_model()
 
@@ -33,14 +33,14 @@ class ApprovalRequestViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Filter queryset based on user permissions"""
         user = self.request.user
-        user_roles = set(UserRole.objects.filter(user=user, is_active=True).values_list('role__name', flat=True))
+        authz = get_authz(self.request)
         
         # Data Administrators and PIs can see all requests
-        if 'Data Administrator' in user_roles or 'PI' in user_roles:
+        if authz.is_data_admin or authz.has_role('PI'):
             return ApprovalRequest.objects.all()
         
         # Ethics reviewers can see requests in their review step
-        if 'Ethics' in user_roles:
+        if authz.has_role('Ethics'):
             return ApprovalRequest.objects.filter(
                 steps__approver=user,
                 steps__approved__isnull=True
@@ -161,10 +161,10 @@ class ApprovalStepViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         """Filter steps based on user permissions"""
         user = self.request.user
-        user_roles = set(UserRole.objects.filter(user=user, is_active=True).values_list('role__name', flat=True))
+        authz = get_authz(self.request)
         
         # Data Administrators and PIs can see all steps
-        if 'Data Administrator' in user_roles or 'PI' in user_roles:
+        if authz.is_data_admin or authz.has_role('PI'):
             return ApprovalStep.objects.all()
         
         # Users can see steps for requests they created or are approving
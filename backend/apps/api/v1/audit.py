@@ -0,0 +1,173 @@
+# apps/api/v1/audit.py
+
+from datetime import timedelta
+
+from django.contrib.contenttypes.models import ContentType
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import serializers, status, permissions
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
+
+from apps.audit.models import AuditLog
+from apps.audit.export import FORMATS, export_audit_logs
+from apps.audit.query import after_cursor, filter_audit_logs, get_page_size, paginate, parse_int
+from apps.audit.rollups import summary
+from apps.audit.request_log import request_log_writer
+from apps.audit.services import log_action
+from apps.audit.writer import audit_writer
+from apps.permissions.context import get_authz
+from apps.tenants.context import get_current_tenant_id
+
+class AuditLogSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username', read_only=True, default=None)
+    target_type = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AuditLog
+        fields = ['id', 'timestamp', 'user', 'username', 'action', 'target_type', 'target_id', 'metadata']
+        read_only_fields = fields
+
+    def get_target_type(self, obj):
+        # Served from ContentType's own cache rather than a join
+        content_type = ContentType.objects.get_for_id(obj.target_type_id)
+        return f'{content_type.app_label}.{content_type.model}'
+
+def can_view_audit_log(request):
+    authz = get_authz(request)
+    return request.user.is_superuser or 'AUDIT_VIEW' in authz.permissions or authz.is_data_admin
+
+class AuditLogListView(APIView):
+    """
+    Audit entries of the current tenant, newest first
+
+    Filters: user, action, target_type ('app_label.model' or id), target_id,
+    since, until, metadata.<key>, and target_user, ip_address or name for the
+    promoted metadata keys. Pages follow the opaque `next` cursor; page_size
+    is capped at 500.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if not can_view_audit_log(request):
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        params = request.query_params
+        try:
+            queryset = filter_audit_logs(AuditLog.objects.select_related('user'), params)
+            entries, cursor = paginate(queryset, params.get('cursor'), get_page_size(params.get('page_size')))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        next_url = None
+        if cursor:
+            next_url = replace_query_param(request.build_absolute_uri(), 'cursor', cursor)
+        return Response({
+            'results': AuditLogSerializer(entries, many=True).data,
+            'next': next_url,
+        })
+
+class AuditLogExportView(APIView):
+    """
+    Stream audit entries of the current tenant, newest first
+
+    Takes the audit list filters plus format ('ndjson' or 'csv') and gzip.
+    Every row carries a cursor; pass the last one received as `cursor` to
+    resume an interrupted export.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_content_negotiation(self, request, force=False):
+        # `format` names the export format here, not a DRF renderer
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        if not can_view_audit_log(request):
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        params = request.query_params
+        export_format = params.get('format', 'ndjson')
+        compress = params.get('gzip', '').lower() in ('1', 'true', 'yes')
+        if export_format not in FORMATS:
+            return Response(
+                {'error': f"format must be one of {', '.join(FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            queryset = after_cursor(filter_audit_logs(AuditLog.objects.all(), params), params.get('cursor'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        log_action(request.user, 'EXPORT_AUDIT_LOG', request.user, metadata={
+            key: value for key, value in params.items()
+        })
+        # Rows are read after the view returns, once the tenant context is
+        # gone, so the tenant's database is chosen now
+        queryset = queryset.using(queryset.db)
+        filename = f'audit-{timezone.now():%Y%m%dT%H%M%S}.{export_format}'
+        if compress:
+            filename += '.gz'
+        response = StreamingHttpResponse(
+            export_audit_logs(queryset, export_format, compress),
+            content_type='application/gzip' if compress else FORMATS[export_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+class AuditSummaryView(APIView):
+    """
+    Audit entry counts of the current tenant per day and action, user or
+    day alone, read from the rollup counters
+
+    Parameters: since and until (days, default the last 30), by ('action',
+    'user' or 'day'). Superusers may pass tenant.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if not can_view_audit_log(request):
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        params = request.query_params
+        by = params.get('by', 'action')
+        if by not in ('action', 'user', 'day'):
+            return Response({'error': "by must be action, user or day"}, status=status.HTTP_400_BAD_REQUEST)
+        until = parse_date(params['until']) if params.get('until') else timezone.localdate()
+        since = parse_date(params['since']) if params.get('since') else until - timedelta(days=29)
+        if since is None or until is None:
+            return Response({'error': 'since and until must be dates'}, status=status.HTTP_400_BAD_REQUEST)
+        tenant_id = get_current_tenant_id()
+        if request.user.is_superuser and params.get('tenant'):
+            try:
+                tenant_id = parse_int(params['tenant'], 'tenant')
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'since': since,
+            'until': until,
+            'results': summary(tenant_id, since, until, by),
+        })
+
+class AuditWriterMetricsView(APIView):
+    """
+    Queue depth and flush latency of the audit and request log writers
+    in this worker
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        if not request.user.is_superuser and not get_authz(request).is_data_admin:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        metrics = audit_writer.metrics()
+        metrics['request_log'] = request_log_writer.metrics()
+        return Response(metrics)
@@ -6,10 +6,10 @@ from rest_framework.response import Response
 from rest_framework import serializers
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
-from django.db import models
 
 from apps.datasets.models import Dataset, DatasetField, DatasetAccess
-from apps.permissions.models import UserRole
+from apps.datasets.services import accessible_dataset_ids
+from apps.permissions.context import get_authz
 from apps.audit.services import log_action
 
 User = get_user_model()
@@ -50,17 +50,10 @@ class DatasetSerializer(serializers.ModelSerializer):
         user = self.context['request'].user if 'request' in self.context else None
         
         if user and user.is_authenticated:
-            user_roles = set(UserRole.objects.filter(user=user, is_active=True).values_list('role__name', flat=True))
-            
-            # Check if user has access to this dataset
-            has_access = DatasetAccess.objects.filter(
-                dataset=instance, 
-                user=user, 
-                is_active=True
-            ).exists()
+            authz = get_authz(self.context['request'])
             
             # Filter sensitive fields based on user permissions
-            if 'Data Administrator' not in user_roles and not has_access:
+            if not authz.can_read_dataset(instance):
                 # Hide sensitive field details for users without access
                 data['fields'] = [
                     {**field, 'sensitivity_level': '***'} 
@@ -85,18 +78,17 @@ class DatasetViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Filter datasets based on user permissions"""
         user = self.request.user
-        user_roles = set(UserRole.objects.filter(user=user, is_active=True).values_list('role__name', flat=True))
         
         # Data Administrators can see all datasets
-        if 'Data Administrator' in user_roles:
+        if get_authz(self.request).is_data_admin:
             return Dataset.objects.filter(is_active=True)
         
-        # Users can see datasets they own or have access to
-        return Dataset.objects.filter(
-            models.Q(owner=user) | 
-            models.Q(datasetaccess__user=user, datasetaccess__is_active=True),
+        # Users can see datasets they own or have access to, unless a
+        # dataset policy denies them
+        return get_authz(self.request).readable_datasets(Dataset.objects.filter(
+            id__in=accessible_dataset_ids(user),
             is_active=True
-        ).distinct()
+        ))
 
     def perform_create(self, serializer):
         """Set owner to current user when creating dataset"""
@@ -136,8 +128,7 @@ class DatasetViewSet(viewsets.ModelViewSet):
             )
         
         # Check if user has permission to grant access
-        user_roles = set(UserRole.objects.filter(user=request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles and dataset.owner != request.user:
+        if not get_authz(request).is_data_admin and dataset.owner != request.user:
             return Response(
                 {'error': 'Permission denied'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -159,7 +150,7 @@ class DatasetViewSet(viewsets.ModelViewSet):
         log_action(request.user, 'GRANT_ACCESS', dataset, {
             'target_user': target_user.username,
             'access_level': access_level
-        })
+        }, durable=True)
         
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
@@ -188,8 +179,7 @@ class DatasetViewSet(viewsets.ModelViewSet):
             )
         
         # Check permission
-        user_roles = set(UserRole.objects.filter(user=request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles and dataset.owner != request.user:
+        if not get_authz(request).is_data_admin and dataset.owner != request.user:
             return Response(
                 {'error': 'Permission denied'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -200,7 +190,7 @@ class DatasetViewSet(viewsets.ModelViewSet):
         
         log_action(request.user, 'REVOKE_ACCESS', dataset, {
             'target_user': access.user.username
-        })
+        }, durable=True)
         
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -210,8 +200,7 @@ class DatasetViewSet(viewsets.ModelViewSet):
         dataset = self.get_object()
         
         # Check permission
-        user_roles = set(UserRole.objects.filter(user=request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles and dataset.owner != request.user:
+        if not get_authz(request).is_data_admin and dataset.owner != request.user:
             return Response(
                 {'error': 'Permission denied'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -234,17 +223,13 @@ class DatasetFieldViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Filter fields based on dataset access"""
         user = self.request.user
-        user_roles = set(UserRole.objects.filter(user=user, is_active=True).values_list('role__name', flat=True))
         
         # Data Administrators can see all fields
-        if 'Data Administrator' in user_roles:
+        if get_authz(self.request).is_data_admin:
             return DatasetField.objects.all()
         
         # Users can see fields for datasets they own or have access to
-        return DatasetField.objects.filter(
-            models.Q(dataset__owner=user) | 
-            models.Q(dataset__datasetaccess__user=user, dataset__datasetaccess__is_active=True)
-        ).distinct()
+        return DatasetField.objects.filter(dataset_id__in=accessible_dataset_ids(user))
 
     def perform_create(self, serializer):
         field = serializer.save()
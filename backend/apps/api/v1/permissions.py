@@ -3,15 +3,23 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework import serializers
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
 
 from apps.permissions.models import Role, Permission, UserRole, RolePermission, PermissionPolicy
+from apps.permissions.context import get_authz
+from apps.permissions.engine import permission_engine
+from apps.permissions.hierarchy import would_create_cycle
+from apps.permissions.policies import compile_condition, CompiledPolicy, PolicyError
 from apps.audit.services import log_action
 
 User = get_user_model()
 
+# Upper bound on the number of checks answered by one batch request
+MAX_PERMISSION_CHECKS = 1000
+
 # Serializers
 class PermissionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -25,12 +33,17 @@ class RoleSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Role
-        fields = ['id', 'name', 'description', 'is_active', 'created_at', 'permissions', 'permission_count']
+        fields = ['id', 'name', 'description', 'parent', 'is_active', 'created_at', 'permissions', 'permission_count']
         read_only_fields = ['id', 'created_at', 'permission_count']
 
     def get_permission_count(self, obj):
         return obj.permissions.count()
 
+    def validate_parent(self, value):
+        if value is not None and self.instance is not None and would_create_cycle(self.instance, value.pk):
+            raise serializers.ValidationError("A role cannot inherit from itself or its descendants")
+        return value
+
 class UserRoleSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
     role_name = serializers.CharField(source='role.name', read_only=True)
@@ -57,6 +70,47 @@ class PermissionPolicySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'resource_type', 'conditions', 'actions', 'is_active', 'created_at']
         read_only_fields = ['id', 'created_at']
 
+    def validate_conditions(self, value):
+        try:
+            compile_condition(value)
+        except PolicyError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate_actions(self, value):
+        try:
+            CompiledPolicy(PermissionPolicy(conditions={}, actions=value))
+        except PolicyError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+class PermissionCheckSerializer(serializers.Serializer):
+    """
+    Batch of [user_id, permission_type, resource] checks.
+    The resource may be omitted or null to check across all resources.
+    """
+    checks = serializers.ListField(
+        child=serializers.ListField(min_length=2, max_length=3),
+        allow_empty=False,
+        max_length=MAX_PERMISSION_CHECKS
+    )
+
+    def validate_checks(self, value):
+        checks = []
+        for index, check in enumerate(value):
+            user_id, permission_type = check[0], check[1]
+            resource = check[2] if len(check) > 2 else None
+            try:
+                user_id = int(user_id)
+            except (TypeError, ValueError):
+                raise serializers.ValidationError(f"Check {index}: user id must be an integer")
+            if not isinstance(permission_type, str):
+                raise serializers.ValidationError(f"Check {index}: permission_type must be a string")
+            if resource is not None and not isinstance(resource, str):
+                raise serializers.ValidationError(f"Check {index}: resource must be a string or null")
+            checks.append((user_id, permission_type, resource or None))
+        return checks
+
 # ViewSets
 class RoleViewSet(viewsets.ModelViewSet):
     """
@@ -71,10 +125,9 @@ class RoleViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Filter roles based on user permissions"""
         user = self.request.user
-        user_roles = set(UserRole.objects.filter(user=user, is_active=True).values_list('role__name', flat=True))
         
         # Only Data Administrators can manage roles
-        if 'Data Administrator' in user_roles:
+        if get_authz(self.request).is_data_admin:
             return Role.objects.filter(is_active=True)
         
         # Other users can only view their own roles
@@ -86,8 +139,7 @@ class RoleViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """Check permission to create roles"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(self.request).is_data_admin:
             raise PermissionError("Only Data Administrators can create roles")
         
         role = serializer.save()
@@ -95,8 +147,7 @@ class RoleViewSet(viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         """Check permission to update roles"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(self.request).is_data_admin:
             raise PermissionError("Only Data Administrators can update roles")
         
         role = serializer.save()
@@ -104,8 +155,7 @@ class RoleViewSet(viewsets.ModelViewSet):
 
     def perform_destroy(self, instance):
         """Soft delete role"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(self.request).is_data_admin:
             raise PermissionError("Only Data Administrators can delete roles")
         
         instance.is_active = False
@@ -118,8 +168,7 @@ class RoleViewSet(viewsets.ModelViewSet):
         role = self.get_object()
         permission_id = request.data.get('permission_id')
         
-        user_roles = set(UserRole.objects.filter(user=request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(request).is_data_admin:
             return Response(
                 {'error': 'Only Data Administrators can manage role permissions'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -147,7 +196,7 @@ class RoleViewSet(viewsets.ModelViewSet):
         serializer = RolePermissionSerializer(role_permission)
         log_action(request.user, 'ADD_PERMISSION', role, {
             'permission': permission.name
-        })
+        }, durable=True)
         
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
@@ -157,8 +206,7 @@ class RoleViewSet(viewsets.ModelViewSet):
         role = self.get_object()
         permission_id = request.data.get('permission_id')
         
-        user_roles = set(UserRole.objects.filter(user=request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(request).is_data_admin:
             return Response(
                 {'error': 'Only Data Administrators can manage role permissions'}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -186,7 +234,7 @@ class RoleViewSet(viewsets.ModelViewSet):
         
         log_action(request.user, 'REMOVE_PERMISSION', role, {
             'permission': permission_name
-        })
+        }, durable=True)
         
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -203,10 +251,9 @@ class UserRoleViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Filter user roles based on permissions"""
         user = self.request.user
-        user_roles = set(UserRole.objects.filter(user=user, is_active=True).values_list('role__name', flat=True))
         
         # Data Administrators can see all user roles
-        if 'Data Administrator' in user_roles:
+        if get_authz(self.request).is_data_admin:
             return UserRole.objects.filter(is_active=True)
         
         # Users can only see their own roles
@@ -214,26 +261,24 @@ class UserRoleViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """Check permission to assign roles"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(self.request).is_data_admin:
             raise PermissionError("Only Data Administrators can assign roles")
         
         user_role = serializer.save(assigned_by=self.request.user)
         log_action(self.request.user, 'ASSIGN_ROLE', user_role.user, {
             'role': user_role.role.name
-        })
+        }, durable=True)
 
     def perform_destroy(self, instance):
         """Revoke user role"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(self.request).is_data_admin:
             raise PermissionError("Only Data Administrators can revoke roles")
         
         instance.is_active = False
         instance.save()
         log_action(self.request.user, 'REVOKE_ROLE', instance.user, {
             'role': instance.role.name
-        })
+        }, durable=True)
 
 class PermissionViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -247,9 +292,7 @@ class PermissionViewSet(viewsets.ReadOnlyModelViewSet):
 
     def get_queryset(self):
         """Only Data Administrators can see all permissions"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        
-        if 'Data Administrator' in user_roles:
+        if get_authz(self.request).is_data_admin:
             return Permission.objects.all()
         
         # Other users can only see their permissions
@@ -270,17 +313,14 @@ class PermissionPolicyViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """Only Data Administrators can manage policies"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        
-        if 'Data Administrator' in user_roles:
+        if get_authz(self.request).is_data_admin:
             return PermissionPolicy.objects.filter(is_active=True)
         
         return PermissionPolicy.objects.none()
 
     def perform_create(self, serializer):
         """Check permission to create policies"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(self.request).is_data_admin:
             raise PermissionError("Only Data Administrators can create policies")
         
         policy = serializer.save()
@@ -288,8 +328,7 @@ class PermissionPolicyViewSet(viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         """Check permission to update policies"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(self.request).is_data_admin:
             raise PermissionError("Only Data Administrators can update policies")
         
         policy = serializer.save()
@@ -297,10 +336,34 @@ class PermissionPolicyViewSet(viewsets.ModelViewSet):
 
     def perform_destroy(self, instance):
         """Soft delete policy"""
-        user_roles = set(UserRole.objects.filter(user=self.request.user, is_active=True).values_list('role__name', flat=True))
-        if 'Data Administrator' not in user_roles:
+        if not get_authz(self.request).is_data_admin:
             raise PermissionError("Only Data Administrators can delete policies")
         
         instance.is_active = False
         instance.save()
-        log_action(self.request.user, 'DELETE', instance, {'name': instance.name})
\ No newline at end of file
+        log_action(self.request.user, 'DELETE', instance, {'name': instance.name})
+
+class PermissionCheckView(APIView):
+    """
+    Bulk authorization decisions
+    
+    Answers many (user, permission_type, resource) questions from one load of
+    the relevant role and dataset grant rows. Results are returned as a 0/1
+    vector in request order.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = PermissionCheckSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        checks = serializer.validated_data['checks']
+        
+        # Only Data Administrators can ask about other users
+        if not get_authz(request).is_data_admin and any(user_id != request.user.id for user_id, _, _ in checks):
+            return Response(
+                {'error': 'Only Data Administrators can check permissions of other users'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        results = permission_engine.check_many(checks)
+        return Response({'results': [int(allowed) for allowed in results]})
\ No newline at end of file
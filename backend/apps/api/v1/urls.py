@@ -8,9 +8,11 @@ from rest_framework_simplejwt.views import (
 )
 
 from .approvals import ApprovalRequestViewSet, ApprovalStepViewSet
+from .audit import AuditLogExportView, AuditLogListView, AuditSummaryView, AuditWriterMetricsView
 from .datasets import DatasetViewSet, DatasetFieldViewSet
 from .permissions import (
-    RoleViewSet, UserRoleViewSet, PermissionViewSet, PermissionPolicyViewSet
+    RoleViewSet, UserRoleViewSet, PermissionViewSet, PermissionPolicyViewSet,
+    PermissionCheckView
 )
 from apps.accounts.views import CurrentUserView
 
@@ -37,6 +39,16 @@ urlpatterns = [
     path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/user/', CurrentUserView.as_view(), name='current_user'),
     
+    # Bulk authorization decisions
+    path('permissions/check/', PermissionCheckView.as_view(), name='permission_check'),
+    
+    # Audit log
+    path('audit/', AuditLogListView.as_view(), name='audit_logs'),
+    path('audit/export/', AuditLogExportView.as_view(), name='audit_export'),
+    path('audit/summary/', AuditSummaryView.as_view(), name='audit_summary'),
+    # Audit writer metrics
+    path('audit/writer/', AuditWriterMetricsView.as_view(), name='audit_writer_metrics'),
+    
     # API endpoints
     path('', include(router.urls)),
 ]
\ No newline at end of file
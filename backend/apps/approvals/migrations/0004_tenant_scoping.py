@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0001_initial"),
+        ("approvals", "0003_approvalrequest_sensitivity"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="approvalrequest",
+            options={
+                "base_manager_name": "all_objects",
+                "default_manager_name": "objects",
+            },
+        ),
+        migrations.AlterModelManagers(
+            name="approvalrequest",
+            managers=[
+                ("objects", django.db.models.manager.Manager()),
+                ("all_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="approvalrequest",
+            name="tenant",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Leave blank for global data",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="tenants.tenant",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="approvalrequest",
+            index=models.Index(
+                fields=["tenant", "status", "created_at"],
+                name="approval_tenant_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="approvalrequest",
+            index=models.Index(
+                fields=["tenant", "applicant", "created_at"],
+                name="approval_tenant_applicant_idx",
+            ),
+        ),
+    ]
@@ -3,7 +3,9 @@
 from django.db import models
 from django.conf import settings
 
-class ApprovalRequest(models.Model):
+from apps.tenants.models import TenantAwareModel
+
+class ApprovalRequest(TenantAwareModel):
     STATUS_CHOICES = [
         ('PENDING', 'Pending'),
         ('APPROVED', 'Approved'),
@@ -24,6 +26,12 @@ class ApprovalRequest(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta(TenantAwareModel.Meta):
+        indexes = [
+            models.Index(fields=['tenant', 'status', 'created_at'], name='approval_tenant_status_idx'),
+            models.Index(fields=['tenant', 'applicant', 'created_at'], name='approval_tenant_applicant_idx'),
+        ]
+
 class ApprovalStep(models.Model):
     request = models.ForeignKey(ApprovalRequest, on_delete=models.CASCADE, related_name='steps')
     step_number = models.IntegerField()
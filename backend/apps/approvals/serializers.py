@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from .models import ApprovalRequest, ApprovalStep
-from apps.permissions.models import UserRole
+from apps.permissions.context import get_authz
 
 class ApprovalStepSerializer(serializers.ModelSerializer):
     approver_username = serializers.CharField(source='approver.username', read_only=True)
@@ -24,14 +24,12 @@ class ApprovalRequestSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
         user = self.context['request'].user if 'request' in self.context else None
-        user_roles = set()
-        if user and user.is_authenticated:
-            user_roles = set(UserRole.objects.filter(user=user, is_active=True).values_list('role__name', flat=True))
+        authz = get_authz(self.context['request']) if user and user.is_authenticated else None
         # Example rules:
-        if 'Data Administrator' in user_roles or 'PI' in user_roles:
+        if authz is not None and (authz.is_data_admin or authz.has_role('PI')):
             # Full access
             return data
-        if 'Ethics' in user_roles:
+        if authz is not None and authz.has_role('Ethics'):
             # Mask sensitivity field
             data['sensitivity'] = '***'
             return data
@@ -5,6 +5,8 @@ from django.db import transaction
 from .models import ApprovalRequest, ApprovalStep, ApprovalFlowTemplate, ApprovalFlowStepTemplate
 from apps.audit.services import log_action  # expected in audit/services.py
 from apps.permissions.models import UserRole, Role
+from apps.tenants.config import get_tenant_config
+from apps.tenants.context import get_current_tenant_id
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
@@ -28,11 +30,16 @@ def submit_request(applicant, title, description, approvers, sensitivity='normal
             description=description,
             sensitivity=sensitivity
         )
-        # Select flow template based on sensitivity
-        flow_template = ApprovalFlowTemplate.objects.filter(
-            is_active=True,
-            name__icontains=sensitivity  # e.g. 'normal' or 'high'
-        ).order_by('id').first()
+        # Select flow template based on sensitivity, unless the tenant names one
+        flow_template = None
+        override = get_tenant_config(get_current_tenant_id()).approval_templates.get(sensitivity)
+        if override:
+            flow_template = ApprovalFlowTemplate.objects.filter(is_active=True, name=override).first()
+        if not flow_template:
+            flow_template = ApprovalFlowTemplate.objects.filter(
+                is_active=True,
+                name__icontains=sensitivity  # e.g. 'normal' or 'high'
+            ).order_by('id').first()
         if not flow_template:
             raise Exception(f"No approval flow template found for sensitivity: {sensitivity}")
         # Generate steps from template
@@ -72,7 +79,7 @@ def approve_step(request_id, approver, comment=""):
         current_step.acted_at = timezone.now()
         current_step.save()
 
-        log_action(user=approver, action="approve_step", target=current_step)
+        log_action(user=approver, action="approve_step", target=current_step, durable=True)
 
         if request.steps.filter(step_number__gt=current_step.step_number, approved__isnull=True).exists():
             request.current_step += 1
@@ -99,4 +106,4 @@ def reject_step(request_id, approver, comment=""):
         request.status = "REJECTED"
         request.save()
 
-        log_action(user=approver, action="reject_step", target=current_step)
+        log_action(user=approver, action="reject_step", target=current_step, durable=True)
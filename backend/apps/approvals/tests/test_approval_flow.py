@@ -258,14 +258,17 @@ class ApprovalFlowTestCase(TestCase):
         """Test that audit logs are created for actions."""
         try:
             from apps.audit.models import AuditLog
+            from apps.audit.writer import audit_writer
             
-            # Create and approve request
-            request = submit_request(
-                applicant=self.applicant,
-                title="Test Request",
-                description="This is a test request",
-                approvers=[self.approver1]
-            )
+            # Create and approve request; entries are written after commit
+            with self.captureOnCommitCallbacks(execute=True):
+                request = submit_request(
+                    applicant=self.applicant,
+                    title="Test Request",
+                    description="This is a test request",
+                    approvers=[self.approver1]
+                )
+            audit_writer.flush()
             
             # Check submit log
             submit_log = AuditLog.objects.filter(
@@ -276,7 +279,8 @@ class ApprovalFlowTestCase(TestCase):
             self.assertEqual(submit_log.user, self.applicant)
             
             # Approve request
-            approve_step(request.id, self.approver1, "Approved")
+            with self.captureOnCommitCallbacks(execute=True):
+                approve_step(request.id, self.approver1, "Approved")
             
             # Check approve log
             approve_log = AuditLog.objects.filter(
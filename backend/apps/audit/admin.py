@@ -1,7 +1,7 @@
 # apps/audit/admin.py
 
 from django.contrib import admin
-from .models import AuditLog
+from .models import AuditCheckpoint, AuditLog, AuditRollup, RequestLog
 
 @admin.register(AuditLog)
 class AuditLogAdmin(admin.ModelAdmin):
@@ -10,7 +10,11 @@ class AuditLogAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'action', 'target_type__model']
     ordering = ['-timestamp']
     date_hierarchy = 'timestamp'
-    readonly_fields = ['user', 'action', 'target_type', 'target_id', 'timestamp', 'metadata']
+    readonly_fields = ['user', 'action', 'target_type', 'target_id', 'timestamp', 'metadata', 'sequence', 'digest']
+    # Counting every row scans every monthly partition; the date hierarchy
+    # bounds timestamp so only the chosen months are read
+    show_full_result_count = False
+    list_select_related = ['user', 'target_type']
     
     def has_add_permission(self, request):
         """Disable manual creation of audit logs."""
@@ -18,4 +22,49 @@ class AuditLogAdmin(admin.ModelAdmin):
     
     def has_change_permission(self, request, obj=None):
         """Disable editing of audit logs."""
-        return False 
\ No newline at end of file
+        return False 
+
+@admin.register(RequestLog)
+class RequestLogAdmin(admin.ModelAdmin):
+    list_display = ['timestamp', 'method', 'path', 'status', 'latency_ms', 'user_id', 'tenant_id']
+    list_filter = ['method', 'status']
+    search_fields = ['path']
+    ordering = ['-timestamp']
+    date_hierarchy = 'timestamp'
+    
+    def has_add_permission(self, request):
+        """Request logs are only written by the middleware."""
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        """Disable editing of request logs."""
+        return False
+
+@admin.register(AuditRollup)
+class AuditRollupAdmin(admin.ModelAdmin):
+    list_display = ['day', 'tenant_id', 'action', 'user_id', 'count']
+    list_filter = ['action']
+    ordering = ['-day']
+    date_hierarchy = 'day'
+    
+    def has_add_permission(self, request):
+        """Rollups are only written by the audit writer and audit_rollups."""
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        """Disable editing of rollups."""
+        return False
+
+@admin.register(AuditCheckpoint)
+class AuditCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['database', 'block', 'first_sequence', 'last_sequence', 'root', 'created_at', 'verified_at']
+    list_filter = ['database']
+    ordering = ['database', '-block']
+    
+    def has_add_permission(self, request):
+        """Checkpoints are only written by the audit chain sealer."""
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        """Disable editing of checkpoints."""
+        return False
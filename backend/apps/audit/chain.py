@@ -0,0 +1,304 @@
+# apps/audit/chain.py
+
+"""
+Tamper evidence for the audit log.
+
+Entries are buffered and written by many workers, so they are chained
+after the fact. The sealer takes committed entries without a sequence
+in id order, numbers them and sets
+
+    digest = sha256(previous digest + canonical encoding of the entry)
+
+starting from GENESIS, so changing, removing or inserting an entry
+breaks every later link. Each full block of AUDIT_CHAIN_BLOCK_SIZE
+entries gets an AuditCheckpoint holding the Merkle root of its digests
+and its last digest.
+
+verify() re-hashes only the blocks after the last verified checkpoint,
+starting from that checkpoint's head and streaming rows in sequence
+order. It stops at the first broken link: a changed entry, a gap or
+duplicate in the sequence, or a block whose root no longer matches its
+checkpoint. A full verification starts from the oldest live block, as
+entries compacted into cold storage (apps.audit.cold) are no longer in
+the table; verify_archive() re-hashes those from their segments. Entries
+after the last sealed one cannot be vouched for until they are sealed.
+
+Entries only leave the table as a prefix of the chain, so the live part
+has no holes: compaction cuts at removable_prefix(), and detaching a
+partition is refused unless check_removable() passes.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Max
+from django.utils import timezone
+
+from .cold import to_micros
+from .models import AuditCheckpoint, AuditLog
+
+logger = logging.getLogger(__name__)
+
+GENESIS = '0' * 64
+BLOCK_SIZE = getattr(settings, 'AUDIT_CHAIN_BLOCK_SIZE', 4096)
+SEAL_BATCH_SIZE = getattr(settings, 'AUDIT_CHAIN_SEAL_BATCH_SIZE', 5000)
+SEAL_INTERVAL = getattr(settings, 'AUDIT_CHAIN_SEAL_INTERVAL', 10)
+CHUNK_SIZE = 10000
+# pg_advisory_xact_lock key serialising sealers of a database
+LOCK_KEY = 0x41554443
+
+CHAINED_FIELDS = [
+    'sequence', 'event_id', 'tenant_id', 'user_id', 'action', 'target_type_id', 'target_id',
+    'timestamp', 'metadata',
+]
+
+_encode = json.JSONEncoder(separators=(',', ':'), sort_keys=True, ensure_ascii=False, default=str).encode
+
+def link(previous, sequence, event_id, tenant_id, user_id, action, target_type_id, target_id,
+         timestamp, metadata):
+    """Hex digest of an entry chained to the previous digest"""
+    # Numbers and hex never contain '|'; the free-form fields go through JSON
+    body = (
+        f'{previous}|{sequence}|{event_id.hex if event_id else None}|{tenant_id}|{user_id}|'
+        f'{target_type_id}|{target_id}|{to_micros(timestamp)}|{_encode([action, metadata])}'
+    )
+    return hashlib.sha256(body.encode()).hexdigest()
+
+def merkle_root(digests):
+    """Merkle root of hex digests; an odd node is paired with itself"""
+    level = [bytes.fromhex(digest) for digest in digests]
+    if not level:
+        return GENESIS
+    sha256 = hashlib.sha256
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+def _lock(database):
+    connection = connections[database]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [LOCK_KEY])
+    # SQLite allows one writer at a time already
+
+def _entries(database):
+    return AuditLog._base_manager.using(database)
+
+def chain_head(database=DEFAULT_DB_ALIAS):
+    """(sequence, digest) of the last sealed entry"""
+    last = (
+        _entries(database).filter(sequence__isnull=False)
+        .order_by('-sequence').values_list('sequence', 'digest').first()
+    )
+    return last or (0, GENESIS)
+
+def _checkpoint(database, sealed_to, block_size):
+    last = AuditCheckpoint.objects.filter(database=database).order_by('-block').first()
+    block = last.block + 1 if last else 0
+    while (block + 1) * block_size <= sealed_to:
+        first, last_sequence = block * block_size + 1, (block + 1) * block_size
+        digests = list(
+            _entries(database).filter(sequence__range=(first, last_sequence))
+            .order_by('sequence').values_list('digest', flat=True)
+        )
+        AuditCheckpoint.objects.create(
+            database=database, block=block, first_sequence=first, last_sequence=last_sequence,
+            root=merkle_root(digests), head=digests[-1]
+        )
+        block += 1
+
+def seal(database=DEFAULT_DB_ALIAS, batch_size=SEAL_BATCH_SIZE, block_size=BLOCK_SIZE):
+    """Chain committed entries that have no sequence yet; returns how many were sealed"""
+    sealed = 0
+    while True:
+        with transaction.atomic(using=database):
+            _lock(database)
+            sequence, previous = chain_head(database)
+            rows = list(
+                _entries(database).filter(sequence__isnull=True).order_by('id')
+                .values_list('id', *CHAINED_FIELDS[1:])[:batch_size]
+            )
+            updates = []
+            for pk, *values in rows:
+                sequence += 1
+                previous = link(previous, sequence, *values)
+                updates.append(AuditLog(pk=pk, sequence=sequence, digest=previous))
+            _entries(database).bulk_update(updates, ['sequence', 'digest'], batch_size=1000)
+            _checkpoint(database, sequence, block_size)
+        sealed += len(rows)
+        if len(rows) < batch_size:
+            return sealed
+
+def _start(database, full):
+    """(first sequence to verify, digest before it, checkpoints from there on)"""
+    checkpoints = AuditCheckpoint.objects.filter(database=database).order_by('block')
+    oldest = (
+        _entries(database).filter(sequence__isnull=False)
+        .order_by('sequence').values_list('sequence', 'digest').first()
+    )
+    if oldest is None or oldest[0] == 1:
+        start = 1, GENESIS
+    else:
+        # Older entries were compacted into cold storage; start at the first
+        # block boundary still live, or failing that trust the oldest digest
+        boundary = checkpoints.filter(last_sequence__gte=oldest[0] - 1).first()
+        start = (boundary.last_sequence + 1, boundary.head) if boundary else (oldest[0] + 1, oldest[1])
+    if not full:
+        verified = checkpoints.filter(verified_at__isnull=False).order_by('-block').first()
+        if verified is not None and verified.last_sequence + 1 >= start[0]:
+            start = verified.last_sequence + 1, verified.head
+    return start[0], start[1], list(checkpoints.filter(first_sequence__gte=start[0]))
+
+def _check_rows(rows, expected, previous, checkpoints):
+    """
+    Re-hash (id, *CHAINED_FIELDS, digest) rows in sequence order, starting
+    at sequence expected chained to digest previous. Returns (entries
+    checked, pks of the checkpoints matched, next expected sequence, first
+    broken link or None).
+    """
+    by_first = {checkpoint.first_sequence: checkpoint for checkpoint in checkpoints}
+    block, block_digests = by_first.get(expected), []
+    verified_blocks, checked, broken = [], 0, None
+    for pk, sequence, *values, digest in rows:
+        if sequence != expected:
+            reason = 'duplicate sequence' if sequence < expected else f'entries {expected}..{sequence - 1} missing'
+            broken = {'sequence': expected, 'id': pk, 'reason': reason}
+            break
+        previous = link(previous, sequence, *values)
+        if previous != digest:
+            broken = {'sequence': sequence, 'id': pk, 'reason': 'digest mismatch'}
+            break
+        checked += 1
+        expected += 1
+        if block is not None:
+            block_digests.append(digest)
+            if sequence == block.last_sequence:
+                if merkle_root(block_digests) != block.root or digest != block.head:
+                    broken = {'sequence': block.first_sequence, 'id': None,
+                              'reason': f'checkpoint {block.block} does not match its entries'}
+                    break
+                verified_blocks.append(block.pk)
+                block = None
+        if block is None:
+            block, block_digests = by_first.get(expected), []
+    return checked, verified_blocks, expected, broken
+
+def _result(started, checked, blocks, last_sequence, broken):
+    elapsed = time.perf_counter() - started
+    return {
+        'entries': checked,
+        'blocks': blocks,
+        'last_sequence': last_sequence,
+        'seconds': round(elapsed, 3),
+        'entries_per_second': int(checked / elapsed) if elapsed else None,
+        'broken': broken,
+    }
+
+def verify(database=DEFAULT_DB_ALIAS, full=False, chunk_size=CHUNK_SIZE):
+    """
+    Re-hash the chain after the last verified checkpoint (everything live
+    with full). Returns a dict with the entries and blocks checked, the
+    rate, and the first broken link or None.
+    """
+    started = time.perf_counter()
+    expected, previous, checkpoints = _start(database, full)
+    rows = (
+        _entries(database).filter(sequence__gte=expected).order_by('sequence', 'id')
+        .values_list('id', *CHAINED_FIELDS, 'digest').iterator(chunk_size=chunk_size)
+    )
+    checked, verified_blocks, expected, broken = _check_rows(rows, expected, previous, checkpoints)
+
+    checkpointed_to = checkpoints[-1].last_sequence if checkpoints else 0
+    if broken is None and expected <= checkpointed_to:
+        # Checkpointed entries at the end of the chain are gone
+        broken = {'sequence': expected, 'id': None, 'reason': f'entries {expected}..{checkpointed_to} missing'}
+    if verified_blocks:
+        AuditCheckpoint.objects.filter(pk__in=verified_blocks).update(verified_at=timezone.now())
+    return _result(started, checked, len(verified_blocks), expected - 1, broken)
+
+def verify_archive(store, database=DEFAULT_DB_ALIAS):
+    """
+    Re-hash the entries compacted into cold storage from their segments,
+    checking them against the checkpoints of their blocks. Returns what
+    verify() does.
+    """
+    started = time.perf_counter()
+    segments = store.chain_segments(database)
+    if not segments:
+        return _result(started, 0, 0, 0, None)
+    unchained = [entry['name'] for entry in segments if entry['min'].get('sequence') is None]
+    if unchained:
+        broken = {'sequence': None, 'id': None, 'reason': f'{unchained[0]} was written without the chain'}
+        return _result(started, 0, 0, 0, broken)
+
+    first, last = segments[0]['min']['sequence'], segments[-1]['max']['sequence']
+    checkpoints = AuditCheckpoint.objects.filter(database=database).order_by('block')
+    if first == 1:
+        previous = GENESIS
+    else:
+        # Older segments were removed; start from the checkpoint before
+        before = checkpoints.filter(last_sequence=first - 1).first()
+        if before is None:
+            broken = {'sequence': first, 'id': None, 'reason': 'no checkpoint ends before the oldest archived entry'}
+            return _result(started, 0, 0, first - 1, broken)
+        previous = before.head
+    blocks = list(checkpoints.filter(first_sequence__gte=first, last_sequence__lte=last))
+    checked, verified_blocks, expected, broken = _check_rows(store.chain_rows(segments), first, previous, blocks)
+    if broken is None and expected <= last:
+        broken = {'sequence': expected, 'id': None, 'reason': f'entries {expected}..{last} missing'}
+    return _result(started, checked, len(verified_blocks), expected - 1, broken)
+
+def removable_prefix(database=DEFAULT_DB_ALIAS, before=None):
+    """
+    Last sequence N ending a checkpointed block such that every entry
+    chained up to N was logged before `before`, or 0. Taking out exactly
+    the entries up to N leaves the live chain without holes.
+    """
+    checkpoints = AuditCheckpoint.objects.filter(database=database)
+    if before is not None:
+        newer = (
+            _entries(database).filter(sequence__isnull=False, timestamp__gte=before)
+            .order_by('sequence').values_list('sequence', flat=True).first()
+        )
+        if newer is not None:
+            checkpoints = checkpoints.filter(last_sequence__lt=newer)
+    return checkpoints.aggregate(last=Max('last_sequence'))['last'] or 0
+
+def check_removable(start, end, database=DEFAULT_DB_ALIAS):
+    """
+    Raise ValueError unless the entries logged in [start, end) can leave
+    the table as a prefix of the chain: all sealed into checkpointed
+    blocks, and chained before every entry that stays
+    """
+    entries = _entries(database)
+    inside = entries.filter(timestamp__gte=start, timestamp__lt=end)
+    if inside.filter(sequence__isnull=True).exists():
+        raise ValueError("Some of these entries are not sealed into the audit chain yet; run `audit_chain seal`")
+    last = inside.aggregate(last=Max('sequence'))['last']
+    if last is None:
+        return
+    if not AuditCheckpoint.objects.filter(database=database, last_sequence__gte=last).exists():
+        raise ValueError("The last block of these entries has no checkpoint yet")
+    if entries.exclude(timestamp__gte=start, timestamp__lt=end).filter(sequence__lt=last).exists():
+        raise ValueError(
+            "Entries logged outside this range were chained before its last entry; "
+            "removing it would leave a hole in the audit chain"
+        )
+
+def run_sealer(database=DEFAULT_DB_ALIAS, interval=SEAL_INTERVAL, stop_event=None):
+    """Seal new entries every interval seconds until stop_event is set"""
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            seal(database)
+        except Exception:
+            logger.exception("Audit chain sealing failed")
+        stop_event.wait(interval)
@@ -0,0 +1,377 @@
+# apps/audit/cold.py
+
+"""
+Columnar cold storage for old audit entries.
+
+Entries older than AUDIT_ARCHIVE_AFTER_MONTHS are compacted out of
+AuditLog into immutable segment files under AUDIT_ARCHIVE_DIR. Only a
+prefix of the hash chain (apps.audit.chain) ending on a checkpoint leaves
+the table, so the live chain never has holes: an old entry chained after
+a newer one waits until the newer one is old too. A segment holds up to
+AUDIT_ARCHIVE_SEGMENT_ROWS entries in sequence order, with their digests,
+stored column by column, each column compressed with zlib on its own:
+
+    header     magic, format version, column count, row count
+    directory  per column: name, kind, offset, length, crc32
+    columns    the compressed arrays
+
+Integer columns are little-endian int64 arrays with -1 for NULL, action
+is dictionary encoded, event_id is 16 bytes per row, digest 32 and
+metadata is one JSON document per line. Format 1 segments, written before
+entries were chained, have no sequence or digest columns.
+
+manifest.json lists the segments with the min/max of every integer
+column and the set of actions they hold. A query reads the manifest,
+skips segments whose ranges cannot match, memory-maps the rest and
+decompresses the filter columns first, and the other columns only for
+segments with matching rows.
+
+Compaction writes and fsyncs a segment, records it in the manifest and
+only then deletes its rows, marking the manifest entry once they are
+gone. A run interrupted in between is finished by the next one: rows of
+unmarked segments are deleted again and segment files missing from the
+manifest are removed, their rows still being in the database.
+"""
+
+import array
+import datetime
+import fcntl
+import json
+import mmap
+import os
+import struct
+import sys
+import uuid
+import zlib
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .models import AuditLog
+
+MAGIC = b'DAHC'
+FORMAT_VERSION = 2
+READABLE_VERSIONS = (1, 2)
+HEADER = struct.Struct('<4sHHI')
+COLUMN = struct.Struct('<16scxxxQQI')
+SUFFIX = '.cold'
+MANIFEST = 'manifest.json'
+LOCK = '.lock'
+SEGMENT_ROWS = 100000
+DELETE_BATCH_SIZE = 500
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+INT_COLUMNS = ['id', 'sequence', 'timestamp', 'tenant_id', 'user_id', 'target_type_id', 'target_id']
+FIELDS = INT_COLUMNS + ['action', 'event_id', 'metadata', 'digest']
+
+def to_micros(value):
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+def from_micros(value):
+    return EPOCH + datetime.timedelta(microseconds=value)
+
+def _int_array(values):
+    column = array.array('q', values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+def _read_int_array(data):
+    column = array.array('q')
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+def _encode_column(kind, values):
+    if kind == b'q':
+        return _int_array(-1 if value is None else value for value in values)
+    if kind == b'd':
+        dictionary = sorted(set(values))
+        codes = {value: code for code, value in enumerate(dictionary)}
+        header = json.dumps(dictionary).encode()
+        return struct.pack('<I', len(header)) + header + _int_array(codes[value] for value in values)
+    if kind == b'u':
+        return b''.join(value.bytes if value is not None else bytes(16) for value in values)
+    if kind == b'h':
+        return b''.join(bytes.fromhex(value) if value is not None else bytes(32) for value in values)
+    # Line-delimited JSON; json.dumps escapes newlines inside values
+    return b'\n'.join(json.dumps(value, cls=DjangoJSONEncoder).encode() for value in values)
+
+def _decode_column(kind, data, rows):
+    if kind == b'q':
+        return [None if value == -1 else value for value in _read_int_array(data)]
+    if kind == b'd':
+        (length,) = struct.unpack_from('<I', data)
+        dictionary = json.loads(data[4:4 + length])
+        return [dictionary[code] for code in _read_int_array(data[4 + length:])]
+    if kind == b'u':
+        return [
+            None if data[i:i + 16] == bytes(16) else uuid.UUID(bytes=data[i:i + 16])
+            for i in range(0, rows * 16, 16)
+        ]
+    if kind == b'h':
+        return [
+            None if data[i:i + 32] == bytes(32) else data[i:i + 32].hex()
+            for i in range(0, rows * 32, 32)
+        ]
+    return [json.loads(line) for line in data.split(b'\n')] if rows else []
+
+COLUMN_KINDS = {name: b'q' for name in INT_COLUMNS}
+COLUMN_KINDS.update({'action': b'd', 'event_id': b'u', 'metadata': b'j', 'digest': b'h'})
+
+def write_segment(path, rows):
+    """
+    Write rows (dicts keyed by FIELDS, timestamps as microseconds) to an
+    immutable segment file; returns its manifest entry
+    """
+    blobs = []
+    for name in FIELDS:
+        data = zlib.compress(_encode_column(COLUMN_KINDS[name], [row[name] for row in rows]))
+        blobs.append((name, data))
+    offset = HEADER.size + COLUMN.size * len(blobs)
+    directory, body = [], []
+    for name, data in blobs:
+        directory.append(COLUMN.pack(name.encode(), COLUMN_KINDS[name], offset, len(data), zlib.crc32(data)))
+        body.append(data)
+        offset += len(data)
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as segment:
+        segment.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(blobs), len(rows)))
+        segment.write(b''.join(directory))
+        segment.write(b''.join(body))
+        segment.flush()
+        os.fsync(segment.fileno())
+    os.chmod(temp_path, 0o444)
+    os.replace(temp_path, path)
+
+    entry = {'name': os.path.basename(path), 'rows': len(rows), 'bytes': offset, 'min': {}, 'max': {}}
+    for name in INT_COLUMNS:
+        values = [row[name] for row in rows if row[name] is not None]
+        entry['min'][name] = min(values) if values else None
+        entry['max'][name] = max(values) if values else None
+    entry['actions'] = sorted({row['action'] for row in rows})
+    return entry
+
+class Segment:
+    """Read-only, memory-mapped view of a segment file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as segment:
+            self.map = mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.rows = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version not in READABLE_VERSIONS:
+            self.close()
+            raise ValueError(f"{path} is not an audit archive segment")
+        self.columns = {}
+        for i in range(count):
+            name, kind, offset, length, crc = COLUMN.unpack_from(self.map, HEADER.size + i * COLUMN.size)
+            self.columns[name.rstrip(b'\0').decode()] = (kind, offset, length, crc)
+        self._decoded = {}
+
+    def column(self, name):
+        """Decompressed values of one column, decoded once; None for a column the segment lacks"""
+        if name not in self.columns:
+            return [None] * self.rows
+        if name not in self._decoded:
+            kind, offset, length, crc = self.columns[name]
+            data = self.map[offset:offset + length]
+            if zlib.crc32(data) != crc:
+                raise ValueError(f"{self.path}: column {name} is corrupt")
+            self._decoded[name] = _decode_column(kind, zlib.decompress(data), self.rows)
+        return self._decoded[name]
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _overlaps(entry, column, low, high):
+    """Whether the segment's range of column can hold values in [low, high]"""
+    smallest, largest = entry['min'][column], entry['max'][column]
+    if smallest is None:
+        return False
+    return (low is None or largest >= low) and (high is None or smallest <= high)
+
+class ColdStore:
+    """Segment files and manifest in one directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def manifest(self):
+        try:
+            with open(self._path(MANIFEST)) as manifest:
+                return json.load(manifest)
+        except FileNotFoundError:
+            return {'version': FORMAT_VERSION, 'segments': []}
+
+    def _save_manifest(self, manifest):
+        path = self._path(MANIFEST)
+        with open(path + '.tmp', 'w') as temp:
+            json.dump(manifest, temp, indent=1)
+            temp.flush()
+            os.fsync(temp.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _lock(self):
+        """Exclusive lock held while compacting"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(self._path(LOCK), 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _delete_rows(self, entry, database):
+        with Segment(self._path(entry['name'])) as segment:
+            ids = segment.column('id')
+        # Audit rows own nothing, so skip the collector and its per-row delete signals
+        with transaction.atomic(using=database):
+            for start in range(0, len(ids), DELETE_BATCH_SIZE):
+                AuditLog._base_manager.using(database).filter(
+                    id__in=ids[start:start + DELETE_BATCH_SIZE]
+                )._raw_delete(database)
+
+    def recover(self, manifest):
+        """Finish a compaction that was interrupted"""
+        known = {entry['name'] for entry in manifest['segments']}
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX + '.tmp') or (name.endswith(SUFFIX) and name not in known):
+                os.remove(self._path(name))
+        for entry in manifest['segments']:
+            if not entry['deleted']:
+                self._delete_rows(entry, entry['database'])
+                entry['deleted'] = True
+                self._save_manifest(manifest)
+
+    def compact(self, before, database='default', segment_rows=SEGMENT_ROWS):
+        """
+        Move the longest checkpointed prefix of the chain logged before
+        `before` out of the database into new segments; returns their
+        manifest entries
+        """
+        from .chain import removable_prefix
+
+        created = []
+        with self._lock():
+            manifest = self.manifest()
+            self.recover(manifest)
+            last_sequence = removable_prefix(database, before)
+            queryset = AuditLog._base_manager.using(database).filter(
+                sequence__lte=last_sequence
+            ).order_by('sequence')
+            while True:
+                rows = list(queryset.values(*FIELDS)[:segment_rows])
+                if not rows:
+                    break
+                for row in rows:
+                    row['timestamp'] = to_micros(row['timestamp'])
+                name = f'{database}-{rows[0]["timestamp"]}-{rows[0]["id"]}{SUFFIX}'
+                entry = write_segment(self._path(name), rows)
+                entry.update(database=database, deleted=False)
+                manifest['segments'].append(entry)
+                self._save_manifest(manifest)
+
+                self._delete_rows(entry, database)
+                entry['deleted'] = True
+                self._save_manifest(manifest)
+                created.append(entry)
+                if len(rows) < segment_rows:
+                    break
+        return created
+
+    def candidates(self, start=None, end=None, tenant=None, user=None, action=None,
+                   target_type=None, target_id=None, database=None):
+        """Manifest entries of the segments that may hold matching rows"""
+        start = to_micros(start) if start is not None else None
+        # end is exclusive
+        end = to_micros(end) - 1 if end is not None else None
+        exact = {'tenant_id': tenant, 'user_id': user, 'target_type_id': target_type, 'target_id': target_id}
+        matches = []
+        for entry in self.manifest()['segments']:
+            if not entry['deleted'] or (database and entry['database'] != database):
+                continue
+            if not _overlaps(entry, 'timestamp', start, end):
+                continue
+            if any(value is not None and not _overlaps(entry, column, value, value)
+                   for column, value in exact.items()):
+                continue
+            if action is not None and action not in entry['actions']:
+                continue
+            matches.append(entry)
+        return matches
+
+    def query(self, start=None, end=None, tenant=None, user=None, action=None,
+              target_type=None, target_id=None, database=None):
+        """
+        Archived entries matching every given filter, in chain order within
+        a segment, as dicts. target_type is a ContentType id; end is
+        exclusive.
+        """
+        filters = {
+            'tenant_id': tenant, 'user_id': user, 'action': action,
+            'target_type_id': target_type, 'target_id': target_id,
+        }
+        filters = {name: value for name, value in filters.items() if value is not None}
+        low = to_micros(start) if start is not None else None
+        high = to_micros(end) if end is not None else None
+        for entry in self.candidates(start, end, tenant, user, action, target_type, target_id, database):
+            with Segment(self._path(entry['name'])) as segment:
+                timestamps = segment.column('timestamp')
+                rows = [
+                    i for i in range(segment.rows)
+                    if (low is None or timestamps[i] >= low) and (high is None or timestamps[i] < high)
+                ]
+                for name, value in filters.items():
+                    column = segment.column(name)
+                    rows = [i for i in rows if column[i] == value]
+                if not rows:
+                    continue
+                columns = {name: segment.column(name) for name in FIELDS}
+                for i in rows:
+                    content_type = ContentType.objects.get_for_id(columns['target_type_id'][i])
+                    yield {
+                        'id': columns['id'][i],
+                        'sequence': columns['sequence'][i],
+                        'timestamp': from_micros(columns['timestamp'][i]),
+                        'tenant': columns['tenant_id'][i],
+                        'user': columns['user_id'][i],
+                        'action': columns['action'][i],
+                        'target_type': f'{content_type.app_label}.{content_type.model}',
+                        'target_id': columns['target_id'][i],
+                        'event_id': columns['event_id'][i],
+                        'metadata': columns['metadata'][i],
+                        'digest': columns['digest'][i],
+                    }
+
+    def chain_segments(self, database):
+        """Manifest entries of a database's segments, in sequence order"""
+        entries = [
+            entry for entry in self.manifest()['segments']
+            if entry['deleted'] and entry['database'] == database
+        ]
+        return sorted(entries, key=lambda entry: entry['min'].get('sequence') or 0)
+
+    def chain_rows(self, entries):
+        """(id, sequence, event_id, ..., metadata, digest) rows of segments, as chained"""
+        names = ['id', 'sequence', 'event_id', 'tenant_id', 'user_id', 'action',
+                 'target_type_id', 'target_id', 'timestamp', 'metadata', 'digest']
+        for entry in entries:
+            with Segment(self._path(entry['name'])) as segment:
+                columns = [segment.column(name) for name in names]
+                timestamps = columns[names.index('timestamp')]
+                columns[names.index('timestamp')] = [from_micros(value) for value in timestamps]
+                yield from zip(*columns)
+
+def get_cold_store():
+    return ColdStore(getattr(settings, 'AUDIT_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'var', 'audit-archive')))
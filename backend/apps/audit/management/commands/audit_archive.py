@@ -0,0 +1,72 @@
+# apps/audit/management/commands/audit_archive.py
+
+import datetime
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from apps.audit.cold import get_cold_store, from_micros
+from apps.audit.query import get_target_type, parse_time
+
+class Command(BaseCommand):
+    help = 'Compact old audit entries into columnar cold storage, list segments or query them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['compact', 'list', 'query'])
+        parser.add_argument('--older-than-months', type=int,
+                            default=getattr(settings, 'AUDIT_ARCHIVE_AFTER_MONTHS', 12),
+                            help='Compact entries logged before the start of the month this many months ago')
+        parser.add_argument('--segment-rows', type=int,
+                            default=getattr(settings, 'AUDIT_ARCHIVE_SEGMENT_ROWS', 100000))
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--since', help='Query: first instant, ISO date or datetime')
+        parser.add_argument('--until', help='Query: end instant (excluded)')
+        parser.add_argument('--tenant', type=int)
+        parser.add_argument('--user', type=int)
+        parser.add_argument('--action-name', dest='action_name')
+        parser.add_argument('--target-type', help="Query: 'app_label.model' or content type id")
+        parser.add_argument('--target-id', type=int)
+
+    def handle(self, *args, **options):
+        store = get_cold_store()
+        action = options['action']
+        if action == 'compact':
+            self.compact(store, options)
+        elif action == 'list':
+            for entry in store.manifest()['segments']:
+                first, last = (from_micros(entry[bound]['timestamp']) for bound in ('min', 'max'))
+                self.stdout.write(
+                    f"{entry['name']}  {entry['database']}  {entry['rows']} rows  "
+                    f"{entry['bytes']} bytes  {first:%Y-%m-%d} .. {last:%Y-%m-%d}"
+                )
+        else:
+            self.query(store, options)
+
+    def compact(self, store, options):
+        now = timezone.now()
+        months = now.year * 12 + now.month - 1 - options['older_than_months']
+        before = datetime.datetime(months // 12, months % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+        created = store.compact(before, options['database'], options['segment_rows'])
+        for entry in created:
+            self.stdout.write(f"Wrote {entry['name']} ({entry['rows']} rows)")
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {sum(entry['rows'] for entry in created)} entries logged before {before:%Y-%m-%d}"
+        ))
+
+    def query(self, store, options):
+        try:
+            start = parse_time(options['since'], 'since') if options['since'] else None
+            end = parse_time(options['until'], 'until') if options['until'] else None
+            target_type = get_target_type(options['target_type']).pk if options['target_type'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        rows = store.query(
+            start=start, end=end, tenant=options['tenant'], user=options['user'],
+            action=options['action_name'], target_type=target_type, target_id=options['target_id'],
+            database=options['database'],
+        )
+        for row in rows:
+            self.stdout.write(json.dumps(row, cls=DjangoJSONEncoder))
@@ -0,0 +1,50 @@
+# apps/audit/management/commands/audit_chain.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.audit.chain import run_sealer, seal, verify, verify_archive, SEAL_INTERVAL
+from apps.audit.cold import get_cold_store
+
+class Command(BaseCommand):
+    help = 'Seal new audit entries into the hash chain, or verify the chain'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['seal', 'verify'])
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--full', action='store_true',
+                            help='Verify every live entry, not only those after the last verified checkpoint')
+        parser.add_argument('--archive', action='store_true',
+                            help='Verify the entries compacted into cold storage instead')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep running and seal new entries as they are written')
+        parser.add_argument('--interval', type=float, default=SEAL_INTERVAL,
+                            help='Seconds between sealing passes in watch mode')
+
+    def handle(self, *args, **options):
+        database = options['database']
+        if options['action'] == 'seal':
+            if options['watch']:
+                self.stdout.write(f"Sealing new audit entries every {options['interval']}s")
+                try:
+                    run_sealer(database, interval=options['interval'])
+                except KeyboardInterrupt:
+                    pass
+                return
+            self.stdout.write(self.style.SUCCESS(f'Sealed {seal(database)} entries'))
+            return
+
+        if options['archive']:
+            result = verify_archive(get_cold_store(), database)
+        else:
+            result = verify(database, full=options['full'])
+        self.stdout.write(
+            f"Checked {result['entries']} entries and {result['blocks']} blocks up to sequence "
+            f"{result['last_sequence']} in {result['seconds']}s ({result['entries_per_second']} entries/s)"
+        )
+        broken = result['broken']
+        if broken:
+            entry = f" (entry id {broken['id']})" if broken['id'] else ''
+            if broken['sequence'] is None:
+                raise CommandError(broken['reason'])
+            raise CommandError(f"First broken link at sequence {broken['sequence']}{entry}: {broken['reason']}")
+        self.stdout.write(self.style.SUCCESS('Audit chain intact'))
@@ -0,0 +1,87 @@
+# apps/audit/management/commands/audit_partitions.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.audit.partitions import get_partitions, month_start, next_month, parse_month
+
+class Command(BaseCommand):
+    help = (
+        'Create, list, detach and archive the monthly partitions of the audit log. '
+        'SQLite has no partitioning: the live table stays whole, ensure creates nothing '
+        'and detach moves a month\'s rows into a table of their own.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'ensure', 'detach', 'archive', 'drop'])
+        parser.add_argument('--months-ahead', type=int, default=3,
+                            help='Future months to create partitions for (ensure)')
+        parser.add_argument('--month', help='Single month to act on, as YYYY-MM')
+        parser.add_argument('--before', help='Act on every month before this one, as YYYY-MM')
+        parser.add_argument('--archive-dir',
+                            help='Directory for gzipped CSV archives (archive, or detach then archive)')
+
+    def handle(self, *args, **options):
+        partitions = get_partitions()
+        action = options['action']
+        if not partitions.partitioned:
+            self.stdout.write(self.style.WARNING(
+                f'{partitions.connection.vendor} has no table partitioning: months listed '
+                f'as attached are ranges of the live table, and detach moves their rows out'
+            ))
+        try:
+            if action == 'list':
+                self.list(partitions)
+            elif action == 'ensure':
+                self.ensure(partitions, options['months_ahead'])
+            else:
+                months = self.selected_months(partitions, action, options)
+                if not months:
+                    self.stdout.write('No partitions selected')
+                for month in months:
+                    self.apply(partitions, action, month, options['archive_dir'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def list(self, partitions):
+        for name, month, detached in partitions.partitions():
+            state = 'detached' if detached else 'attached'
+            self.stdout.write(f'{name}  {month:%Y-%m}  {state}')
+
+    def ensure(self, partitions, months_ahead):
+        month = month_start(timezone.now())
+        months = [month]
+        for _ in range(months_ahead):
+            month = next_month(month)
+            months.append(month)
+        created = partitions.ensure(months)
+        for name in created:
+            self.stdout.write(f'Created {name}')
+        self.stdout.write(self.style.SUCCESS(f'{len(created)} partitions created'))
+
+    def selected_months(self, partitions, action, options):
+        if options['month']:
+            return [parse_month(options['month'])]
+        if not options['before']:
+            raise CommandError('Give --month or --before')
+        before = parse_month(options['before'])
+        # detach acts on live months, archive and drop on detached ones
+        detached = action != 'detach'
+        return sorted({
+            month for _, month, is_detached in partitions.partitions()
+            if month < before and is_detached == detached
+        })
+
+    def apply(self, partitions, action, month, archive_dir):
+        if action == 'detach':
+            name = partitions.detach(month)
+            self.stdout.write(f'Detached {name}')
+            if archive_dir:
+                self.stdout.write(f'Archived {name} to {partitions.archive(month, archive_dir)}')
+        elif action == 'archive':
+            if not archive_dir:
+                raise CommandError('archive needs --archive-dir')
+            self.stdout.write(f'Archived {month:%Y-%m} to {partitions.archive(month, archive_dir)}')
+        elif action == 'drop':
+            partitions.drop(month)
+            self.stdout.write(f'Dropped {month:%Y-%m}')
@@ -0,0 +1,61 @@
+# apps/audit/management/commands/audit_rollups.py
+
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from apps.audit.rollups import backfill, live_days, reconcile
+from apps.tenants.routers import get_shard_aliases
+
+class Command(BaseCommand):
+    help = 'Rebuild the audit rollup counters from the audit log, or check them against it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['backfill', 'reconcile'])
+        parser.add_argument('--since', help='First day, YYYY-MM-DD (backfill: first day with entries)')
+        parser.add_argument('--until', help='Last day, YYYY-MM-DD (default: today)')
+        parser.add_argument('--days', type=int, default=7,
+                            help='Reconcile: days back from --until to check when --since is not given')
+        parser.add_argument('--fix', action='store_true',
+                            help='Reconcile: rebuild the days that disagree')
+
+    def parse_day(self, value, name):
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f'{name} must be a date as YYYY-MM-DD')
+        return day
+
+    def handle(self, *args, **options):
+        databases = get_shard_aliases()
+        end = self.parse_day(options['until'], '--until') if options['until'] else timezone.localdate()
+        if options['since']:
+            start = self.parse_day(options['since'], '--since')
+        elif options['action'] == 'backfill':
+            bounds = live_days(databases)
+            if bounds is None:
+                self.stdout.write('No audit entries to count')
+                return
+            start = bounds[0]
+        else:
+            start = end - datetime.timedelta(days=options['days'] - 1)
+
+        if options['action'] == 'backfill':
+            written = backfill(start, end, databases)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup rows for {start} .. {end}'))
+            return
+
+        mismatches = reconcile(start, end, databases)
+        for (tenant_id, day, action, user_id), live, stored in mismatches:
+            self.stdout.write(
+                f'{day} tenant={tenant_id} user={user_id} {action}: log has {live}, rollup has {stored}'
+            )
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS(f'Rollups match the audit log for {start} .. {end}'))
+            return
+        if not options['fix']:
+            raise CommandError(f'{len(mismatches)} rollup counts disagree with the audit log')
+        for day in sorted({key[1] for key, _, _ in mismatches}):
+            backfill(day, day, databases)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len({key[1] for key, _, _ in mismatches})} days'))
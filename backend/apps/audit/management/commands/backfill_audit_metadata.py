@@ -0,0 +1,29 @@
+# apps/audit/management/commands/backfill_audit_metadata.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.audit.metadata import BACKFILL_BATCH_SIZE, backfill_promoted, promoted_keys
+from apps.audit.models import AuditLog
+from apps.tenants.routers import get_shard_aliases
+
+class Command(BaseCommand):
+    help = 'Fill the promoted metadata columns of audit entries written before they existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help='Only this database (default: every shard)')
+        parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE,
+                            help='Rows updated per transaction')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        keys = promoted_keys()
+        if not keys:
+            self.stdout.write('No metadata keys are promoted (AUDIT_PROMOTED_METADATA)')
+            return
+        databases = [options['database']] if options['database'] else get_shard_aliases()
+        for database in databases:
+            updated = backfill_promoted(AuditLog, options['batch_size'], using=database)
+            self.stdout.write(self.style.SUCCESS(
+                f"Filled {', '.join(keys)} for {updated} entries in {database}"
+            ))
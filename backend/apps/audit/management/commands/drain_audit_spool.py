@@ -0,0 +1,25 @@
+# apps/audit/management/commands/drain_audit_spool.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.audit.rollups import record_entries
+from apps.audit.writer import AuditWriter, BATCH_SIZE, get_spool
+
+class Command(BaseCommand):
+    help = 'Load audit entries left in the spool by stopped or crashed workers into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Entries inserted per batch')
+
+    def handle(self, *args, **options):
+        spool = get_spool()
+        if spool is None:
+            raise CommandError('AUDIT_SPOOL_DIR is not set')
+        # Counted in the rollups like entries the workers load themselves
+        writer = AuditWriter(batch_size=options['batch_size'], spool=spool, on_write=record_entries)
+        try:
+            drained = spool.drain(writer.load_payloads, options['batch_size'], force_orphans=True)
+        finally:
+            spool.close()
+        self.stdout.write(self.style.SUCCESS(f'Loaded {drained} spooled audit entries'))
@@ -0,0 +1,84 @@
+# apps/audit/metadata.py
+
+"""
+Metadata keys promoted into indexed AuditLog columns.
+
+Filtering on a JSON key scans every row. The keys investigations filter
+on most are copied into their own columns when an entry is written, each
+with a partial index ending in (timestamp, id) for keyset pages. Which
+keys are promoted is set by AUDIT_PROMOTED_METADATA, out of those that
+have a column in PROMOTED_COLUMNS; a new key needs a column, a migration
+and a run of `manage.py backfill_audit_metadata` for older rows.
+
+filter_metadata() uses the column for a promoted key and falls back to a
+JSON lookup for any other, so callers filter the same way either way.
+"""
+
+from django.conf import settings
+from django.db.models import Q
+
+# metadata key -> AuditLog column
+PROMOTED_COLUMNS = {
+    'target_user': 'meta_target_user',
+    'ip_address': 'meta_ip_address',
+    'name': 'meta_name',
+}
+BACKFILL_BATCH_SIZE = 5000
+
+def promoted_keys():
+    """Promoted metadata keys, in PROMOTED_COLUMNS order"""
+    enabled = set(getattr(settings, 'AUDIT_PROMOTED_METADATA', PROMOTED_COLUMNS))
+    return [key for key in PROMOTED_COLUMNS if key in enabled]
+
+def _column_value(entry, column, value):
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    max_length = entry._meta.get_field(column).max_length
+    return str(value)[:max_length]
+
+def promote_metadata(entry):
+    """Copy the promoted keys of entry.metadata into their columns"""
+    metadata = entry.metadata if isinstance(entry.metadata, dict) else {}
+    for key in promoted_keys():
+        column = PROMOTED_COLUMNS[key]
+        setattr(entry, column, _column_value(entry, column, metadata.get(key)))
+    return entry
+
+def filter_metadata(queryset, key, value):
+    """
+    Entries whose metadata[key] equals value, through the column when the
+    key is promoted
+    """
+    if key in promoted_keys():
+        return queryset.filter(**{PROMOTED_COLUMNS[key]: value})
+    # The trailing __exact keeps a key named like a lookup ('contains') a key
+    return queryset.filter(**{f'metadata__{key}__exact': value})
+
+def backfill_promoted(model, batch_size=BACKFILL_BATCH_SIZE, using=None):
+    """
+    Fill promoted columns of existing rows in id order, one transaction
+    per batch; returns how many rows were updated. Safe to rerun.
+    """
+    from django.db import transaction
+
+    keys = promoted_keys()
+    if not keys:
+        return 0
+    missing = Q()
+    for key in keys:
+        missing |= Q(metadata__has_key=key, **{f'{PROMOTED_COLUMNS[key]}__isnull': True})
+    manager = model._base_manager.db_manager(using)
+    columns = [PROMOTED_COLUMNS[key] for key in keys]
+    updated, last_id = 0, 0
+    while True:
+        rows = list(
+            manager.filter(missing, id__gt=last_id).order_by('id').only('id', 'metadata')[:batch_size]
+        )
+        if not rows:
+            return updated
+        for row in rows:
+            promote_metadata(row)
+        with transaction.atomic(using=manager.db):
+            manager.bulk_update(rows, columns, batch_size=1000)
+        updated += len(rows)
+        last_id = rows[-1].id
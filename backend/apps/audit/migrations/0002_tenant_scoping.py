@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0001_initial"),
+        ("audit", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="auditlog",
+            options={
+                "base_manager_name": "all_objects",
+                "default_manager_name": "objects",
+                "ordering": ["-timestamp"],
+            },
+        ),
+        migrations.AlterModelManagers(
+            name="auditlog",
+            managers=[
+                ("objects", django.db.models.manager.Manager()),
+                ("all_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="auditlog",
+            name="tenant",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Leave blank for global data",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="tenants.tenant",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["tenant", "timestamp"], name="auditlog_tenant_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["tenant", "user", "timestamp"],
+                name="auditlog_tenant_user_time_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:02
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0003_timestamp_default"),
+    ]
+
+    operations = [
+        # Existing rows keep a NULL event id; only new entries get one
+        migrations.AddField(
+            model_name="auditlog",
+            name="event_id",
+            field=models.UUIDField(editable=False, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="auditlog",
+            name="event_id",
+            field=models.UUIDField(
+                default=uuid.uuid4, editable=False, null=True, unique=True
+            ),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:19
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0004_event_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RequestLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("timestamp", models.DateTimeField(default=django.utils.timezone.now)),
+                ("tenant_id", models.PositiveIntegerField(blank=True, null=True)),
+                ("user_id", models.PositiveIntegerField(blank=True, null=True)),
+                ("method", models.CharField(max_length=8)),
+                ("path", models.CharField(max_length=255)),
+                ("status", models.PositiveSmallIntegerField()),
+                ("latency_ms", models.FloatField()),
+                ("ip_address", models.GenericIPAddressField(blank=True, null=True)),
+                ("sample_rate", models.FloatField(default=1.0)),
+            ],
+            options={
+                "ordering": ["-timestamp"],
+                "indexes": [
+                    models.Index(fields=["timestamp"], name="requestlog_time_idx")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:22
+
+import datetime
+
+from django.db import migrations, models
+
+# Months created ahead of the current one; later ones come from
+# `manage.py audit_partitions ensure`
+MONTHS_AHEAD = 3
+
+
+def partition_auditlog(apps, schema_editor):
+    """
+    Rebuild audit_auditlog as a table partitioned by month on PostgreSQL.
+    Other databases keep the plain table (see apps.audit.partitions).
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    from apps.audit.partitions import months_between, next_month, partition_name
+
+    AuditLog = apps.get_model("audit", "AuditLog")
+    execute = schema_editor.execute
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MIN("timestamp"), MAX("timestamp") FROM audit_auditlog')
+        oldest, newest = cursor.fetchone()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    start = min(oldest or now, now)
+    end = max(newest or now, now)
+    for _ in range(MONTHS_AHEAD + 1):
+        end = next_month(datetime.datetime(end.year, end.month, 1, tzinfo=datetime.timezone.utc))
+
+    execute("ALTER TABLE audit_auditlog RENAME TO audit_auditlog_unpartitioned")
+    execute(
+        "CREATE TABLE audit_auditlog (LIKE audit_auditlog_unpartitioned "
+        'INCLUDING DEFAULTS INCLUDING IDENTITY) PARTITION BY RANGE ("timestamp")'
+    )
+    execute("CREATE TABLE audit_auditlog_default PARTITION OF audit_auditlog DEFAULT")
+    for month in months_between(start, end):
+        execute(
+            f"CREATE TABLE {partition_name(month)} PARTITION OF audit_auditlog "
+            "FOR VALUES FROM (%s) TO (%s)",
+            [month, next_month(month)],
+        )
+    execute("INSERT INTO audit_auditlog SELECT * FROM audit_auditlog_unpartitioned")
+    execute(
+        "SELECT setval(pg_get_serial_sequence('audit_auditlog', 'id'), "
+        "COALESCE((SELECT MAX(id) FROM audit_auditlog), 0) + 1, false)"
+    )
+    execute("DROP TABLE audit_auditlog_unpartitioned")
+
+    # Unique constraints on a partitioned table must include the partition key
+    execute(
+        "ALTER TABLE audit_auditlog ADD CONSTRAINT audit_auditlog_pkey "
+        'PRIMARY KEY (id, "timestamp")'
+    )
+    execute(
+        "ALTER TABLE audit_auditlog ADD CONSTRAINT audit_auditlog_event_id_key "
+        'UNIQUE (event_id, "timestamp")'
+    )
+    for field in AuditLog._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            execute(
+                schema_editor._create_fk_sql(
+                    AuditLog, field, "_fk_%(to_table)s_%(to_column)s"
+                )
+            )
+    for statement in schema_editor._model_indexes_sql(AuditLog):
+        execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0005_request_log"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(fields=["timestamp"], name="auditlog_time_idx"),
+        ),
+        migrations.RunPython(partition_auditlog, migrations.RunPython.noop),
+    ]
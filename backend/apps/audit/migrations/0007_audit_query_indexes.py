@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0006_partition_auditlog"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["user", "timestamp", "id"], name="auditlog_user_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["target_type", "target_id", "timestamp", "id"],
+                name="auditlog_target_time_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(
+                fields=["action", "timestamp", "id"], name="auditlog_action_time_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0007_audit_query_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuditRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("tenant_id", models.PositiveIntegerField(default=0)),
+                ("day", models.DateField()),
+                ("action", models.CharField(max_length=100)),
+                ("user_id", models.PositiveIntegerField(default=0)),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "ordering": ["-day"],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="auditrollup",
+            constraint=models.UniqueConstraint(
+                fields=("tenant_id", "day", "action", "user_id"), name="auditrollup_key"
+            ),
+        ),
+    ]
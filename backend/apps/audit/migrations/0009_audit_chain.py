@@ -0,0 +1,68 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0008_audit_rollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuditCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("database", models.CharField(default="default", max_length=100)),
+                ("block", models.PositiveIntegerField()),
+                ("first_sequence", models.BigIntegerField()),
+                ("last_sequence", models.BigIntegerField()),
+                ("root", models.CharField(max_length=64)),
+                ("head", models.CharField(max_length=64)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("verified_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["database", "block"],
+            },
+        ),
+        migrations.AddField(
+            model_name="auditlog",
+            name="digest",
+            field=models.CharField(
+                blank=True, editable=False, max_length=64, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="auditlog",
+            name="sequence",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(fields=["sequence"], name="auditlog_sequence_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(
+                condition=models.Q(("sequence__isnull", True)),
+                fields=["id"],
+                name="auditlog_unsealed_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="auditcheckpoint",
+            constraint=models.UniqueConstraint(
+                fields=("database", "block"), name="auditcheckpoint_block"
+            ),
+        ),
+    ]
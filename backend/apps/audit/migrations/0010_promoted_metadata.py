@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0009_audit_chain"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="auditlog",
+            name="meta_ip_address",
+            field=models.CharField(
+                blank=True, editable=False, max_length=45, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="auditlog",
+            name="meta_name",
+            field=models.CharField(
+                blank=True, editable=False, max_length=255, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="auditlog",
+            name="meta_target_user",
+            field=models.CharField(
+                blank=True, editable=False, max_length=150, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(
+                condition=models.Q(("meta_target_user__isnull", False)),
+                fields=["meta_target_user", "timestamp", "id"],
+                name="auditlog_meta_target_user_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(
+                condition=models.Q(("meta_ip_address__isnull", False)),
+                fields=["meta_ip_address", "timestamp", "id"],
+                name="auditlog_meta_ip_address_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="auditlog",
+            index=models.Index(
+                condition=models.Q(("meta_name__isnull", False)),
+                fields=["meta_name", "timestamp", "id"],
+                name="auditlog_meta_name_idx",
+            ),
+        ),
+    ]
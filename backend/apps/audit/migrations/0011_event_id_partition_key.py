@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:52
+
+from django.db import migrations, models
+import uuid
+
+
+class UnlessPartitioned(migrations.SeparateDatabaseAndState):
+    """
+    Always a state change; a schema change only where 0006 did not
+    already make it (PostgreSQL, where the table is partitioned)
+    """
+
+    def __init__(self, operation):
+        super().__init__(database_operations=[operation], state_operations=[operation])
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audit", "0010_promoted_metadata"),
+    ]
+
+    operations = [
+        UnlessPartitioned(
+            migrations.AlterField(
+                model_name="auditlog",
+                name="event_id",
+                field=models.UUIDField(default=uuid.uuid4, editable=False, null=True),
+            )
+        ),
+        UnlessPartitioned(
+            migrations.AddConstraint(
+                model_name="auditlog",
+                constraint=models.UniqueConstraint(
+                    fields=("event_id", "timestamp"), name="audit_auditlog_event_id_key"
+                ),
+            )
+        ),
+    ]
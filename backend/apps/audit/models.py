@@ -1,18 +1,162 @@
 # apps/audit/models.py
 
+import uuid
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
-class AuditLog(models.Model):
+from apps.tenants.models import TenantAwareModel, TenantManager
+from .metadata import promote_metadata
+
+class AuditLogQuerySet(models.QuerySet):
+    def between(self, start=None, end=None):
+        """
+        Entries logged in [start, end). Bounding timestamp lets PostgreSQL
+        skip the monthly partitions outside the range.
+        """
+        queryset = self
+        if start is not None:
+            queryset = queryset.filter(timestamp__gte=start)
+        if end is not None:
+            queryset = queryset.filter(timestamp__lt=end)
+        return queryset
+
+    def in_month(self, year, month):
+        from .partitions import month_range
+        return self.between(*month_range(year, month))
+
+class AuditLog(TenantAwareModel):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     action = models.CharField(max_length=100)
     target_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     target_id = models.PositiveIntegerField()
     target = GenericForeignKey('target_type', 'target_id')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the entry is logged, not when the buffered row is inserted
+    timestamp = models.DateTimeField(default=timezone.now)
     metadata = models.JSONField(null=True, blank=True)
+    # Lets spooled entries be loaded more than once without duplicates.
+    # Unique together with timestamp (see Meta.constraints)
+    event_id = models.UUIDField(default=uuid.uuid4, null=True, editable=False)
+    # Position in the hash chain and the chained digest, set by the sealer
+    # (apps.audit.chain) once the entry is committed
+    sequence = models.BigIntegerField(null=True, blank=True, editable=False)
+    digest = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    # Copies of frequently filtered metadata keys (apps.audit.metadata)
+    meta_target_user = models.CharField(max_length=150, null=True, blank=True, editable=False)
+    meta_ip_address = models.CharField(max_length=45, null=True, blank=True, editable=False)
+    meta_name = models.CharField(max_length=255, null=True, blank=True, editable=False)
+
+    # Entries without a tenant are system events, not shared data
+    objects = TenantManager.from_queryset(AuditLogQuerySet)(include_global=False)
+    all_objects = models.Manager.from_queryset(AuditLogQuerySet)()
+
+    class Meta(TenantAwareModel.Meta):
+        ordering = ['-timestamp']
+        # On PostgreSQL the table is partitioned by timestamp, and a unique
+        # key there has to include it: the primary key is (id, timestamp)
+        # and event_id is unique per timestamp. id stays unique through its
+        # sequence. A spooled entry keeps the timestamp it was logged with,
+        # so loading it again still conflicts, and the writer skips event
+        # ids already loaded before inserting.
+        constraints = [
+            models.UniqueConstraint(fields=['event_id', 'timestamp'], name='audit_auditlog_event_id_key'),
+        ]
+        indexes = [
+            models.Index(fields=['timestamp'], name='auditlog_time_idx'),
+            models.Index(fields=['tenant', 'timestamp'], name='auditlog_tenant_time_idx'),
+            models.Index(fields=['tenant', 'user', 'timestamp'], name='auditlog_tenant_user_time_idx'),
+            # Back the audit API filters; id breaks timestamp ties for keyset pages
+            models.Index(fields=['user', 'timestamp', 'id'], name='auditlog_user_time_idx'),
+            models.Index(fields=['target_type', 'target_id', 'timestamp', 'id'], name='auditlog_target_time_idx'),
+            models.Index(fields=['action', 'timestamp', 'id'], name='auditlog_action_time_idx'),
+            # Not unique: a unique index on a partitioned table would have to
+            # include timestamp. The sealer hands out sequences under a lock
+            models.Index(fields=['sequence'], name='auditlog_sequence_idx'),
+            models.Index(fields=['id'], condition=models.Q(sequence__isnull=True), name='auditlog_unsealed_idx'),
+            models.Index(fields=['meta_target_user', 'timestamp', 'id'], name='auditlog_meta_target_user_idx',
+                         condition=models.Q(meta_target_user__isnull=False)),
+            models.Index(fields=['meta_ip_address', 'timestamp', 'id'], name='auditlog_meta_ip_address_idx',
+                         condition=models.Q(meta_ip_address__isnull=False)),
+            models.Index(fields=['meta_name', 'timestamp', 'id'], name='auditlog_meta_name_idx',
+                         condition=models.Q(meta_name__isnull=False)),
+        ]
+
+    def save(self, *args, **kwargs):
+        # bulk_create skips this; the audit writer's callers promote first
+        promote_metadata(self)
+        super().save(*args, **kwargs)
+
+class AuditRollup(models.Model):
+    """
+    Audit entries per tenant, day, action and user, kept current by the
+    audit writer so dashboards read counts instead of grouping AuditLog.
+    0 stands for no tenant or no user, keeping the key free of NULLs so it
+    can be upserted.
+    """
+    tenant_id = models.PositiveIntegerField(default=0)
+    day = models.DateField()
+    action = models.CharField(max_length=100)
+    user_id = models.PositiveIntegerField(default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            # Also serves queries by tenant and day range
+            models.UniqueConstraint(fields=['tenant_id', 'day', 'action', 'user_id'], name='auditrollup_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.day} {self.action} x{self.count}'
+
+class AuditCheckpoint(models.Model):
+    """
+    Merkle root over one fixed-size block of the audit hash chain of a
+    database, and when the block was last verified
+    """
+    database = models.CharField(max_length=100, default='default')
+    block = models.PositiveIntegerField()
+    first_sequence = models.BigIntegerField()
+    last_sequence = models.BigIntegerField()
+    root = models.CharField(max_length=64)
+    # Digest of the block's last entry, where the next block's chain starts
+    head = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+    verified_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['database', 'block']
+        constraints = [
+            models.UniqueConstraint(fields=['database', 'block'], name='auditcheckpoint_block'),
+        ]
+
+    def __str__(self):
+        return f'{self.database} block {self.block}'
+
+class RequestLog(models.Model):
+    """
+    One sampled HTTP request. Append-only and kept narrow: no foreign keys
+    to check on insert and a single index, so batches insert cheaply.
+    """
+    timestamp = models.DateTimeField(default=timezone.now)
+    tenant_id = models.PositiveIntegerField(null=True, blank=True)
+    user_id = models.PositiveIntegerField(null=True, blank=True)
+    method = models.CharField(max_length=8)
+    path = models.CharField(max_length=255)
+    status = models.PositiveSmallIntegerField()
+    latency_ms = models.FloatField()
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    # Rate the request was sampled at; 1 / sample_rate requests are behind each row
+    sample_rate = models.FloatField(default=1.0)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='requestlog_time_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.method} {self.path} {self.status}'
@@ -0,0 +1,246 @@
+# apps/audit/partitions.py
+
+"""
+Monthly partitions of the audit log.
+
+On PostgreSQL audit_auditlog is a table partitioned by RANGE (timestamp),
+with one partition per month named audit_auditlog_pYYYY_MM and a default
+partition catching anything outside them. Queries that bound timestamp
+(AuditLog.objects.between(), the admin date hierarchy) only scan the
+matching months. A month is retired by detaching its partition, which is
+a catalogue change rather than a delete. Only months whose entries are
+sealed into the hash chain ahead of every entry that stays can be
+detached (apps.audit.chain.check_removable), so the live chain keeps no
+holes.
+
+SQLite has no partitioning, so the live table stays whole and is indexed
+on timestamp for range scans. Detaching a month there moves its rows
+into a table of their own with one INSERT ... SELECT and one range
+DELETE. Either way a detached month is an ordinary table that can be
+archived to a gzipped CSV file and dropped as a whole.
+"""
+
+import abc
+import csv
+import datetime
+import gzip
+import os
+import re
+
+from django.db import connection as default_connection, transaction
+from django.utils import timezone
+
+TABLE = 'audit_auditlog'
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{TABLE}_p(\d{{4}})_(\d{{2}})$')
+ARCHIVE_CHUNK_SIZE = 5000
+
+def month_start(value):
+    """First instant of the month holding value, in UTC"""
+    value = value.astimezone(datetime.timezone.utc) if timezone.is_aware(value) else value
+    return datetime.datetime(value.year, value.month, 1, tzinfo=datetime.timezone.utc)
+
+def next_month(start):
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+def month_range(year, month):
+    """(start, end) of a calendar month, end excluded"""
+    start = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+    return start, next_month(start)
+
+def months_between(start, end):
+    """Start of every month overlapping [start, end)"""
+    months = []
+    current = month_start(start)
+    while current < end:
+        months.append(current)
+        current = next_month(current)
+    return months
+
+def partition_name(month):
+    return f'{TABLE}_p{month.year:04d}_{month.month:02d}'
+
+def parse_month(value):
+    """Turn 'YYYY-MM' into the start of that month"""
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        return month_range(year, month)[0]
+    except ValueError:
+        raise ValueError(f"Expected a month as YYYY-MM, got {value!r}")
+
+class BasePartitions(abc.ABC):
+    """Partition maintenance for one database connection"""
+
+    # Whether the live table is split into monthly partitions
+    partitioned = True
+
+    def __init__(self, connection=None):
+        self.connection = connection or default_connection
+
+    def _params(self, start, end):
+        ops = self.connection.ops
+        return [ops.adapt_datetimefield_value(start), ops.adapt_datetimefield_value(end)]
+
+    def table_exists(self, name):
+        with self.connection.cursor() as cursor:
+            return name in self.connection.introspection.table_names(cursor)
+
+    def ensure(self, months):
+        """Create partitions for the given months; returns the names created"""
+        return []
+
+    @abc.abstractmethod
+    def partitions(self):
+        """[(name, month start or None, detached)] known to the database"""
+
+    @abc.abstractmethod
+    def detach(self, month):
+        """Take a month out of the live table; returns the table now holding it"""
+
+    def check_detachable(self, month):
+        """ValueError unless taking the month out keeps the audit chain whole"""
+        from .chain import check_removable
+
+        try:
+            check_removable(month, next_month(month), self.connection.alias)
+        except ValueError as e:
+            raise ValueError(f"Cannot detach {partition_name(month)}: {e}")
+
+    def archive(self, month, directory):
+        """
+        Write a detached month to directory/<partition>.csv.gz and drop it.
+        Returns the path written.
+        """
+        name = partition_name(month)
+        if not self.table_exists(name):
+            raise ValueError(f"{name} is not a detached partition")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{name}.csv.gz')
+        quote = self.connection.ops.quote_name
+        with transaction.atomic(using=self.connection.alias):
+            with self.connection.cursor() as cursor, gzip.open(path, 'wt', newline='') as archive:
+                cursor.execute(f'SELECT * FROM {quote(name)} ORDER BY {quote("timestamp")}, {quote("id")}')
+                writer = csv.writer(archive)
+                writer.writerow([column[0] for column in cursor.description])
+                while True:
+                    rows = cursor.fetchmany(ARCHIVE_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    writer.writerows(rows)
+                cursor.execute(f'DROP TABLE {quote(name)}')
+        return path
+
+    def drop(self, month):
+        """Drop a detached month without archiving it"""
+        name = partition_name(month)
+        if not self.table_exists(name):
+            raise ValueError(f"{name} is not a detached partition")
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {self.connection.ops.quote_name(name)}')
+
+class PostgresPartitions(BasePartitions):
+    """Native declarative partitions"""
+
+    def _attached(self, cursor):
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [TABLE]
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    def ensure(self, months):
+        created = []
+        with transaction.atomic(using=self.connection.alias), self.connection.cursor() as cursor:
+            attached = self._attached(cursor)
+            for month in months:
+                name = partition_name(month)
+                if name in attached or self.table_exists(name):
+                    continue
+                start, end = month, next_month(month)
+                params = self._params(start, end)
+                # Rows for this month may have landed in the default
+                # partition; it must not hold any when the range is added
+                cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+                cursor.execute(
+                    f'CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)', params
+                )
+                cursor.execute(
+                    f'INSERT INTO {TABLE} SELECT * FROM {DEFAULT_PARTITION} '
+                    f'WHERE "timestamp" >= %s AND "timestamp" < %s', params
+                )
+                cursor.execute(
+                    f'DELETE FROM {DEFAULT_PARTITION} WHERE "timestamp" >= %s AND "timestamp" < %s', params
+                )
+                cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+                created.append(name)
+        return created
+
+    def partitions(self):
+        with self.connection.cursor() as cursor:
+            attached = self._attached(cursor)
+            tables = self.connection.introspection.table_names(cursor)
+        result = []
+        for name in sorted(set(tables) | attached):
+            match = PARTITION_NAME.match(name)
+            if match:
+                month = month_range(int(match.group(1)), int(match.group(2)))[0]
+                result.append((name, month, name not in attached))
+        return result
+
+    def detach(self, month):
+        name = partition_name(month)
+        with self.connection.cursor() as cursor:
+            if name not in self._attached(cursor):
+                raise ValueError(f"{name} is not an attached partition")
+            self.check_detachable(month)
+            cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+        return name
+
+class SQLitePartitions(BasePartitions):
+    """Months moved out of the live table into tables of their own"""
+
+    partitioned = False
+
+    def partitions(self):
+        result = []
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT MIN("timestamp"), MAX("timestamp") FROM audit_auditlog')
+            oldest, newest = cursor.fetchone()
+            tables = self.connection.introspection.table_names(cursor)
+        if oldest is not None:
+            parse = self.connection.ops.convert_datetimefield_value
+            first, last = (parse(value, None, self.connection) for value in (oldest, newest))
+            for month in months_between(first, last + datetime.timedelta(microseconds=1)):
+                result.append((partition_name(month), month, False))
+        for name in tables:
+            match = PARTITION_NAME.match(name)
+            if match:
+                month = month_range(int(match.group(1)), int(match.group(2)))[0]
+                result.append((name, month, True))
+        return sorted(result, key=lambda partition: (partition[1], partition[2]))
+
+    def detach(self, month):
+        name = partition_name(month)
+        if self.table_exists(name):
+            raise ValueError(f"{name} is already detached")
+        self.check_detachable(month)
+        params = self._params(month, next_month(month))
+        with transaction.atomic(using=self.connection.alias), self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE {name} AS SELECT * FROM {TABLE} '
+                f'WHERE "timestamp" >= %s AND "timestamp" < %s', params
+            )
+            cursor.execute(f'DELETE FROM {TABLE} WHERE "timestamp" >= %s AND "timestamp" < %s', params)
+        return name
+
+def get_partitions(connection=None):
+    """Partition maintenance for the connection's database"""
+    connection = connection or default_connection
+    if connection.vendor == 'postgresql':
+        return PostgresPartitions(connection)
+    return SQLitePartitions(connection)
@@ -0,0 +1,65 @@
+# apps/audit/request_log.py
+
+"""
+Sampled request logging.
+
+Whether a request is logged is decided after it ran:
+
+    responses with a status of 500 or more are always logged;
+    a path matching a prefix in REQUEST_LOG_PATH_RATES uses that rate
+    (the longest prefix wins), e.g. {'/api/v1/permissions/': 1.0,
+    '/static/': 0};
+    anything else uses the tenant's audit_sample_rate, which defaults to
+    REQUEST_LOG_SAMPLE_RATE.
+
+Kept requests become RequestLog rows, queued in memory and bulk inserted
+by their own writer.
+"""
+
+import random
+
+from django.conf import settings
+
+from apps.tenants.config import get_tenant_config
+from .models import RequestLog
+from .writer import AuditWriter, FLUSH_INTERVAL
+
+request_log_writer = AuditWriter(
+    batch_size=getattr(settings, 'REQUEST_LOG_BATCH_SIZE', 1000),
+    flush_interval=FLUSH_INTERVAL,
+    max_queue=getattr(settings, 'REQUEST_LOG_MAX_QUEUE', 20000),
+    model=RequestLog,
+    # A request happened whether or not its transaction committed
+    transactional=False,
+)
+
+def sample_rate(path, tenant_config, status):
+    """Share of requests like this one that are logged"""
+    if status >= 500:
+        return 1.0
+    rates = getattr(settings, 'REQUEST_LOG_PATH_RATES', {})
+    matches = [prefix for prefix in rates if path.startswith(prefix)]
+    if matches:
+        return rates[max(matches, key=len)]
+    return tenant_config.audit_sample_rate
+
+def log_request(request, status, latency_ms, ip_address):
+    """Queue a RequestLog row if the request is sampled; returns whether it was"""
+    config = getattr(request, 'tenant_config', None)
+    if config is None:
+        config = get_tenant_config(getattr(request, 'tenant', None))
+    rate = sample_rate(request.path, config, status)
+    if rate <= 0 or (rate < 1 and random.random() >= rate):
+        return False
+    user = getattr(request, 'user', None)
+    request_log_writer.log(RequestLog(
+        tenant_id=getattr(request, 'tenant_id', None) or config.tenant_id,
+        user_id=user.pk if user is not None and user.is_authenticated else None,
+        method=request.method[:8],
+        path=request.path[:255],
+        status=status,
+        latency_ms=round(latency_ms, 3),
+        ip_address=ip_address or None,
+        sample_rate=rate,
+    ))
+    return True
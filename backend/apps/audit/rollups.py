@@ -0,0 +1,144 @@
+# apps/audit/rollups.py
+
+"""
+Incrementally maintained audit counters.
+
+AuditRollup holds one row per (tenant, day, action, user) with the number
+of entries logged. The audit writer adds each batch's counts in the same
+transaction as its insert, with one multi-row INSERT ... ON CONFLICT DO
+UPDATE per chunk of keys, so dashboards read a few hundred rollup rows
+instead of grouping the whole log. Days are calendar days in TIME_ZONE.
+
+Rollups live in the default database. backfill() rebuilds them day by
+day from AuditLog; reconcile() compares the two. Days compacted into cold
+storage (apps.audit.cold) keep their rollups but have no live rows, so
+both take a date range.
+"""
+
+import datetime
+from collections import Counter
+
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import AuditLog, AuditRollup
+
+# Keys per upsert statement; 5 parameters each stays under SQLite's limit
+UPSERT_BATCH_SIZE = 150
+
+def rollup_key(entry):
+    return (entry.tenant_id or 0, timezone.localdate(entry.timestamp), entry.action, entry.user_id or 0)
+
+def count_entries(entries):
+    """Counter of rollup keys for unsaved or saved AuditLog rows"""
+    return Counter(rollup_key(entry) for entry in entries)
+
+def add_counts(counts, using=DEFAULT_DB_ALIAS):
+    """Add counts ({(tenant_id, day, action, user_id): n}) to the rollups"""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(AuditRollup._meta.db_table)
+    columns = ', '.join(quote(name) for name in ('tenant_id', 'day', 'action', 'user_id', 'count'))
+    key = ', '.join(quote(name) for name in ('tenant_id', 'day', 'action', 'user_id'))
+    items = [(tenant_id, day, action, user_id, n) for (tenant_id, day, action, user_id), n in counts.items() if n]
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), UPSERT_BATCH_SIZE):
+            chunk = items[start:start + UPSERT_BATCH_SIZE]
+            params = []
+            for tenant_id, day, action, user_id, n in chunk:
+                params.extend([tenant_id, connection.ops.adapt_datefield_value(day), action, user_id, n])
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) VALUES '
+                + ', '.join(['(%s, %s, %s, %s, %s)'] * len(chunk))
+                + f' ON CONFLICT ({key}) DO UPDATE SET {quote("count")} = {table}.{quote("count")} + EXCLUDED.{quote("count")}',
+                params
+            )
+    return len(items)
+
+def record_entries(entries):
+    """Count newly inserted AuditLog rows into the rollups"""
+    return add_counts(count_entries(entries))
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time()))
+    return start, timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time()))
+
+def live_counts(start_day, end_day, database=DEFAULT_DB_ALIAS):
+    """Counter of rollup keys computed from AuditLog for days in [start_day, end_day]"""
+    start, _ = _day_bounds(start_day)
+    _, end = _day_bounds(end_day)
+    rows = (
+        AuditLog._base_manager.using(database).between(start, end)
+        .annotate(day=TruncDate('timestamp'))
+        .values('tenant_id', 'day', 'action', 'user_id')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    return Counter({
+        (row['tenant_id'] or 0, row['day'], row['action'], row['user_id'] or 0): row['n'] for row in rows
+    })
+
+def rollup_counts(start_day, end_day):
+    """Counter of rollup keys stored for days in [start_day, end_day]"""
+    rows = AuditRollup.objects.filter(day__range=(start_day, end_day)).values_list(
+        'tenant_id', 'day', 'action', 'user_id', 'count'
+    )
+    return Counter({(tenant_id, day, action, user_id): n for tenant_id, day, action, user_id, n in rows})
+
+def live_days(databases=(DEFAULT_DB_ALIAS,)):
+    """(first, last) day with live AuditLog rows, or None"""
+    bounds = []
+    for database in databases:
+        queryset = AuditLog._base_manager.using(database)
+        first = queryset.order_by('timestamp').values_list('timestamp', flat=True).first()
+        if first is not None:
+            last = queryset.order_by('-timestamp').values_list('timestamp', flat=True).first()
+            bounds.append((timezone.localdate(first), timezone.localdate(last)))
+    if not bounds:
+        return None
+    return min(first for first, _ in bounds), max(last for _, last in bounds)
+
+def _days(start_day, end_day):
+    day = start_day
+    while day <= end_day:
+        yield day
+        day += datetime.timedelta(days=1)
+
+def backfill(start_day, end_day, databases=(DEFAULT_DB_ALIAS,)):
+    """Rebuild the rollups of each day in [start_day, end_day]; returns rows written"""
+    written = 0
+    for day in _days(start_day, end_day):
+        counts = Counter()
+        for database in databases:
+            counts.update(live_counts(day, day, database))
+        # Entries written while a day is rebuilt may be counted twice or
+        # not at all; reconcile() finds such days
+        with transaction.atomic():
+            AuditRollup.objects.filter(day=day).delete()
+            written += add_counts(counts)
+    return written
+
+def reconcile(start_day, end_day, databases=(DEFAULT_DB_ALIAS,)):
+    """[(key, live count, rollup count)] for every key that disagrees"""
+    live = Counter()
+    for database in databases:
+        live.update(live_counts(start_day, end_day, database))
+    stored = rollup_counts(start_day, end_day)
+    return sorted(
+        (key, live[key], stored[key]) for key in set(live) | set(stored) if live[key] != stored[key]
+    )
+
+def summary(tenant_id, start_day, end_day, by='action'):
+    """
+    Totals per day and action (by='action'), per day and user (by='user')
+    or per day (by='day') for one tenant, read from the rollups only
+    """
+    fields = {'action': ['day', 'action'], 'user': ['day', 'user_id'], 'day': ['day']}[by]
+    return list(
+        AuditRollup.objects.filter(tenant_id=tenant_id or 0, day__range=(start_day, end_day))
+        .values(*fields)
+        .annotate(count=Sum('count'))
+        .order_by(*fields)
+    )
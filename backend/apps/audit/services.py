@@ -1,16 +1,46 @@
 # apps/audit/services.py
 
+from .metadata import promote_metadata
 from .models import AuditLog
+from .rollups import record_entries
+from .writer import audit_writer
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from apps.tenants.context import get_current_tenant_id
 
-def log_action(user, action, target, metadata=None):
+def log_action(user, action, target, metadata=None, durable=False):
     """
-    Create an audit log entry for a specific user action.
+    Record an audit log entry for a specific user action.
+    Entries are buffered and bulk inserted; durable entries are written as
+    soon as the current transaction commits.
     """
-    AuditLog.objects.create(
+    audit_writer.log(promote_metadata(AuditLog(
         user=user,
         action=action,
         target_type=ContentType.objects.get_for_model(target.__class__),
         target_id=target.id,
         metadata=metadata or {}
-    )
+    )), durable=durable)
+
+def log_actions(entries, batch_size=500):
+    """
+    Create many audit log entries with one bulk insert.
+    entries is an iterable of (user, action, target, metadata) tuples.
+    """
+    # bulk_create skips save(), so the active tenant is set here
+    tenant_id = get_current_tenant_id()
+    logs = [
+        promote_metadata(AuditLog(
+            tenant_id=tenant_id,
+            user=user,
+            action=action,
+            target_type=ContentType.objects.get_for_model(target.__class__),
+            target_id=target.id,
+            metadata=metadata or {}
+        ))
+        for user, action, target, metadata in entries
+    ]
+    with transaction.atomic():
+        logs = AuditLog.objects.bulk_create(logs, batch_size=batch_size)
+        record_entries(logs)
+    return logs
@@ -0,0 +1,304 @@
+# apps/audit/spool.py
+
+"""
+Crash-safe local spool for audit entries.
+
+When AUDIT_SPOOL_DIR is set, the audit writer appends every entry to a
+spool on local disk instead of holding it in memory, and a drainer loads
+the spool into AuditLog whenever the database is available. Requests
+then never wait on the database for auditing, and an outage only makes
+the spool grow.
+
+The spool is a set of memory-mapped segment files, each owned by one
+process and locked with flock while it is open:
+
+    header  magic, format version, drained offset
+    record  payload length (uint32), crc32 of the payload (uint32), payload
+
+A zero length marks the end of the written records; segments are
+preallocated, so unwritten space reads as zeros. The payload is written
+before its length, so a record torn by a crash fails its checksum and
+ends the segment there. Dirty pages are synced in batches, every
+AUDIT_SPOOL_FSYNC_BATCH records or AUDIT_SPOOL_FSYNC_INTERVAL seconds,
+and at once for durable entries.
+
+Records carry an event id that is unique in AuditLog, so a batch loaded
+twice (a crash between the insert and the drained offset update) is not
+duplicated. Segments left behind by a dead process are unlocked; any
+drainer claims and drains them.
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'DAHS'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHxxQ')
+RECORD = struct.Struct('<II')
+SUFFIX = '.seg'
+TEMP_SUFFIX = '.tmp'
+
+class SpoolSegment:
+    """One memory-mapped segment file"""
+
+    def __init__(self, path, size=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        # New segments are prepared under a temporary name so no drainer
+        # claims them before they are locked
+        open_path = path + TEMP_SUFFIX if size is not None else path
+        flags = os.O_RDWR | os.O_CREAT if size is not None else os.O_RDWR
+        self.fd = os.open(open_path, flags, 0o600)
+        try:
+            # Held for as long as this process has the segment open
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(self.fd)
+            raise
+        if size is not None:
+            os.ftruncate(self.fd, size)
+        self.size = os.fstat(self.fd).st_size
+        self.map = mmap.mmap(self.fd, self.size)
+        magic, version, drained = HEADER.unpack_from(self.map, 0)
+        if magic == b'\0' * 4:
+            drained = HEADER.size
+            HEADER.pack_into(self.map, 0, MAGIC, FORMAT_VERSION, drained)
+        elif magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Not an audit spool segment: {path}")
+        self.drained = drained
+        self.offset = self._scan(drained)
+        self.sealed = False
+        if open_path != path:
+            os.rename(open_path, path)
+
+    def _scan(self, offset):
+        """Offset just past the last intact record"""
+        while offset + RECORD.size <= self.size:
+            length, crc = RECORD.unpack_from(self.map, offset)
+            end = offset + RECORD.size + length
+            if length == 0 or end > self.size or zlib.crc32(self.map[offset + RECORD.size:end]) != crc:
+                break
+            offset = end
+        return offset
+
+    def room(self):
+        return self.size - self.offset - RECORD.size
+
+    def append(self, payload):
+        start = self.offset + RECORD.size
+        self.map[start:start + len(payload)] = payload
+        RECORD.pack_into(self.map, self.offset, len(payload), zlib.crc32(payload))
+        self.offset = start + len(payload)
+
+    def read(self, limit):
+        """Up to limit undrained payloads and the offset after them"""
+        payloads = []
+        offset = self.drained
+        while offset < self.offset and len(payloads) < limit:
+            length, _ = RECORD.unpack_from(self.map, offset)
+            start = offset + RECORD.size
+            payloads.append(bytes(self.map[start:start + length]))
+            offset = start + length
+        return payloads, offset
+
+    def mark_drained(self, offset):
+        self.drained = offset
+        HEADER.pack_into(self.map, 0, MAGIC, FORMAT_VERSION, offset)
+        self.map.flush(0, min(mmap.PAGESIZE, self.size))
+
+    def pending(self):
+        return self.drained < self.offset
+
+    def sync(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def remove(self):
+        os.unlink(self.path)
+        self.close()
+
+class AuditSpool:
+    """Append-only spool of this process, plus any orphaned segments it claims"""
+
+    def __init__(self, directory, segment_size=16 * 1024 * 1024, fsync_batch=64,
+                 fsync_interval=0.05, orphan_scan_interval=30.0):
+        self.directory = str(directory)
+        self.segment_size = segment_size
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.orphan_scan_interval = orphan_scan_interval
+        self._segments = []
+        self._active = None
+        self._pid = None
+        self._counter = 0
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self._orphans_checked_at = None
+        self._lock = threading.RLock()
+        self._drain_lock = threading.Lock()
+        self._stats = {'appended': 0, 'drained': 0, 'fsyncs': 0, 'last_fsync_ms': None}
+
+    def _check_fork(self):
+        # A forked child must not share the parent's segments
+        if self._pid != os.getpid():
+            self._segments = []
+            self._active = None
+            self._unsynced = 0
+            self._pid = os.getpid()
+
+    def _open_segment(self, min_size):
+        os.makedirs(self.directory, exist_ok=True)
+        self._counter += 1
+        name = f'{time.time_ns():020d}-{os.getpid()}-{self._counter:06d}{SUFFIX}'
+        segment = SpoolSegment(os.path.join(self.directory, name), max(self.segment_size, min_size))
+        self._segments.append(segment)
+        return segment
+
+    def append(self, payload, sync=False):
+        """Append one record; sync=True returns only once it is on disk"""
+        with self._lock:
+            self._check_fork()
+            segment = self._active
+            if segment is None or segment.room() < len(payload):
+                if segment is not None:
+                    segment.sync()
+                    segment.sealed = True
+                segment = self._active = self._open_segment(HEADER.size + RECORD.size + len(payload))
+            segment.append(payload)
+            self._stats['appended'] += 1
+            self._unsynced += 1
+            if sync or self._unsynced >= self.fsync_batch or time.monotonic() - self._synced_at >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        if self._unsynced and self._active is not None:
+            started = time.perf_counter()
+            self._active.sync()
+            self._stats['fsyncs'] += 1
+            self._stats['last_fsync_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def sync(self):
+        """Force unsynced records to disk"""
+        with self._lock:
+            self._check_fork()
+            self._sync()
+
+    def claim_orphans(self, force=False):
+        """Adopt segments whose owning process is gone"""
+        now = time.monotonic()
+        with self._lock:
+            self._check_fork()
+            if not force and self._orphans_checked_at is not None and \
+                    now - self._orphans_checked_at < self.orphan_scan_interval:
+                return 0
+            self._orphans_checked_at = now
+            try:
+                names = sorted(name for name in os.listdir(self.directory) if name.endswith(SUFFIX))
+            except FileNotFoundError:
+                return 0
+            owned = {segment.name for segment in self._segments}
+            claimed = 0
+            for name in names:
+                if name in owned:
+                    continue
+                try:
+                    segment = SpoolSegment(os.path.join(self.directory, name))
+                except (OSError, ValueError):
+                    # Locked by a live process, or removed meanwhile
+                    continue
+                segment.sealed = True
+                self._segments.append(segment)
+                claimed += 1
+            self._segments.sort(key=lambda segment: segment.name)
+            return claimed
+
+    def drain(self, load, batch_size=500, force_orphans=False):
+        """
+        Pass undrained payloads to load(payloads) in batches, oldest segment
+        first, and record each batch as drained once load returns.
+        Appends are not blocked while load runs. Returns the number of
+        records drained.
+        """
+        drained = 0
+        with self._drain_lock:
+            self.claim_orphans(force=force_orphans)
+            with self._lock:
+                segments = list(self._segments)
+            for segment in segments:
+                while True:
+                    with self._lock:
+                        payloads, offset = segment.read(batch_size)
+                    if not payloads:
+                        break
+                    load(payloads)
+                    with self._lock:
+                        segment.mark_drained(offset)
+                    drained += len(payloads)
+                with self._lock:
+                    if segment.sealed and not segment.pending():
+                        segment.remove()
+                        self._segments.remove(segment)
+            with self._lock:
+                self._stats['drained'] += drained
+        return drained
+
+    def pending(self):
+        """Whether this process holds undrained records"""
+        with self._lock:
+            return any(segment.pending() for segment in self._segments)
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['segments'] = len(self._segments)
+            stats['pending_bytes'] = sum(segment.offset - segment.drained for segment in self._segments)
+            stats['unsynced'] = self._unsynced
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            for segment in self._segments:
+                segment.close()
+            self._segments = []
+            self._active = None
+
+def encode_entry(entry):
+    """Spool payload of an unsaved AuditLog"""
+    return json.dumps({
+        'event_id': str(entry.event_id),
+        'tenant_id': entry.tenant_id,
+        'user_id': entry.user_id,
+        'action': entry.action,
+        'target_type_id': entry.target_type_id,
+        'target_id': entry.target_id,
+        'timestamp': entry.timestamp.isoformat(),
+        'metadata': entry.metadata,
+    }, separators=(',', ':'), default=str).encode()
+
+def decode_entry(payload):
+    from django.utils.dateparse import parse_datetime
+    from .metadata import promote_metadata
+    from .models import AuditLog
+
+    data = json.loads(payload)
+    data['event_id'] = uuid.UUID(data['event_id'])
+    data['timestamp'] = parse_datetime(data['timestamp'])
+    # Promoted columns are derived from metadata rather than spooled
+    return promote_metadata(AuditLog(**data))
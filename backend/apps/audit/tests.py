@@ -0,0 +1,859 @@
+# apps/audit/tests.py
+
+import csv
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from io import StringIO
+from urllib.parse import parse_qs, urlparse
+
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.http import HttpResponse
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from django.db.models.signals import post_delete
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.audit.models import AuditCheckpoint, AuditLog, AuditRollup, RequestLog
+from apps.audit.chain import merkle_root, seal, verify, verify_archive
+from apps.audit.cold import ColdStore
+from apps.audit.export import export_audit_logs
+from apps.audit.metadata import backfill_promoted
+from apps.audit.query import paginate
+from apps.audit.partitions import get_partitions, month_range, months_between, parse_month, partition_name
+from apps.audit.rollups import backfill, reconcile, record_entries
+from apps.audit.request_log import log_request, request_log_writer, sample_rate
+from apps.audit.services import log_action, log_actions
+from apps.audit.spool import AuditSpool, HEADER, decode_entry, encode_entry
+from apps.audit.writer import AuditWriter, audit_writer
+from apps.api.v1.audit import AuditLogExportView, AuditLogListView, AuditSummaryView
+from apps.tenants.config import TenantConfig, get_tenant_config
+from apps.tenants.models import Tenant
+from middleware.permissions import RequestLoggingMiddleware
+
+User = get_user_model()
+
+class AuditWriterTestCase(TestCase):
+    def setUp(self):
+        audit_writer.clear()
+        self.user = User.objects.create_user(username='auditor', password='testpass123')
+
+    def entry(self, action='UPDATE'):
+        return AuditLog(user=self.user, action=action, target_type_id=1, target_id=self.user.pk)
+
+    def test_flush_thread_follows_setting(self):
+        """Test writers without use_thread read AUDIT_FLUSH_THREAD, which tests turn off."""
+        self.assertFalse(audit_writer.threaded)
+        with override_settings(AUDIT_FLUSH_THREAD=True):
+            self.assertTrue(AuditWriter().threaded)
+            self.assertFalse(AuditWriter(use_thread=False).threaded)
+
+    def test_entries_are_written_in_batches(self):
+        """Test queued entries are inserted with one bulk insert per batch."""
+        writer = AuditWriter(batch_size=3, flush_interval=60)
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(5):
+                writer.log(self.entry())
+        self.assertEqual(AuditLog.objects.count(), 0)
+        self.assertEqual(writer.metrics()['queue_depth'], 5)
+
+        self.assertEqual(writer.flush(), 5)
+        self.assertEqual(AuditLog.objects.count(), 5)
+        metrics = writer.metrics()
+        self.assertEqual((metrics['flushes'], metrics['written'], metrics['queue_depth']), (2, 5, 0))
+        self.assertIsNotNone(metrics['last_flush_ms'])
+
+    def test_thresholds(self):
+        """Test the queue is due for a flush by size or by age."""
+        writer = AuditWriter(batch_size=2, flush_interval=60)
+        writer._queue.append(self.entry())
+        writer._oldest = time.monotonic()
+        self.assertFalse(writer.due())
+        writer._queue.append(self.entry())
+        self.assertTrue(writer.due())
+
+        writer = AuditWriter(batch_size=100, flush_interval=0)
+        writer._queue.append(self.entry())
+        writer._oldest = 0
+        self.assertTrue(writer.due())
+
+    def test_durable_entries_flush_at_commit(self):
+        """Test durable entries are written as soon as the transaction commits."""
+        with self.captureOnCommitCallbacks(execute=True):
+            log_action(self.user, 'GRANT_ACCESS', self.user, durable=True)
+            self.assertEqual(AuditLog.objects.count(), 0)
+        self.assertEqual(AuditLog.objects.get().action, 'GRANT_ACCESS')
+
+    def test_rolled_back_entries_are_dropped(self):
+        """Test actions undone by a rollback are never audited."""
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    log_action(self.user, 'DELETE', self.user, durable=True)
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(audit_writer.flush(), 0)
+        self.assertFalse(AuditLog.objects.exists())
+
+    def test_timestamp_is_taken_when_logged(self):
+        """Test buffered entries keep the time they were logged."""
+        writer = AuditWriter(flush_interval=60)
+        entry = self.entry()
+        logged_at = entry.timestamp
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.log(entry)
+        writer.flush()
+        self.assertEqual(AuditLog.objects.get().timestamp, logged_at)
+
+class UnavailableWriter(AuditWriter):
+    """Writer whose database is down until available is set"""
+    available = False
+
+    def _write_batch(self, batch, reloading=False):
+        if not self.available:
+            raise DatabaseError('database unavailable')
+        super()._write_batch(batch, reloading)
+
+class AuditBackpressureTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='auditor', password='testpass123')
+
+    def test_full_queue_is_written_by_callers_not_dropped(self):
+        """Test a full queue makes callers flush, and keeps every entry while writes fail."""
+        writer = UnavailableWriter(batch_size=100, flush_interval=60, max_queue=3, use_thread=False)
+        with self.assertLogs('apps.audit.writer', 'ERROR'):
+            for _ in range(5):
+                writer.log(AuditLog(user=self.user, action='UPDATE', target_type_id=1, target_id=1))
+        metrics = writer.metrics()
+        self.assertEqual((metrics['queue_depth'], metrics['backpressure_flushes']), (5, 3))
+        self.assertFalse(AuditLog.objects.exists())
+
+        writer.available = True
+        writer.log(AuditLog(user=self.user, action='DELETE', target_type_id=1, target_id=1))
+        self.assertEqual(writer.metrics()['queue_depth'], 0)
+        self.assertEqual(AuditLog.objects.count(), 6)
+
+class AuditSpoolTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.user = User.objects.create_user(username='auditor', password='testpass123')
+
+    def spool(self, **kwargs):
+        spool = AuditSpool(self.directory, **kwargs)
+        self.addCleanup(spool.close)
+        return spool
+
+    def drain_all(self, spool, **kwargs):
+        loaded = []
+        spool.drain(loaded.extend, **kwargs)
+        return loaded
+
+    def test_records_round_trip_in_order(self):
+        """Test records are read back in order across segment rollovers."""
+        spool = self.spool(segment_size=256)
+        payloads = [f'record-{number}'.encode() * 3 for number in range(20)]
+        for payload in payloads:
+            spool.append(payload)
+        self.assertGreater(spool.metrics()['segments'], 1)
+        self.assertEqual(self.drain_all(spool, batch_size=7), payloads)
+        self.assertEqual(self.drain_all(spool), [])
+        # Only the segment still being written is kept
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_orphaned_segments_are_claimed(self):
+        """Test records of a process that died undrained are picked up by another."""
+        crashed = AuditSpool(self.directory)
+        crashed.append(b'first')
+        crashed.append(b'second', sync=True)
+        self.drain_all(crashed, batch_size=1)
+        crashed.append(b'third', sync=True)
+        # A crash releases the segment lock without any cleanup
+        for segment in crashed._segments:
+            segment.close()
+
+        survivor = self.spool()
+        self.assertEqual(self.drain_all(survivor, force_orphans=True), [b'third'])
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_live_segments_are_not_claimed(self):
+        """Test a drainer leaves segments locked by a running process alone."""
+        owner = self.spool()
+        owner.append(b'mine')
+        other = self.spool()
+        self.assertEqual(other.claim_orphans(force=True), 0)
+        self.assertEqual(self.drain_all(owner), [b'mine'])
+
+    def test_torn_record_ends_the_segment(self):
+        """Test a record whose checksum fails is treated as never written."""
+        crashed = AuditSpool(self.directory)
+        crashed.append(b'complete')
+        crashed.append(b'torn')
+        segment = crashed._segments[0]
+        segment.map[segment.offset - 1:segment.offset] = b'X'
+        segment.sync()
+        segment.close()
+
+        self.assertEqual(self.drain_all(self.spool(), force_orphans=True), [b'complete'])
+
+    def test_writer_loads_spool_once(self):
+        """Test spooled entries reach AuditLog, and reloading does not duplicate them."""
+        spool = self.spool()
+        writer = AuditWriter(flush_interval=60, spool=spool)
+        with self.captureOnCommitCallbacks(execute=True):
+            log_entry = AuditLog(user=self.user, action='GRANT_ACCESS', target_type_id=1, target_id=1)
+            writer.log(log_entry, durable=True)
+            writer.log(AuditLog(user=self.user, action='UPDATE', target_type_id=1, target_id=1))
+        self.assertEqual(AuditLog.objects.count(), 0)
+        self.assertEqual(writer.flush(), 2)
+
+        # As if the process crashed before recording the drained offset
+        spool._segments[0].mark_drained(HEADER.size)
+        writer.flush()
+        self.assertEqual(AuditLog.objects.count(), 2)
+        self.assertEqual(AuditLog.objects.get(action='GRANT_ACCESS').event_id, log_entry.event_id)
+
+class RequestLoggingTestCase(TestCase):
+    def setUp(self):
+        request_log_writer.clear()
+        self.addCleanup(request_log_writer.clear)
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user(username='visitor', password='testpass123')
+
+    def request(self, path, tenant=None):
+        request = self.factory.get(path, REMOTE_ADDR='10.0.0.7')
+        request.user = self.user
+        request.tenant = tenant
+        request.tenant_config = get_tenant_config(tenant)
+        return request
+
+    @override_settings(REQUEST_LOG_SAMPLE_RATE=0.0, REQUEST_LOG_PATH_RATES={'/api/': 0.5, '/api/v1/permissions/': 1.0})
+    def test_sample_rates(self):
+        """Test errors are always kept and the longest matching path prefix wins."""
+        config = TenantConfig.from_settings({})
+        self.assertEqual(sample_rate('/api/v1/permissions/roles/', config, 200), 1.0)
+        self.assertEqual(sample_rate('/api/v1/datasets/', config, 200), 0.5)
+        self.assertEqual(sample_rate('/admin/', config, 200), 0.0)
+        self.assertEqual(sample_rate('/admin/', config, 503), 1.0)
+        tenant_config = TenantConfig.from_settings({'audit_sample_rate': 0.25})
+        self.assertEqual(sample_rate('/admin/', tenant_config, 200), 0.25)
+
+    @override_settings(REQUEST_LOG_PATH_RATES={})
+    def test_tenant_rate_controls_sampling(self):
+        """Test a tenant can turn request logging off or on."""
+        quiet = Tenant.objects.create(name='Quiet', subdomain='quiet', settings={'audit_sample_rate': 0})
+        loud = Tenant.objects.create(name='Loud', subdomain='loud', settings={'audit_sample_rate': 1})
+        self.assertFalse(log_request(self.request('/api/v1/datasets/', quiet), 200, 1.0, '10.0.0.7'))
+        self.assertTrue(log_request(self.request('/api/v1/datasets/', loud), 200, 1.0, '10.0.0.7'))
+        self.assertEqual(request_log_writer.metrics()['queue_depth'], 1)
+
+    @override_settings(REQUEST_LOG_PATH_RATES={'/': 1.0})
+    def test_middleware_batches_request_logs(self):
+        """Test the middleware captures each request without writing to the database."""
+        middleware = RequestLoggingMiddleware(lambda request: HttpResponse(status=201))
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                middleware(self.request('/api/v1/datasets/'))
+        self.assertEqual(RequestLog.objects.count(), 0)
+        self.assertEqual(request_log_writer.flush(), 3)
+
+        log = RequestLog.objects.first()
+        self.assertEqual((log.method, log.path, log.status), ('GET', '/api/v1/datasets/', 201))
+        self.assertEqual((log.user_id, log.ip_address, log.sample_rate), (self.user.pk, '10.0.0.7', 1.0))
+        self.assertGreaterEqual(log.latency_ms, 0)
+
+class AuditPartitionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='archivist', password='testpass123')
+        self.partitions = get_partitions()
+
+    def entry(self, year, month, day=15):
+        return AuditLog.all_objects.create(
+            user=self.user, action='UPDATE', target_type_id=1, target_id=self.user.pk,
+            timestamp=datetime.datetime(year, month, day, 12, tzinfo=datetime.timezone.utc)
+        )
+
+    def test_month_helpers(self):
+        """Test month boundaries used to name and bound partitions."""
+        start, end = month_range(2025, 12)
+        self.assertEqual((start.month, end.year, end.month), (12, 2026, 1))
+        self.assertEqual(partition_name(parse_month('2025-03')), 'audit_auditlog_p2025_03')
+        self.assertEqual(len(months_between(start, datetime.datetime(2026, 2, 2, tzinfo=datetime.timezone.utc))), 3)
+        with self.assertRaises(ValueError):
+            parse_month('March')
+
+    def test_between_bounds_timestamp(self):
+        """Test range queries only return entries inside the requested months."""
+        self.entry(2025, 1)
+        inside = self.entry(2025, 2)
+        self.entry(2025, 3)
+        self.assertEqual(list(AuditLog.all_objects.in_month(2025, 2)), [inside])
+        self.assertEqual(AuditLog.all_objects.between(start=month_range(2025, 2)[0]).count(), 2)
+
+    def test_detach_moves_month_out_of_live_table(self):
+        """Test detaching a month moves its rows into a table of their own."""
+        self.entry(2025, 1)
+        self.entry(2025, 1, day=31)
+        kept = self.entry(2025, 2, day=1)
+        self.assertEqual(
+            [(name, detached) for name, _, detached in self.partitions.partitions()],
+            [('audit_auditlog_p2025_01', False), ('audit_auditlog_p2025_02', False)]
+        )
+
+        seal(block_size=1)
+        self.assertEqual(self.partitions.detach(parse_month('2025-01')), 'audit_auditlog_p2025_01')
+        self.assertEqual(list(AuditLog.all_objects.all()), [kept])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM audit_auditlog_p2025_01')
+            self.assertEqual(cursor.fetchone()[0], 2)
+        self.assertIn(('audit_auditlog_p2025_01', parse_month('2025-01'), True), self.partitions.partitions())
+        with self.assertRaises(ValueError):
+            self.partitions.detach(parse_month('2025-01'))
+
+    def test_archive_writes_csv_and_drops_partition(self):
+        """Test archiving a detached month writes it to gzipped CSV and drops the table."""
+        entry = self.entry(2024, 6)
+        month = parse_month('2024-06')
+        seal(block_size=1)
+        self.partitions.detach(month)
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.partitions.archive(month, directory)
+            with gzip.open(path, 'rt', newline='') as archive:
+                rows = list(csv.DictReader(archive))
+        self.assertEqual(os.path.basename(path), 'audit_auditlog_p2024_06.csv.gz')
+        self.assertEqual([int(row['id']) for row in rows], [entry.pk])
+        self.assertFalse(self.partitions.table_exists('audit_auditlog_p2024_06'))
+        with self.assertRaises(ValueError):
+            self.partitions.archive(month, '/tmp')
+
+    def test_command_detaches_months_before(self):
+        """Test the management command detaches every live month before the cutoff."""
+        self.entry(2024, 11)
+        self.entry(2024, 12)
+        self.entry(2025, 1)
+        seal(block_size=1)
+        out = StringIO()
+        call_command('audit_partitions', 'detach', before='2025-01', stdout=out)
+        self.assertIn('Detached audit_auditlog_p2024_11', out.getvalue())
+        self.assertIn('Detached audit_auditlog_p2024_12', out.getvalue())
+        self.assertEqual(AuditLog.all_objects.count(), 1)
+        if not self.partitions.partitioned:
+            self.assertIn('no table partitioning', out.getvalue())
+
+    def test_queries_after_detach_exclude_the_month(self):
+        """Test AuditLog queries no longer see a month once it is detached."""
+        self.entry(2025, 1)
+        kept = self.entry(2025, 2)
+        seal(block_size=1)
+        self.partitions.detach(parse_month('2025-01'))
+        self.assertFalse(AuditLog.all_objects.in_month(2025, 1).exists())
+        self.assertEqual(list(AuditLog.all_objects.between(start=month_range(2025, 1)[0])), [kept])
+        self.assertEqual(list(AuditLog.objects.filter(user=self.user)), [kept])
+
+    def test_detach_keeps_chain_whole(self):
+        """Test a month is only detached once its entries lead the chain."""
+        self.entry(2025, 1)
+        self.entry(2025, 2)
+        month = parse_month('2025-01')
+        with self.assertRaisesMessage(ValueError, 'not sealed'):
+            self.partitions.detach(month)
+        # Logged in January but chained after a February entry
+        self.entry(2025, 1, day=31)
+        seal(block_size=1)
+        with self.assertRaisesMessage(ValueError, 'hole in the audit chain'):
+            self.partitions.detach(month)
+        self.assertEqual(AuditLog.all_objects.count(), 3)
+        self.assertIsNone(verify(full=True)['broken'])
+
+    def test_event_ids_are_unique_per_timestamp(self):
+        """Test a replayed entry conflicts: it keeps the event id and timestamp it was logged with."""
+        entry = self.entry(2025, 1)
+        replay = decode_entry(encode_entry(entry))
+        self.assertEqual((replay.event_id, replay.timestamp), (entry.event_id, entry.timestamp))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            AuditLog.all_objects.create(
+                user=self.user, action='UPDATE', target_type_id=1, target_id=self.user.pk,
+                event_id=entry.event_id, timestamp=entry.timestamp
+            )
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'Native partitions need PostgreSQL')
+class AuditPostgresPartitionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='archivist', password='testpass123')
+        self.partitions = get_partitions()
+
+    def query(self, sql, params=None):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def test_table_is_partitioned_by_timestamp(self):
+        """Test the migration left a range-partitioned table keyed on (id, timestamp)."""
+        self.assertEqual(self.query(
+            "SELECT partstrat FROM pg_partitioned_table WHERE partrelid = 'audit_auditlog'::regclass"
+        ), [('r',)])
+        primary_key = self.query(
+            "SELECT a.attname FROM pg_index i JOIN pg_attribute a "
+            "ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+            "WHERE i.indrelid = 'audit_auditlog'::regclass AND i.indisprimary"
+        )
+        self.assertEqual({row[0] for row in primary_key}, {'id', 'timestamp'})
+
+    def test_ensure_and_detach(self):
+        """Test ensure moves a month out of the default partition, and detach takes it out of the table."""
+        month = parse_month('2099-05')
+        AuditLog.all_objects.create(
+            user=self.user, action='UPDATE', target_type_id=1, target_id=self.user.pk,
+            timestamp=month + datetime.timedelta(days=3)
+        )
+        seal(block_size=1)
+        self.assertEqual(self.partitions.ensure([month]), ['audit_auditlog_p2099_05'])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM audit_auditlog_p2099_05'), [(1,)])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM audit_auditlog_default'), [(0,)])
+
+        self.partitions.detach(month)
+        self.assertIn(('audit_auditlog_p2099_05', month, True), self.partitions.partitions())
+        self.assertFalse(AuditLog.all_objects.exists())
+
+class AuditQueryTestCase(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.admin = User.objects.create_superuser(username='auditadmin', password='testpass123')
+        self.user = User.objects.create_user(username='viewer', password='testpass123')
+        self.user_type = ContentType.objects.get_for_model(User)
+        base = datetime.datetime(2025, 5, 1, tzinfo=datetime.timezone.utc)
+        # Pairs share a timestamp so pages must break ties on id
+        self.entries = [
+            AuditLog.all_objects.create(
+                user=self.user if i % 2 else self.admin, action='UPDATE' if i % 3 else 'DELETE',
+                target_type=self.user_type, target_id=i, timestamp=base + datetime.timedelta(minutes=i // 2)
+            )
+            for i in range(10)
+        ]
+
+    def get(self, as_user=None, **params):
+        request = self.factory.get('/api/v1/audit/', params)
+        force_authenticate(request, user=as_user or self.admin)
+        return AuditLogListView.as_view()(request)
+
+    def test_cursor_pages_cover_every_entry_once(self):
+        """Test following next cursors returns each entry once, newest first."""
+        seen = []
+        response = self.get(page_size=3)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(entry['id'] for entry in response.data['results'])
+            if not response.data['next']:
+                break
+            cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+            response = self.get(page_size=3, cursor=cursor)
+        expected = sorted(self.entries, key=lambda entry: (entry.timestamp, entry.pk), reverse=True)
+        self.assertEqual(seen, [entry.pk for entry in expected])
+
+    def test_deep_pages_seek_instead_of_offset(self):
+        """Test later pages filter on the cursor key rather than skipping rows."""
+        _, cursor = paginate(AuditLog.objects.all(), page_size=4)
+        with CaptureQueriesContext(connection) as queries:
+            entries, _ = paginate(AuditLog.objects.all(), cursor, page_size=4)
+        self.assertEqual(len(entries), 4)
+        self.assertNotIn('OFFSET', queries[0]['sql'].upper())
+
+    def test_filters(self):
+        """Test user, action, target and time range filters."""
+        response = self.get(user=self.user.pk, action='UPDATE')
+        self.assertEqual(
+            {entry['id'] for entry in response.data['results']},
+            {entry.pk for entry in self.entries if entry.user == self.user and entry.action == 'UPDATE'}
+        )
+        response = self.get(target_type='accounts.customuser', target_id=4)
+        self.assertEqual([entry['id'] for entry in response.data['results']], [self.entries[4].pk])
+        self.assertEqual(response.data['results'][0]['target_type'], 'accounts.customuser')
+        response = self.get(since='2025-05-01T00:01:00Z', until='2025-05-01T00:03:00Z')
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_bad_parameters_are_rejected(self):
+        """Test malformed cursors and filters return 400."""
+        self.assertEqual(self.get(cursor='not-a-cursor').status_code, 400)
+        self.assertEqual(self.get(since='yesterday').status_code, 400)
+        self.assertEqual(self.get(target_type='nope.nothing').status_code, 400)
+
+    def export(self, **params):
+        request = self.factory.get('/api/v1/audit/export/', params)
+        force_authenticate(request, user=self.admin)
+        response = AuditLogExportView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_export_ndjson_streams_every_entry(self):
+        """Test the NDJSON export holds one line per entry, newest first."""
+        lines = [json.loads(line) for line in self.export(user=self.user.pk).decode().splitlines()]
+        expected = sorted(
+            (entry for entry in self.entries if entry.user == self.user),
+            key=lambda entry: (entry.timestamp, entry.pk), reverse=True
+        )
+        self.assertEqual([line['id'] for line in lines], [entry.pk for entry in expected])
+        self.assertEqual(lines[0]['username'], 'viewer')
+        self.assertEqual(lines[0]['target_type'], 'accounts.customuser')
+
+    def test_export_resumes_from_row_cursor(self):
+        """Test passing a row's cursor back resumes the export right after it."""
+        lines = self.export().decode().splitlines()
+        resumed = self.export(cursor=json.loads(lines[3])['cursor']).decode().splitlines()
+        self.assertEqual(resumed, lines[4:])
+
+    def test_export_gzipped_csv(self):
+        """Test the CSV export can be gzipped and keeps metadata as JSON."""
+        self.entries[0].metadata = {'reason': 'audit'}
+        self.entries[0].save()
+        rows = list(csv.DictReader(gzip.decompress(self.export(format='csv', gzip='1')).decode().splitlines()))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(json.loads(rows[-1]['metadata']), {'reason': 'audit'})
+
+    def test_export_reads_in_chunks(self):
+        """Test entries are fetched lazily in chunks rather than all at once."""
+        chunks = export_audit_logs(AuditLog.objects.order_by('-timestamp', '-id'), chunk_size=3)
+        with CaptureQueriesContext(connection) as queries:
+            first = next(chunks)
+        self.assertEqual(len(first.decode().splitlines()), 10)
+        self.assertEqual(len(queries), 1)
+
+    def test_requires_audit_view(self):
+        """Test users without AUDIT_VIEW cannot list the audit log."""
+        self.assertEqual(self.get(as_user=self.user).status_code, 403)
+
+class AuditColdStorageTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='coldreader', password='testpass123')
+        self.user_type = ContentType.objects.get_for_model(User)
+        self.directory = tempfile.mkdtemp()
+        self.store = ColdStore(self.directory)
+        base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.entries = [
+            AuditLog.all_objects.create(
+                user=self.user if i % 2 else None, action='EXPORT' if i == 4 else 'UPDATE',
+                target_type=self.user_type, target_id=i, metadata={'n': i, 'note': 'line\nbreak'},
+                timestamp=base + datetime.timedelta(days=10 * i)
+            )
+            for i in range(8)
+        ]
+        seal(block_size=1)
+        self.cutoff = base + datetime.timedelta(days=60)
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.chmod(os.path.join(self.directory, name), 0o644)
+        shutil.rmtree(self.directory)
+
+    def test_compact_moves_old_entries_into_segments(self):
+        """Test old entries are written to segments with min/max ranges and deleted."""
+        created = self.store.compact(self.cutoff, segment_rows=4)
+        self.assertEqual([entry['rows'] for entry in created], [4, 2])
+        self.assertEqual(AuditLog.all_objects.count(), 2)
+        self.assertEqual(created[0]['min']['id'], self.entries[0].pk)
+        self.assertEqual(created[1]['max']['target_id'], 5)
+        self.assertEqual(created[1]['actions'], ['EXPORT', 'UPDATE'])
+        self.assertTrue(all(entry['deleted'] for entry in self.store.manifest()['segments']))
+
+    def test_compact_deletes_without_signals(self):
+        """Test compacted rows are deleted in bulk, without per-row delete signals."""
+        deleted = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted.append(instance.pk)
+
+        post_delete.connect(receiver, weak=False)
+        try:
+            self.store.compact(self.cutoff, segment_rows=4)
+        finally:
+            post_delete.disconnect(receiver)
+        self.assertEqual(AuditLog.all_objects.count(), 2)
+        self.assertEqual(deleted, [])
+
+    def test_query_scans_only_matching_segments(self):
+        """Test queries skip segments by range and return full rows."""
+        digest = AuditLog.all_objects.get(pk=self.entries[4].pk).digest
+        self.store.compact(self.cutoff, segment_rows=4)
+        start = self.entries[4].timestamp
+        self.assertEqual(len(self.store.candidates(start=start)), 1)
+        self.assertEqual(len(self.store.candidates(action='EXPORT')), 1)
+        self.assertEqual(len(self.store.candidates(target_id=7)), 0)
+
+        rows = list(self.store.query(start=start))
+        self.assertEqual([row['id'] for row in rows], [self.entries[4].pk, self.entries[5].pk])
+        self.assertEqual(rows[0]['timestamp'], self.entries[4].timestamp)
+        self.assertEqual(rows[0]['metadata'], {'n': 4, 'note': 'line\nbreak'})
+        self.assertEqual(rows[0]['event_id'], self.entries[4].event_id)
+        self.assertEqual((rows[0]['sequence'], rows[0]['digest']), (5, digest))
+        self.assertEqual(rows[0]['target_type'], 'accounts.customuser')
+        self.assertEqual([row['target_id'] for row in self.store.query(user=self.user.pk)], [1, 3, 5])
+        self.assertIsNone(next(self.store.query(action='EXPORT'))['user'])
+
+    def test_interrupted_compaction_is_finished(self):
+        """Test the next run deletes rows of unfinished segments and drops orphan files."""
+        self.store.compact(self.cutoff, segment_rows=10)
+        manifest = self.store.manifest()
+        manifest['segments'][0]['deleted'] = False
+        self.store._save_manifest(manifest)
+        survivor = self.entries[6]
+        # Old, but chained after entries newer than the cutoff
+        late = AuditLog.all_objects.create(
+            user=self.user, action='UPDATE', target_type=self.user_type, target_id=99,
+            timestamp=self.entries[0].timestamp
+        )
+        seal(block_size=1)
+        with open(os.path.join(self.directory, 'default-1-1.cold'), 'wb') as orphan:
+            orphan.write(b'partial')
+
+        self.store.compact(self.cutoff, segment_rows=10)
+        self.assertNotIn('default-1-1.cold', os.listdir(self.directory))
+        self.assertEqual(len(self.store.manifest()['segments']), 1)
+        self.assertTrue(self.store.manifest()['segments'][0]['deleted'])
+        self.assertEqual(
+            sorted(AuditLog.all_objects.values_list('id', flat=True)), [survivor.pk, self.entries[7].pk, late.pk]
+        )
+        self.assertEqual(len(list(self.store.query(target_id=99))), 0)
+
+    def test_compaction_keeps_chain_verifiable(self):
+        """Test only a sealed prefix is compacted and both halves still verify."""
+        AuditLog.all_objects.create(
+            action='UPDATE', target_type=self.user_type, target_id=98, timestamp=self.entries[0].timestamp
+        )
+        AuditLog.all_objects.create(
+            action='UPDATE', target_type=self.user_type, target_id=99, timestamp=self.entries[0].timestamp
+        )
+        seal(block_size=2)
+        self.store.compact(self.cutoff, segment_rows=4)
+        self.assertEqual(
+            sorted(AuditLog.all_objects.values_list('target_id', flat=True)), [6, 7, 98, 99]
+        )
+        self.assertIsNone(verify(full=True)['broken'])
+        archived = verify_archive(self.store)
+        self.assertEqual((archived['entries'], archived['broken']), (6, None))
+        self.assertEqual([row['sequence'] for row in self.store.query()], [1, 2, 3, 4, 5, 6])
+
+class AuditRollupTestCase(TestCase):
+    def setUp(self):
+        audit_writer.clear()
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create_superuser(username='counter', password='testpass123')
+        self.today = timezone.localdate()
+
+    def entry(self, action='UPDATE', user=None, days_ago=0):
+        return AuditLog(
+            user=user, action=action, target_type_id=1, target_id=1,
+            timestamp=timezone.now() - datetime.timedelta(days=days_ago)
+        )
+
+    def counts(self):
+        return {
+            (rollup.day, rollup.action, rollup.user_id): rollup.count
+            for rollup in AuditRollup.objects.all()
+        }
+
+    def test_writer_upserts_counts_per_batch(self):
+        """Test each flushed batch adds to the rollup rows in one upsert."""
+        writer = AuditWriter(batch_size=100, flush_interval=60, on_write=record_entries)
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                for _ in range(3):
+                    writer.log(self.entry(user=self.user))
+                writer.log(self.entry('DELETE'))
+            writer.flush()
+        self.assertEqual(self.counts(), {
+            (self.today, 'UPDATE', self.user.pk): 6,
+            (self.today, 'DELETE', 0): 2,
+        })
+
+    def test_reloaded_spool_entries_are_counted_once(self):
+        """Test entries loaded again after a crash do not inflate the rollups."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        spool = AuditSpool(directory.name)
+        self.addCleanup(spool.close)
+        writer = AuditWriter(flush_interval=60, spool=spool, on_write=record_entries)
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.log(self.entry(user=self.user))
+        writer.flush()
+        spool._segments[0].mark_drained(HEADER.size)
+        writer.flush()
+        self.assertEqual(self.counts(), {(self.today, 'UPDATE', self.user.pk): 1})
+
+    def test_drained_spool_entries_are_counted(self):
+        """Test entries loaded by drain_audit_spool reach the rollups."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        spool = AuditSpool(directory.name)
+        writer = AuditWriter(flush_interval=60, spool=spool)
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.log(self.entry(user=self.user), durable=True)
+        # Left behind by a stopped worker
+        spool.close()
+        with override_settings(AUDIT_SPOOL_DIR=directory.name):
+            call_command('drain_audit_spool', stdout=StringIO())
+        self.assertEqual(AuditLog.objects.count(), 1)
+        self.assertEqual(self.counts(), {(self.today, 'UPDATE', self.user.pk): 1})
+
+    def test_backfill_and_reconcile(self):
+        """Test reconcile reports drifted counts and backfill rebuilds them."""
+        AuditLog.all_objects.bulk_create([self.entry(days_ago=days) for days in (0, 0, 1, 3)])
+        start = self.today - datetime.timedelta(days=3)
+        self.assertEqual(len(reconcile(start, self.today)), 3)
+
+        backfill(start, self.today)
+        self.assertEqual(reconcile(start, self.today), [])
+        self.assertEqual(self.counts()[(self.today, 'UPDATE', 0)], 2)
+
+        AuditRollup.objects.filter(day=self.today).update(count=5)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('audit_rollups', 'reconcile', stdout=out)
+        self.assertIn('log has 2, rollup has 5', out.getvalue())
+        call_command('audit_rollups', 'reconcile', fix=True, stdout=StringIO())
+        self.assertEqual(reconcile(start, self.today), [])
+
+    def test_summary_reads_rollups(self):
+        """Test the summary endpoint groups rollup rows without touching AuditLog."""
+        log_actions([(self.user, 'UPDATE', self.user, {})] * 3 + [(self.user, 'DELETE', self.user, {})])
+        request = self.factory.get('/api/v1/audit/summary/', {'by': 'day'})
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = AuditSummaryView.as_view()(request)
+        self.assertEqual(response.data['results'], [{'day': self.today, 'count': 4}])
+        self.assertFalse(any('audit_auditlog' in query['sql'] for query in queries))
+
+        request = self.factory.get('/api/v1/audit/summary/', {'by': 'action'})
+        force_authenticate(request, user=self.user)
+        response = AuditSummaryView.as_view()(request)
+        self.assertEqual(
+            [(row['action'], row['count']) for row in response.data['results']], [('DELETE', 1), ('UPDATE', 3)]
+        )
+
+class AuditChainTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='notary', password='testpass123')
+        self.entries = [
+            AuditLog.all_objects.create(
+                user=self.user, action='UPDATE', target_type_id=1, target_id=i, metadata={'n': i}
+            )
+            for i in range(10)
+        ]
+        self.assertEqual(seal(block_size=4), 10)
+
+    def test_seal_chains_entries_and_checkpoints_blocks(self):
+        """Test entries are numbered in id order, chained, and full blocks checkpointed."""
+        rows = list(AuditLog.all_objects.order_by('id').values_list('sequence', 'digest'))
+        self.assertEqual([sequence for sequence, _ in rows], list(range(1, 11)))
+        self.assertEqual(len({digest for _, digest in rows}), 10)
+        checkpoints = list(AuditCheckpoint.objects.all())
+        self.assertEqual([(c.first_sequence, c.last_sequence) for c in checkpoints], [(1, 4), (5, 8)])
+        self.assertEqual(checkpoints[1].head, rows[7][1])
+        self.assertEqual(checkpoints[0].root, merkle_root([digest for _, digest in rows[:4]]))
+        self.assertEqual(seal(block_size=4), 0)
+
+    def test_verify_is_incremental(self):
+        """Test a second verification only re-hashes entries after the last verified block."""
+        first = verify()
+        self.assertIsNone(first['broken'])
+        self.assertEqual((first['entries'], first['blocks']), (10, 2))
+        AuditLog.all_objects.create(user=self.user, action='DELETE', target_type_id=1, target_id=99)
+        seal(block_size=4)
+        second = verify()
+        self.assertIsNone(second['broken'])
+        self.assertEqual((second['entries'], second['last_sequence']), (3, 11))
+
+    def test_changed_entry_is_first_broken_link(self):
+        """Test editing an entry is reported at its sequence."""
+        AuditLog.all_objects.filter(pk=self.entries[5].pk).update(action='READ')
+        broken = verify()['broken']
+        self.assertEqual((broken['sequence'], broken['id'], broken['reason']), (6, self.entries[5].pk, 'digest mismatch'))
+
+    def test_removed_entry_breaks_chain(self):
+        """Test deleting an entry leaves a gap that is reported."""
+        AuditLog.all_objects.filter(pk=self.entries[2].pk).delete()
+        broken = verify()['broken']
+        self.assertEqual(broken['sequence'], 3)
+        self.assertIn('missing', broken['reason'])
+
+    def test_rewritten_checkpoint_is_detected(self):
+        """Test a checkpoint that no longer matches its block is reported, and the command fails."""
+        AuditCheckpoint.objects.filter(block=1).update(root='f' * 64)
+        with self.assertRaisesMessage(CommandError, 'First broken link at sequence 5'):
+            call_command('audit_chain', 'verify', stdout=StringIO())
+        # Blocks before the break were still verified
+        self.assertIsNotNone(AuditCheckpoint.objects.get(block=0).verified_at)
+
+class AuditPromotedMetadataTestCase(TestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.admin = User.objects.create_superuser(username='auditadmin', password='testpass123')
+        self.user = User.objects.create_user(username='viewer', password='testpass123')
+        self.user_type = ContentType.objects.get_for_model(User)
+        self.entries = [
+            AuditLog.all_objects.create(
+                user=self.admin, action='UPDATE', target_type=self.user_type, target_id=i,
+                metadata={'target_user': 'alice' if i % 2 else 'bob', 'ip_address': f'10.0.0.{i}',
+                          'access_level': 'read' if i < 3 else 'write'}
+            )
+            for i in range(6)
+        ]
+
+    def get(self, **params):
+        request = self.factory.get('/api/v1/audit/', params)
+        force_authenticate(request, user=self.admin)
+        return AuditLogListView.as_view()(request)
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return sorted(entry['id'] for entry in response.data['results'])
+
+    def test_writes_fill_promoted_columns(self):
+        """Test saved and buffered entries copy promoted keys into their columns."""
+        entry = self.entries[1]
+        self.assertEqual((entry.meta_target_user, entry.meta_ip_address, entry.meta_name), ('alice', '10.0.0.1', None))
+        with self.captureOnCommitCallbacks(execute=True):
+            log_action(self.admin, 'UPDATE', self.user, {'name': 'n' * 300, 'target_user': {'nested': 1}})
+        audit_writer.flush()
+        logged = AuditLog.all_objects.get(target_id=self.user.id, meta_name__isnull=False)
+        self.assertEqual(logged.meta_name, 'n' * 255)
+        self.assertIsNone(logged.meta_target_user)
+
+    def test_promoted_filter_uses_column(self):
+        """Test filtering on a promoted key queries its column, not the JSON."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(target_user='alice')
+        self.assertEqual(self.ids(response), [entry.pk for entry in self.entries if entry.target_id % 2])
+        sql = next(query['sql'] for query in queries if 'audit_auditlog' in query['sql'])
+        self.assertIn('meta_target_user', sql)
+        self.assertEqual(self.ids(self.get(**{'metadata.ip_address': '10.0.0.4'})), [self.entries[4].pk])
+
+    def test_other_keys_fall_back_to_json(self):
+        """Test keys without a promoted column still filter through the JSON."""
+        response = self.get(**{'metadata.access_level': 'read'})
+        self.assertEqual(self.ids(response), [entry.pk for entry in self.entries[:3]])
+        self.assertEqual(self.get(**{'metadata.bad-key': 'x'}).status_code, 400)
+        with override_settings(AUDIT_PROMOTED_METADATA=[]):
+            response = self.get(**{'metadata.target_user': 'bob'})
+        self.assertEqual(self.ids(response), [entry.pk for entry in self.entries if not entry.target_id % 2])
+
+    def test_backfill_fills_older_rows(self):
+        """Test the backfill fills rows written before promotion, and can be rerun."""
+        AuditLog.all_objects.update(meta_target_user=None, meta_ip_address=None)
+        self.assertEqual(backfill_promoted(AuditLog, batch_size=4), 6)
+        self.assertEqual(AuditLog.all_objects.filter(meta_target_user='bob').count(), 3)
+        self.assertEqual(AuditLog.all_objects.get(pk=self.entries[5].pk).meta_ip_address, '10.0.0.5')
+        self.assertEqual(backfill_promoted(AuditLog), 0)
+        out = StringIO()
+        call_command('backfill_audit_metadata', database='default', stdout=out)
+        self.assertIn('for 0 entries in default', out.getvalue())
@@ -0,0 +1,341 @@
+# apps/audit/writer.py
+
+"""
+Buffered audit log writer.
+
+Entries are queued and written with one bulk_create per batch instead of
+one INSERT each. The queue is flushed when:
+
+    it holds AUDIT_BATCH_SIZE entries;
+    its oldest entry is AUDIT_FLUSH_INTERVAL seconds old, checked when an
+    entry is queued, when a request finishes and by a background thread
+    (AUDIT_FLUSH_THREAD, read when the thread would start; on unless
+    turned off, as the test runner does);
+    a durable entry is queued (see below);
+    the worker exits (atexit).
+
+Entries are never dropped. Once AUDIT_MAX_QUEUE entries are waiting, as
+when the database is unavailable, whoever queues the next one writes the
+backlog itself before going on, so callers slow down instead of the queue
+growing; if the write fails the entries stay queued for the next try.
+
+An entry logged inside a transaction is only queued once the transaction
+commits, so rolled-back actions are not audited, as before. A durable
+entry is flushed right after the commit that made it true instead of
+waiting for a threshold. Threshold flushes are put off while the calling
+thread is inside a transaction, so other entries never share its fate.
+
+With AUDIT_SPOOL_DIR set the queue is the on-disk spool of
+apps.audit.spool rather than memory. A durable entry is then synced to
+disk instead of written to the database, and when the background thread
+runs, only that thread touches the database, backing off while it is
+unavailable.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.tenants.context import get_current_tenant_id, tenant_context
+from .models import AuditLog
+from .rollups import record_entries
+from .spool import AuditSpool, encode_entry, decode_entry
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'AUDIT_BATCH_SIZE', 500)
+FLUSH_INTERVAL = getattr(settings, 'AUDIT_FLUSH_INTERVAL', 1.0)
+# Queue depth at which callers flush synchronously (backpressure)
+MAX_QUEUE = getattr(settings, 'AUDIT_MAX_QUEUE', 50000)
+# Longest pause between attempts while flushes keep failing
+MAX_RETRY_DELAY = 60
+
+class AuditWriter:
+    """Process-wide queue of rows (AuditLog by default) waiting to be inserted"""
+
+    def __init__(self, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_queue=MAX_QUEUE,
+                 use_thread=None, spool=None, model=AuditLog, transactional=True, on_write=None):
+        self.model = model
+        # Called with each tenant's inserted rows, inside the insert's transaction
+        self.on_write = on_write
+        # Whether rows logged in a transaction wait for its commit
+        self.transactional = transactional
+        self.batch_size = batch_size
+        # None follows AUDIT_FLUSH_THREAD
+        self.use_thread = use_thread
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.spool = spool
+        self._queue = []
+        # Entries appended to the spool since it was last drained
+        self._spooled = 0
+        self._oldest = None
+        self._failures = 0
+        self._retry_at = None
+        self._lock = threading.Lock()
+        # Serialises flushes so batches are written in order
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._exit_hook = False
+        self._stats = {
+            'queued': 0,
+            'written': 0,
+            'backpressure_flushes': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'last_flush_ms': None,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+        }
+
+    @property
+    def threaded(self):
+        """Whether a background thread flushes this writer"""
+        if self.use_thread is None:
+            return getattr(settings, 'AUDIT_FLUSH_THREAD', True)
+        return self.use_thread
+
+    def log(self, entry, durable=False):
+        """Queue an unsaved row; durable entries are flushed at commit"""
+        if entry.timestamp is None:
+            entry.timestamp = timezone.now()
+        if entry.tenant_id is None:
+            # bulk_create skips save(), so the active tenant is set here
+            entry.tenant_id = get_current_tenant_id()
+        if self.transactional and connection.in_atomic_block:
+            transaction.on_commit(lambda: self._enqueue(entry, durable))
+        else:
+            self._enqueue(entry, durable)
+
+    def _enqueue(self, entry, durable):
+        if self.spool is not None:
+            # On disk before anything else can go wrong
+            self.spool.append(encode_entry(entry), sync=durable)
+        with self._lock:
+            if not self._exit_hook:
+                atexit.register(self.close)
+                self._exit_hook = True
+                start_thread = self.threaded
+            else:
+                start_thread = False
+            self._stats['queued'] += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = False
+            if self.spool is not None:
+                self._spooled += 1
+            else:
+                self._queue.append(entry)
+                full = len(self._queue) >= self.max_queue
+        if start_thread:
+            # Started on first use so forked workers each get their own
+            self.start()
+        if self.spool is not None and self.threaded:
+            # Already durable; the drainer thread loads it
+            return
+        if full and not connection.in_atomic_block:
+            self._apply_backpressure()
+        elif durable and self.spool is None:
+            self.flush()
+        else:
+            self.flush_due()
+
+    def _apply_backpressure(self):
+        # Ignores the retry delay: the caller waits for the write rather
+        # than the queue outgrowing its bound
+        with self._lock:
+            self._stats['backpressure_flushes'] += 1
+        self.flush()
+        depth = self._depth()
+        if depth >= self.max_queue:
+            logger.error("Audit queue holds %d entries and cannot be written", depth)
+
+    def _depth(self):
+        return self._spooled if self.spool is not None else len(self._queue)
+
+    def due(self):
+        if self.spool is not None and not self.spool.pending():
+            return False
+        with self._lock:
+            if self._retry_at is not None and time.monotonic() < self._retry_at:
+                return False
+            if self.spool is None:
+                if not self._queue:
+                    return False
+            elif self._oldest is None:
+                # Records left by an earlier run or a failed drain
+                return True
+            if self._depth() >= self.batch_size:
+                return True
+            return time.monotonic() - self._oldest >= self.flush_interval
+
+    def flush_due(self):
+        """Flush if a threshold was reached and no transaction is open"""
+        if self.due() and not connection.in_atomic_block:
+            self.flush()
+
+    def flush(self):
+        """Write every queued entry; returns how many were written"""
+        with self._flush_lock:
+            if self.spool is not None:
+                return self._drain_spool()
+            written = 0
+            while True:
+                with self._lock:
+                    batch = self._queue[:self.batch_size]
+                    del self._queue[:self.batch_size]
+                    self._oldest = time.monotonic() if self._queue else None
+                if not batch:
+                    self._succeeded()
+                    return written
+                try:
+                    self._write_batch(batch)
+                except Exception:
+                    self._requeue(batch)
+                    self._failed(len(batch))
+                    return written
+                written += len(batch)
+
+    def _drain_spool(self):
+        with self._lock:
+            spooled = self._spooled
+            self._spooled = 0
+            self._oldest = None
+        try:
+            self.spool.sync()
+            written = self.spool.drain(self.load_payloads, self.batch_size)
+        except Exception:
+            with self._lock:
+                self._spooled += spooled
+            self._failed(spooled)
+            return 0
+        self._succeeded()
+        return written
+
+    def load_payloads(self, payloads):
+        """Insert spooled entries; ones already loaded before a crash are skipped by event id"""
+        self._write_batch([decode_entry(payload) for payload in payloads], reloading=True)
+
+    def _write_batch(self, batch, reloading=False):
+        started = time.perf_counter()
+        by_tenant = {}
+        for entry in batch:
+            by_tenant.setdefault(entry.tenant_id, []).append(entry)
+        # Each tenant's entries go to its own database when shards are used
+        with transaction.atomic():
+            for tenant_id, entries in by_tenant.items():
+                with tenant_context(tenant_id):
+                    manager = self.model._base_manager
+                    if reloading:
+                        # Left out rather than ignored on conflict, so
+                        # on_write only sees rows that are new
+                        loaded = set(manager.filter(
+                            event_id__in=[entry.event_id for entry in entries]
+                        ).values_list('event_id', flat=True))
+                        entries = [entry for entry in entries if entry.event_id not in loaded]
+                    manager.bulk_create(entries, ignore_conflicts=reloading)
+                    if self.on_write is not None and entries:
+                        self.on_write(entries)
+        self._record(len(batch), (time.perf_counter() - started) * 1000)
+
+    def _requeue(self, batch):
+        with self._lock:
+            self._queue[:0] = batch
+            self._oldest = time.monotonic()
+
+    def _failed(self, count):
+        with self._lock:
+            self._stats['failed_flushes'] += 1
+            self._failures += 1
+            self._retry_at = time.monotonic() + min(MAX_RETRY_DELAY, 2 ** (self._failures - 1))
+        logger.exception("Audit flush of %d entries failed", count)
+
+    def _succeeded(self):
+        with self._lock:
+            self._failures = 0
+            self._retry_at = None
+
+    def _record(self, count, elapsed_ms):
+        with self._lock:
+            stats = self._stats
+            stats['written'] += count
+            stats['flushes'] += 1
+            stats['last_flush_ms'] = round(elapsed_ms, 3)
+            stats['max_flush_ms'] = max(stats['max_flush_ms'], round(elapsed_ms, 3))
+            stats['total_flush_ms'] += elapsed_ms
+
+    def metrics(self):
+        """Queue depth and flush latency of this worker"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queue_depth'] = self._depth()
+            stats['oldest_age_s'] = round(time.monotonic() - self._oldest, 3) if self._oldest else 0
+        total = stats.pop('total_flush_ms')
+        stats['avg_flush_ms'] = round(total / stats['flushes'], 3) if stats['flushes'] else None
+        if self.spool is not None:
+            stats['spool'] = self.spool.metrics()
+        return stats
+
+    def start(self):
+        """Start the background thread flushing entries that wait too long"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            name = f'{self.model._meta.model_name}-writer'
+            self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                if self.spool is not None:
+                    # Bounds how long a spooled entry stays unsynced when idle
+                    self.spool.sync()
+                    self.spool.claim_orphans()
+                self.flush_due()
+            except Exception:
+                logger.exception("Audit writer thread failed")
+            finally:
+                # This thread has its own connection; do not hold it open
+                connection.close()
+
+    def close(self):
+        """Stop the background thread and drain the queue"""
+        self._stopping.set()
+        self.flush()
+        if self.spool is not None:
+            self.spool.close()
+
+    def clear(self):
+        """Drop queued entries without writing them"""
+        with self._lock:
+            self._queue.clear()
+            self._oldest = None
+
+def get_spool():
+    """The spool configured by AUDIT_SPOOL_DIR, or None"""
+    directory = getattr(settings, 'AUDIT_SPOOL_DIR', None)
+    if not directory:
+        return None
+    return AuditSpool(
+        directory,
+        segment_size=getattr(settings, 'AUDIT_SPOOL_SEGMENT_SIZE', 16 * 1024 * 1024),
+        fsync_batch=getattr(settings, 'AUDIT_SPOOL_FSYNC_BATCH', 64),
+        fsync_interval=getattr(settings, 'AUDIT_SPOOL_FSYNC_INTERVAL', 0.05),
+    )
+
+audit_writer = AuditWriter(spool=get_spool(), on_write=record_entries)
+
+def _request_finished(sender, **kwargs):
+    if audit_writer.spool is None or not audit_writer.threaded:
+        audit_writer.flush_due()
+
+request_finished.connect(_request_finished, dispatch_uid='audit_writer_flush')
@@ -1,7 +1,7 @@
 # apps/datasets/admin.py
 
 from django.contrib import admin
-from .models import Dataset, DatasetField, DatasetAccess
+from .models import Dataset, DatasetField, DatasetAccess, EffectiveDatasetAccess
 
 @admin.register(Dataset)
 class DatasetAdmin(admin.ModelAdmin):
@@ -24,4 +24,16 @@ class DatasetAccessAdmin(admin.ModelAdmin):
     list_filter = ['access_level', 'is_active', 'granted_at']
     search_fields = ['user__username', 'dataset__name']
     ordering = ['user__username', 'dataset__name']
-    date_hierarchy = 'granted_at' 
\ No newline at end of file
+    date_hierarchy = 'granted_at' 
+
+@admin.register(EffectiveDatasetAccess)
+class EffectiveDatasetAccessAdmin(admin.ModelAdmin):
+    list_display = ['user', 'dataset', 'access_level', 'source', 'expires_at']
+    list_filter = ['source', 'access_level']
+    search_fields = ['user__username', 'dataset__name']
+    ordering = ['user__username', 'dataset__name']
+    readonly_fields = ['user', 'dataset', 'access_level', 'source', 'expires_at']
+    
+    def has_add_permission(self, request):
+        """Rows are maintained from grants, ownership and roles."""
+        return False
@@ -0,0 +1,9 @@
+# apps/datasets/apps.py
+
+from django.apps import AppConfig
+
+class DatasetsConfig(AppConfig):
+    name = 'apps.datasets'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,23 @@
+# apps/datasets/management/commands/rebuild_effective_access.py
+
+from django.core.management.base import BaseCommand
+
+from apps.datasets.services import refresh_effective_access
+
+class Command(BaseCommand):
+    help = 'Rebuild the EffectiveDatasetAccess table from grants, ownership and roles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help='Only rebuild rows of this user id (repeatable)')
+        parser.add_argument('--dataset', type=int, action='append', dest='dataset_ids',
+                            help='Only rebuild rows of this dataset id (repeatable)')
+        parser.add_argument('--database', help='Only this database (default: every shard)')
+
+    def handle(self, *args, **options):
+        count = refresh_effective_access(
+            user_ids=options['user_ids'],
+            dataset_ids=options['dataset_ids'],
+            databases=[options['database']] if options['database'] else None
+        )
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} effective access rows'))
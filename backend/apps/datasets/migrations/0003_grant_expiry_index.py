@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("datasets", "0002_effectivedatasetaccess"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="datasetaccess",
+            index=models.Index(
+                fields=["is_active", "expires_at"], name="datasetaccess_expiry_idx"
+            ),
+        ),
+    ]
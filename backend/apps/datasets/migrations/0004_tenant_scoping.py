@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0001_initial"),
+        ("datasets", "0003_grant_expiry_index"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="dataset",
+            options={
+                "base_manager_name": "all_objects",
+                "default_manager_name": "objects",
+            },
+        ),
+        migrations.AlterModelManagers(
+            name="dataset",
+            managers=[
+                ("objects", django.db.models.manager.Manager()),
+                ("all_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="dataset",
+            name="tenant",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Leave blank for global data",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="tenants.tenant",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dataset",
+            index=models.Index(
+                fields=["tenant", "is_active", "name"], name="dataset_tenant_active_idx"
+            ),
+        ),
+    ]
@@ -3,7 +3,9 @@
 from django.db import models
 from django.conf import settings
 
-class Dataset(models.Model):
+from apps.tenants.models import TenantAwareModel
+
+class Dataset(TenantAwareModel):
     """Dataset model for managing data access permissions."""
     name = models.CharField(max_length=255, unique=True)
     description = models.TextField(blank=True)
@@ -12,6 +14,11 @@ class Dataset(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
     
+    class Meta(TenantAwareModel.Meta):
+        indexes = [
+            models.Index(fields=['tenant', 'is_active', 'name'], name='dataset_tenant_active_idx'),
+        ]
+    
     def __str__(self):
         return self.name
 
@@ -57,6 +64,34 @@ class DatasetAccess(models.Model):
     
     class Meta:
         unique_together = ('user', 'dataset')
+        indexes = [
+            # Queue of active grants ordered by expiry, read by the expiry scheduler
+            models.Index(fields=['is_active', 'expires_at'], name='datasetaccess_expiry_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} -> {self.dataset.name} ({self.access_level})" 
+
+class EffectiveDatasetAccess(models.Model):
+    """
+    Denormalized dataset access: one row per user, dataset and the source
+    that grants it. Maintained by signals, rebuilt by rebuild_effective_access.
+    """
+    SOURCE_CHOICES = [
+        ('OWNER', 'Dataset Owner'),
+        ('GRANT', 'Dataset Access Grant'),
+        ('ADMIN_ROLE', 'Data Administrator Role'),
+        ('ROLE_PERMISSION', 'Role Permission'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='effective_dataset_access')
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='effective_access')
+    access_level = models.CharField(max_length=20, choices=DatasetAccess.ACCESS_LEVEL_CHOICES)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ('user', 'dataset', 'source')
     
     def __str__(self):
-        return f"{self.user.username} -> {self.dataset.name} ({self.access_level})" 
\ No newline at end of file
+        return f"{self.user_id} -> {self.dataset_id} ({self.access_level} via {self.source})"
@@ -0,0 +1,198 @@
+# apps/datasets/services.py
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.permissions.models import RoleClosure, RolePermission, UserRole
+from apps.permissions.context import DATA_ADMIN_ROLE
+from apps.permissions.explain import explain_step, NULL_STEP
+from apps.tenants.routers import get_shard_aliases
+from .models import Dataset, DatasetAccess, EffectiveDatasetAccess
+
+# Dataset permission types and the access level they imply, weakest first
+PERMISSION_ACCESS_LEVELS = {
+    'DATASET_READ': 'READ',
+    'DATASET_WRITE': 'WRITE',
+    'DATASET_ADMIN': 'ADMIN',
+}
+ACCESS_LEVEL_RANK = {'READ': 1, 'WRITE': 2, 'ADMIN': 3}
+
+def _combine(current, candidate):
+    """
+    Merge two (access_level, expires_at) pairs backing the same row. The
+    stronger level wins; for equal levels the later expiry (None is never)
+    is kept.
+    """
+    current_rank = ACCESS_LEVEL_RANK[current[0]]
+    candidate_rank = ACCESS_LEVEL_RANK[candidate[0]]
+    if candidate_rank != current_rank:
+        return candidate if candidate_rank > current_rank else current
+    if current[1] is None or candidate[1] is None:
+        return (current[0], None)
+    return (current[0], max(current[1], candidate[1]))
+
+def compute_effective_access(user_ids=None, dataset_ids=None, using=None):
+    """
+    Compute effective access rows of the datasets in one database (the
+    routed one by default), optionally restricted to some users and/or
+    datasets. Returns a dict keyed by (user_id, dataset_id, source)
+    holding (access_level, expires_at).
+    """
+    rows = {}
+
+    def add(user_id, dataset_id, source, level, expires_at):
+        key = (user_id, dataset_id, source)
+        if key in rows:
+            rows[key] = _combine(rows[key], (level, expires_at))
+        else:
+            rows[key] = (level, expires_at)
+
+    # Access is materialized for every tenant, whoever triggered the refresh
+    datasets = Dataset.all_objects.using(using)
+    if dataset_ids is not None:
+        datasets = datasets.filter(id__in=dataset_ids)
+    datasets = list(datasets.values_list('id', 'name', 'created_by_id'))
+    datasets_by_name = {name: dataset_id for dataset_id, name, _ in datasets}
+
+    # Ownership
+    for dataset_id, _, owner_id in datasets:
+        if user_ids is None or owner_id in user_ids:
+            add(owner_id, dataset_id, 'OWNER', 'ADMIN', None)
+
+    # Direct grants
+    grants = DatasetAccess.objects.using(using).filter(is_active=True)
+    if user_ids is not None:
+        grants = grants.filter(user_id__in=user_ids)
+    if dataset_ids is not None:
+        grants = grants.filter(dataset_id__in=dataset_ids)
+    for user_id, dataset_id, level, expires_at in grants.values_list(
+        'user_id', 'dataset_id', 'access_level', 'expires_at'
+    ):
+        add(user_id, dataset_id, 'GRANT', level, expires_at)
+
+    # Role based access: the Data Administrator role and dataset permissions
+    role_grants = {}
+    for role_id, permission_type, resource in RolePermission.objects.filter(
+        permission__permission_type__in=PERMISSION_ACCESS_LEVELS
+    ).values_list('role_id', 'permission__permission_type', 'permission__resource'):
+        role_grants.setdefault(role_id, []).append((PERMISSION_ACCESS_LEVELS[permission_type], resource))
+
+    # Assigned roles expanded to the roles they inherit from
+    # (filtered in one call so every condition applies to the same assignment)
+    assignment = {'descendant__userrole__is_active': True}
+    if user_ids is not None:
+        assignment['descendant__userrole__user_id__in'] = user_ids
+    user_roles = RoleClosure.objects.filter(
+        Q(ancestor__name=DATA_ADMIN_ROLE) | Q(ancestor_id__in=list(role_grants)),
+        **assignment
+    ).values_list(
+        'descendant__userrole__user_id', 'ancestor_id', 'ancestor__name', 'descendant__userrole__expires_at'
+    )
+    # Assigned roles themselves, in case their closure self row is missing
+    assigned = UserRole.objects.filter(
+        Q(role__name=DATA_ADMIN_ROLE) | Q(role_id__in=list(role_grants)), is_active=True
+    )
+    if user_ids is not None:
+        assigned = assigned.filter(user_id__in=user_ids)
+    assigned = assigned.values_list('user_id', 'role_id', 'role__name', 'expires_at')
+    for user_id, role_id, role_name, expires_at in user_roles.union(assigned):
+        if role_name == DATA_ADMIN_ROLE:
+            for dataset_id, _, _ in datasets:
+                add(user_id, dataset_id, 'ADMIN_ROLE', 'ADMIN', expires_at)
+        for level, resource in role_grants.get(role_id, ()):
+            if resource == 'all':
+                for dataset_id, _, _ in datasets:
+                    add(user_id, dataset_id, 'ROLE_PERMISSION', level, expires_at)
+            elif resource in datasets_by_name:
+                add(user_id, datasets_by_name[resource], 'ROLE_PERMISSION', level, expires_at)
+
+    return rows
+
+def refresh_effective_access(user_ids=None, dataset_ids=None, databases=None):
+    """
+    Recompute the effective access rows for the given users and/or
+    datasets, or for everything when neither is given, in each of the
+    given databases (every shard by default)
+    """
+    if user_ids is not None:
+        user_ids = set(user_ids)
+    if dataset_ids is not None:
+        dataset_ids = set(dataset_ids)
+
+    count = 0
+    for database in databases or get_shard_aliases():
+        rows = compute_effective_access(user_ids, dataset_ids, using=database)
+
+        # Rows are upserted and only rows that no longer apply are deleted,
+        # so refreshes of the same user running at once cannot collide on
+        # the (user, dataset, source) constraint
+        with transaction.atomic(using=database):
+            existing = EffectiveDatasetAccess.objects.using(database)
+            if user_ids is not None:
+                existing = existing.filter(user_id__in=user_ids)
+            if dataset_ids is not None:
+                existing = existing.filter(dataset_id__in=dataset_ids)
+            stale = [
+                pk for pk, *key in existing.values_list('id', 'user_id', 'dataset_id', 'source')
+                if tuple(key) not in rows
+            ]
+            for start in range(0, len(stale), 1000):
+                # Nothing depends on these rows, so no cascade or signal is needed
+                EffectiveDatasetAccess.objects.using(database).filter(
+                    id__in=stale[start:start + 1000]
+                )._raw_delete(database)
+
+            EffectiveDatasetAccess.objects.using(database).bulk_create(
+                [
+                    EffectiveDatasetAccess(
+                        user_id=user_id,
+                        dataset_id=dataset_id,
+                        source=source,
+                        access_level=level,
+                        expires_at=expires_at
+                    )
+                    for (user_id, dataset_id, source), (level, expires_at) in rows.items()
+                ],
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['user', 'dataset', 'source'],
+                update_fields=['access_level', 'expires_at']
+            )
+        count += len(rows)
+    return count
+
+def refresh_effective_access_on_commit(user_ids=None, dataset_ids=None, using=None):
+    """
+    Schedule a refresh once the current transaction commits, so cascading
+    deletes have finished and rolled back writes are never materialized.
+    using is the database of a changed sharded row, which only affects
+    that shard; changes to global rows (roles, permissions) refresh every
+    shard.
+    """
+    user_ids = set(user_ids) if user_ids is not None else None
+    dataset_ids = set(dataset_ids) if dataset_ids is not None else None
+    if user_ids == set() or dataset_ids == set():
+        return
+    databases = [using] if using is not None else None
+    transaction.on_commit(lambda: refresh_effective_access(user_ids, dataset_ids, databases), using=using)
+
+def rebuild_effective_access():
+    """Recompute the whole effective access table of every shard"""
+    return refresh_effective_access()
+
+def current_effective_access(user):
+    """Effective access rows of a user that have not expired"""
+    return EffectiveDatasetAccess.objects.filter(
+        Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+        user=user
+    )
+
+def accessible_dataset_ids(user):
+    """Subquery of dataset ids the user can currently reach"""
+    with explain_step('accessible_datasets', user_id=user.pk) as step:
+        subquery = current_effective_access(user).values('dataset_id')
+        if step is not NULL_STEP:
+            # The subquery runs inside the caller's query, so show its SQL here
+            step.update(source='effective_access', subquery=str(subquery.query))
+        return subquery
@@ -0,0 +1,51 @@
+# apps/datasets/signals.py
+
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from apps.permissions.models import Role, Permission, RolePermission, UserRole
+from apps.permissions.hierarchy import descendant_role_ids
+from apps.tenants.routers import is_global_row
+from .models import Dataset, DatasetAccess
+from .services import refresh_effective_access_on_commit
+
+@receiver([post_save, post_delete], sender=DatasetAccess)
+def dataset_access_changed(sender, instance, using, **kwargs):
+    refresh_effective_access_on_commit(
+        user_ids=[instance.user_id], dataset_ids=[instance.dataset_id], using=using
+    )
+
+@receiver(post_save, sender=Dataset)
+def dataset_saved(sender, instance, using, **kwargs):
+    """New datasets pick up owner and role based access; renames can change resource matches"""
+    # Global datasets are mirrored into every shard
+    refresh_effective_access_on_commit(
+        dataset_ids=[instance.pk], using=None if is_global_row(instance) else using
+    )
+
+@receiver([post_save, post_delete], sender=UserRole)
+def user_role_changed(sender, instance, **kwargs):
+    refresh_effective_access_on_commit(user_ids=[instance.user_id])
+
+@receiver([post_save, post_delete], sender=RolePermission)
+def role_permission_changed(sender, instance, **kwargs):
+    user_ids = UserRole.objects.filter(
+        role_id__in=descendant_role_ids(instance.role_id)
+    ).values_list('user_id', flat=True)
+    refresh_effective_access_on_commit(user_ids=set(user_ids))
+
+@receiver(post_save, sender=Role)
+@receiver(pre_delete, sender=Role)
+def role_changed(sender, instance, **kwargs):
+    """Users of every role inheriting from this one are affected"""
+    user_ids = UserRole.objects.filter(
+        role_id__in=descendant_role_ids(instance.pk)
+    ).values_list('user_id', flat=True)
+    refresh_effective_access_on_commit(user_ids=set(user_ids))
+
+@receiver(post_save, sender=Permission)
+def permission_saved(sender, instance, **kwargs):
+    user_ids = UserRole.objects.filter(
+        role__ancestor_links__ancestor__rolepermission__permission=instance
+    ).values_list('user_id', flat=True)
+    refresh_effective_access_on_commit(user_ids=set(user_ids))
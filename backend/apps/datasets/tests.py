@@ -1,8 +1,15 @@
 # apps/datasets/tests.py
 
+from datetime import timedelta
+from io import StringIO
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
-from apps.datasets.models import Dataset, DatasetField
+from django.core.management import call_command
+from django.utils import timezone
+from apps.datasets.models import Dataset, DatasetField, DatasetAccess, EffectiveDatasetAccess
+from apps.datasets.services import accessible_dataset_ids, refresh_effective_access_on_commit
+from apps.permissions.models import Role, Permission, RolePermission, UserRole
 
 User = get_user_model()
 
@@ -55,4 +62,96 @@ class DatasetsTestCase(TestCase):
         )
         
         expected = f'{self.dataset.name}.test_field'
-        self.assertEqual(str(field), expected)
\ No newline at end of file
+        self.assertEqual(str(field), expected)
+
+class EffectiveDatasetAccessTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.reader = User.objects.create_user(username='reader', password='testpass123')
+        self.admin = User.objects.create_user(username='admin', password='testpass123')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dataset = Dataset.objects.create(name='census', created_by=self.owner)
+            self.other = Dataset.objects.create(name='payroll', created_by=self.owner)
+            admin_role = Role.objects.create(name='Data Administrator')
+            UserRole.objects.create(user=self.admin, role=admin_role)
+
+    def sources(self, user):
+        return set(
+            EffectiveDatasetAccess.objects.filter(user=user)
+            .values_list('dataset__name', 'source', 'access_level')
+        )
+
+    def test_owner_and_admin_rows(self):
+        """Test owners and Data Administrators are materialized."""
+        self.assertEqual(self.sources(self.owner), {
+            ('census', 'OWNER', 'ADMIN'),
+            ('payroll', 'OWNER', 'ADMIN'),
+        })
+        self.assertEqual(self.sources(self.admin), {
+            ('census', 'ADMIN_ROLE', 'ADMIN'),
+            ('payroll', 'ADMIN_ROLE', 'ADMIN'),
+        })
+
+    def test_grant_and_revoke(self):
+        """Test dataset grants are added and removed incrementally."""
+        with self.captureOnCommitCallbacks(execute=True):
+            access = DatasetAccess.objects.create(user=self.reader, dataset=self.dataset)
+        self.assertEqual(self.sources(self.reader), {('census', 'GRANT', 'READ')})
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            access.is_active = False
+            access.save()
+        self.assertEqual(self.sources(self.reader), set())
+
+    def test_role_permission_on_all_resources(self):
+        """Test a role permission on 'all' reaches every dataset."""
+        with self.captureOnCommitCallbacks(execute=True):
+            role = Role.objects.create(name='Analyst')
+            UserRole.objects.create(user=self.reader, role=role)
+            permission = Permission.objects.create(
+                name='DATASET_VIEW', permission_type='DATASET_READ', resource='all'
+            )
+            RolePermission.objects.create(role=role, permission=permission)
+        self.assertEqual(self.sources(self.reader), {
+            ('census', 'ROLE_PERMISSION', 'READ'),
+            ('payroll', 'ROLE_PERMISSION', 'READ'),
+        })
+
+    def test_expired_grants_are_not_accessible(self):
+        """Test expired rows are excluded from catalog lookups."""
+        with self.captureOnCommitCallbacks(execute=True):
+            DatasetAccess.objects.create(
+                user=self.reader,
+                dataset=self.dataset,
+                expires_at=timezone.now() - timedelta(minutes=1)
+            )
+            DatasetAccess.objects.create(user=self.reader, dataset=self.other)
+        accessible = Dataset.objects.filter(id__in=accessible_dataset_ids(self.reader))
+        self.assertEqual(list(accessible.values_list('name', flat=True)), ['payroll'])
+
+    def test_refresh_updates_rows_in_place(self):
+        """Test a refresh upserts rows that still apply and deletes only the others."""
+        with self.captureOnCommitCallbacks(execute=True):
+            access = DatasetAccess.objects.create(user=self.reader, dataset=self.dataset)
+            DatasetAccess.objects.create(user=self.reader, dataset=self.other)
+        before = dict(EffectiveDatasetAccess.objects.filter(user=self.reader).values_list('dataset_id', 'id'))
+
+        DatasetAccess.objects.filter(user=self.reader, dataset=self.other).update(is_active=False)
+        access.access_level = 'WRITE'
+        with self.captureOnCommitCallbacks(execute=True):
+            access.save()
+            refresh_effective_access_on_commit(user_ids=[self.reader.pk])
+        rows = list(EffectiveDatasetAccess.objects.filter(user=self.reader).values_list('id', 'access_level'))
+        self.assertEqual(rows, [(before[self.dataset.pk], 'WRITE')])
+
+    def test_rebuild_matches_incremental_state(self):
+        """Test a full rebuild reproduces the incrementally maintained rows."""
+        with self.captureOnCommitCallbacks(execute=True):
+            DatasetAccess.objects.create(user=self.reader, dataset=self.dataset, access_level='WRITE')
+        before = set(EffectiveDatasetAccess.objects.values_list('user_id', 'dataset_id', 'source', 'access_level'))
+        
+        EffectiveDatasetAccess.objects.all().delete()
+        call_command('rebuild_effective_access', stdout=StringIO())
+        after = set(EffectiveDatasetAccess.objects.values_list('user_id', 'dataset_id', 'source', 'access_level'))
+        self.assertEqual(before, after)
@@ -5,7 +5,7 @@ from .models import Role, Permission, RolePermission, UserRole, PermissionPolicy
 
 @admin.register(Role)
 class RoleAdmin(admin.ModelAdmin):
-    list_display = ['name', 'description', 'is_active', 'created_at']
+    list_display = ['name', 'description', 'parent', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at']
     search_fields = ['name', 'description']
     ordering = ['name']
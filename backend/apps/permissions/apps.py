@@ -0,0 +1,9 @@
+# apps/permissions/apps.py
+
+from django.apps import AppConfig
+
+class PermissionsConfig(AppConfig):
+    name = 'apps.permissions'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,134 @@
+# apps/permissions/cache.py
+
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import RoleClosure, UserRole
+from .invalidation import bus
+from .explain import explain_step
+
+SNAPSHOT_KEY = 'permissions:snapshot:{}:{}:{}'
+
+# How long a compiled snapshot lives in the shared cache. Snapshots are keyed
+# by version, so this only bounds memory, not staleness.
+SNAPSHOT_TIMEOUT = getattr(settings, 'PERMISSION_SNAPSHOT_TIMEOUT', 60 * 60)
+LOCAL_CACHE_SIZE = getattr(settings, 'PERMISSION_SNAPSHOT_LOCAL_SIZE', 1024)
+
+class PermissionSnapshot:
+    """
+    Compiled view of a user's active roles and permission names
+    at a given permission version
+    """
+    __slots__ = ('user_id', 'version', 'role_ids', 'roles', 'permissions')
+
+    def __init__(self, user_id, version, role_ids, roles, permissions):
+        self.user_id = user_id
+        self.version = version
+        self.role_ids = frozenset(role_ids)
+        self.roles = frozenset(roles)
+        self.permissions = frozenset(permissions)
+
+    def to_cache(self):
+        """Plain tuple form stored in the shared cache"""
+        return (tuple(self.role_ids), tuple(self.roles), tuple(self.permissions))
+
+    @classmethod
+    def from_cache(cls, user_id, version, data):
+        role_ids, roles, permissions = data
+        return cls(user_id, version, role_ids, roles, permissions)
+
+_local_snapshots = OrderedDict()
+_local_lock = threading.Lock()
+
+def get_global_permission_version():
+    """Return the version shared by every user's snapshot"""
+    return bus.version('global')
+
+def get_permission_version(user_id):
+    """Return the (global, user) permission version pair for a user"""
+    return bus.versions([('global', None), ('user', user_id)])
+
+def bump_permission_version(user_id=None):
+    """
+    Move the permission version forward in every worker. With a user id
+    only that user's snapshots are invalidated, otherwise every snapshot
+    is. Returns the new version.
+    """
+    if user_id is not None:
+        return bus.publish('user', user_id)
+    return bus.publish('global')
+
+def bump_role_versions(role_ids):
+    """Tell every worker the grants of these roles changed"""
+    for role_id in set(role_ids):
+        bus.publish('role', role_id)
+
+def get_policy_version():
+    """Return the version of the active PermissionPolicy set"""
+    return bus.version('policy')
+
+def bump_policy_version():
+    return bus.publish('policy')
+
+def build_permission_snapshot(user_id, version):
+    """
+    Load roles and permission names for a user in a single query. Assigned
+    roles are expanded to every role they inherit from through the closure
+    table, and count themselves even when their closure rows are missing
+    (roles written by bulk_create, fixtures or raw SQL).
+    """
+    role_ids, roles, permissions = set(), set(), set()
+    fields = ('role_id', 'role__name', 'role__rolepermission__permission__name')
+    assigned = UserRole.objects.filter(user_id=user_id, is_active=True).values_list(*fields)
+    inherited = RoleClosure.objects.filter(
+        descendant__userrole__user_id=user_id,
+        descendant__userrole__is_active=True
+    ).values_list('ancestor_id', 'ancestor__name', 'ancestor__rolepermission__permission__name')
+    rows = assigned.union(inherited)
+    for role_id, role_name, permission_name in rows:
+        role_ids.add(role_id)
+        roles.add(role_name)
+        if permission_name is not None:
+            permissions.add(permission_name)
+    return PermissionSnapshot(user_id, version, role_ids, roles, permissions)
+
+def get_permission_snapshot(user):
+    """
+    Return the permission snapshot for a user, checking the in-process
+    cache, then the shared cache, then the database
+    """
+    user_id = user.pk
+    with explain_step('permission_snapshot', user_id=user_id) as step:
+        version = get_permission_version(user_id)
+
+        with _local_lock:
+            snapshot = _local_snapshots.get(user_id)
+            if snapshot is not None and snapshot.version == version:
+                _local_snapshots.move_to_end(user_id)
+                step.update(source='snapshot', cache='local')
+                return snapshot
+
+        key = SNAPSHOT_KEY.format(user_id, *version)
+        data = cache.get(key)
+        if data is not None:
+            snapshot = PermissionSnapshot.from_cache(user_id, version, data)
+            step.update(source='snapshot', cache='shared')
+        else:
+            snapshot = build_permission_snapshot(user_id, version)
+            cache.set(key, snapshot.to_cache(), SNAPSHOT_TIMEOUT)
+            step.update(source='role_closure', cache='miss')
+
+        with _local_lock:
+            _local_snapshots[user_id] = snapshot
+            _local_snapshots.move_to_end(user_id)
+            while len(_local_snapshots) > LOCAL_CACHE_SIZE:
+                _local_snapshots.popitem(last=False)
+        return snapshot
+
+def clear_local_snapshots():
+    """Drop every snapshot held by this process"""
+    with _local_lock:
+        _local_snapshots.clear()
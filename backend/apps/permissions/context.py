@@ -0,0 +1,158 @@
+# apps/permissions/context.py
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import get_permission_snapshot
+from .policies import dataset_policy_engine
+from .explain import explain_step
+
+DATA_ADMIN_ROLE = 'Data Administrator'
+
+class AuthorizationContext:
+    """
+    Request-scoped authorization facts for the current user.
+    Everything is resolved lazily on first use and reused for the
+    rest of the request.
+    """
+
+    def __init__(self, request):
+        self._request = request
+        self._user_id = None
+        self._snapshot = None
+        self._dataset_grants = None
+        self._policy_set = None
+
+    @property
+    def user(self):
+        return getattr(self._request, 'user', None)
+
+    def _bind(self):
+        """
+        Reset cached facts if the request user changed, e.g. once DRF has
+        authenticated a JWT user after the middleware ran
+        """
+        user = self.user
+        user_id = user.pk if user is not None and user.is_authenticated else None
+        if user_id != self._user_id:
+            self._user_id = user_id
+            self._snapshot = None
+            self._dataset_grants = None
+        return user_id
+
+    @property
+    def snapshot(self):
+        if self._bind() is None:
+            return None
+        if self._snapshot is None:
+            self._snapshot = get_permission_snapshot(self.user)
+        return self._snapshot
+
+    @property
+    def roles(self):
+        snapshot = self.snapshot
+        return snapshot.roles if snapshot is not None else frozenset()
+
+    @property
+    def permissions(self):
+        snapshot = self.snapshot
+        return snapshot.permissions if snapshot is not None else frozenset()
+
+    def has_role(self, *role_names):
+        """Check if the user holds any of the given roles"""
+        with explain_step('has_role', roles=role_names) as step:
+            roles = self.roles
+            held = [name for name in role_names if name in roles]
+            step.update(decision=bool(held), source=f'role:{held[0]}' if held else 'no_role')
+            return bool(held)
+
+    @property
+    def is_data_admin(self):
+        return self.has_role(DATA_ADMIN_ROLE)
+
+    @property
+    def dataset_grants(self):
+        """
+        Map of dataset id to access level for the user's active grants,
+        leaving out grants past their expiry that are not swept yet
+        """
+        user_id = self._bind()
+        if user_id is None:
+            return {}
+        with explain_step('dataset_grants', user_id=user_id) as step:
+            if self._dataset_grants is None:
+                from apps.datasets.models import DatasetAccess
+                self._dataset_grants = dict(
+                    DatasetAccess.objects.filter(
+                        Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+                        user_id=user_id, is_active=True
+                    ).values_list('dataset_id', 'access_level')
+                )
+                step.update(source='dataset_access', cache='miss')
+            else:
+                step.update(source='dataset_access', cache='request')
+            return self._dataset_grants
+
+    def has_dataset_grant(self, dataset):
+        dataset_id = getattr(dataset, 'pk', dataset)
+        return dataset_id in self.dataset_grants
+
+    @property
+    def dataset_policies(self):
+        """Compiled dataset access policies, loaded once per request"""
+        if self._policy_set is None:
+            self._policy_set = dataset_policy_engine.get_policy_set()
+        return self._policy_set
+
+    def can_read_dataset(self, dataset):
+        """
+        Data Administrators always can. Otherwise a matching dataset access
+        policy decides, falling back to the user's dataset grants.
+        """
+        with explain_step('can_read_dataset', dataset_id=getattr(dataset, 'pk', dataset)) as step:
+            if self._bind() is None:
+                step.update(decision=False, source='anonymous')
+                return False
+            if self.is_data_admin:
+                step.update(decision=True, source=f'role:{DATA_ADMIN_ROLE}')
+                return True
+            decision, policy = self.dataset_policies.match(
+                self.user, dataset, 'DATASET_READ', getattr(self._request, 'tenant', None)
+            )
+            if decision is not None:
+                step.update(decision=decision, source=f'policy:{policy.name}', policy_id=policy.id)
+                return decision
+            allowed = self.has_dataset_grant(dataset)
+            step.update(decision=allowed, source='dataset_grant' if allowed else 'no_grant')
+            return allowed
+
+    def readable_datasets(self, queryset):
+        """
+        Narrow a queryset of datasets the user can reach to those
+        can_read_dataset would not refuse: dataset policies denying the
+        user are applied to every row, in one evaluate_many batch
+        """
+        if self._bind() is None:
+            return queryset.none()
+        if self.is_data_admin:
+            return queryset
+        policy_set = self.dataset_policies
+        if not policy_set.can_deny('DATASET_READ'):
+            return queryset
+        with explain_step('readable_datasets', user_id=self._user_id) as step:
+            datasets = list(queryset)
+            decisions = policy_set.evaluate_many(
+                [(self.user, dataset) for dataset in datasets], 'DATASET_READ',
+                getattr(self._request, 'tenant', None)
+            )
+            denied = [dataset.pk for dataset, decision in zip(datasets, decisions) if decision is False]
+            step.update(source='policies', denied=len(denied))
+        return queryset.exclude(pk__in=denied) if denied else queryset
+
+def get_authz(request):
+    """Return the authorization context for a request, creating it if needed"""
+    authz = getattr(request, 'authz', None)
+    if authz is None:
+        authz = AuthorizationContext(request)
+        request.authz = authz
+    return authz
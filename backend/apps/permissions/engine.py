@@ -0,0 +1,261 @@
+# apps/permissions/engine.py
+
+import threading
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Permission, RolePermission, RoleClosure, UserRole
+from .cache import get_permission_snapshot, get_global_permission_version, LOCAL_CACHE_SIZE
+from .invalidation import bus
+from .explain import explain_step, NULL_STEP
+
+ALL_RESOURCES = 'all'
+
+# One bit per permission type, in declaration order
+PERMISSION_BITS = {
+    permission_type: 1 << index
+    for index, (permission_type, _) in enumerate(Permission.PERMISSION_TYPES)
+}
+
+# Permission bits implied by a DatasetAccess grant on a dataset
+ACCESS_LEVEL_BITS = {
+    'READ': PERMISSION_BITS['DATASET_READ'],
+    'WRITE': PERMISSION_BITS['DATASET_READ'] | PERMISSION_BITS['DATASET_WRITE'],
+    'ADMIN': PERMISSION_BITS['DATASET_READ'] | PERMISSION_BITS['DATASET_WRITE'] | PERMISSION_BITS['DATASET_ADMIN'],
+}
+
+def permission_mask(*permission_types):
+    """OR together the bits of the given permission types"""
+    mask = 0
+    for permission_type in permission_types:
+        mask |= PERMISSION_BITS.get(permission_type, 0)
+    return mask
+
+class UserPermissionMask:
+    """
+    Effective permission bits of one user, keyed by resource.
+    Built by OR-ing the masks of every role the user holds.
+    """
+    __slots__ = ('version', 'resources', 'wildcard', 'combined')
+
+    def __init__(self, version, resources):
+        self.version = version
+        self.resources = resources
+        self.wildcard = resources.get(ALL_RESOURCES, 0)
+        combined = 0
+        for mask in resources.values():
+            combined |= mask
+        self.combined = combined
+
+    def allows(self, bits, resource=None):
+        """Check the given bits on a resource, or on any resource if none given"""
+        if not resource:
+            return bool(self.combined & bits)
+        return bool((self.wildcard | self.resources.get(resource, 0)) & bits)
+
+class PermissionEngine:
+    """
+    In-memory permission engine.
+
+    Keeps a {resource: mask} table per role and caches the combined mask
+    per user next to their permission snapshot. Role masks are reloaded
+    one role at a time when the invalidation bus reports a role change,
+    whichever worker made it.
+    """
+
+    def __init__(self, max_users=LOCAL_CACHE_SIZE):
+        self.max_users = max_users
+        self._role_masks = {}
+        self._loaded = False
+        self._stale_roles = set()
+        self._user_masks = OrderedDict()
+        self._lock = threading.RLock()
+        bus.subscribe('role', self._role_changed)
+
+    def _role_changed(self, role_id, version):
+        with self._lock:
+            if role_id is None:
+                self._loaded = False
+            else:
+                self._stale_roles.add(int(role_id))
+            self._user_masks.clear()
+
+    def _load(self, queryset):
+        role_masks = {}
+        rows = queryset.values_list('role_id', 'permission__permission_type', 'permission__resource')
+        for role_id, permission_type, resource in rows:
+            resources = role_masks.setdefault(role_id, {})
+            resource = resource or ''
+            resources[resource] = resources.get(resource, 0) | PERMISSION_BITS.get(permission_type, 0)
+        return role_masks
+
+    def rebuild(self):
+        """Reload every role mask with one query"""
+        role_masks = self._load(RolePermission.objects.all())
+        with self._lock:
+            self._role_masks = role_masks
+            self._loaded = True
+            self._stale_roles.clear()
+            self._user_masks.clear()
+
+    def rebuild_roles(self, role_ids):
+        """Reload the masks of the given roles only"""
+        role_ids = set(role_ids)
+        role_masks = self._load(RolePermission.objects.filter(role_id__in=role_ids))
+        with self._lock:
+            for role_id in role_ids:
+                if role_id in role_masks:
+                    self._role_masks[role_id] = role_masks[role_id]
+                else:
+                    self._role_masks.pop(role_id, None)
+            self._stale_roles -= role_ids
+            self._user_masks.clear()
+
+    def _refresh(self):
+        """Bring role masks up to date with the changes seen so far"""
+        with self._lock:
+            if not self._loaded:
+                self.rebuild()
+            elif self._stale_roles:
+                self.rebuild_roles(self._stale_roles)
+
+    def role_mask(self, role_id):
+        bus.sync()
+        self._refresh()
+        return self._role_masks.get(role_id, {})
+
+    def user_mask(self, user):
+        """Return the combined permission mask for a user"""
+        snapshot = get_permission_snapshot(user)
+
+        with explain_step('user_mask', user_id=user.pk) as step, self._lock:
+            self._refresh()
+
+            mask = self._user_masks.get(user.pk)
+            if mask is not None and mask.version == snapshot.version:
+                self._user_masks.move_to_end(user.pk)
+                step.update(source='role_masks', cache='hit')
+                return mask
+
+            resources = {}
+            for role_id in snapshot.role_ids:
+                for resource, bits in self._role_masks.get(role_id, {}).items():
+                    resources[resource] = resources.get(resource, 0) | bits
+            mask = UserPermissionMask(snapshot.version, resources)
+            step.update(source='role_masks', cache='miss', roles=len(snapshot.role_ids))
+
+            self._user_masks[user.pk] = mask
+            while len(self._user_masks) > self.max_users:
+                self._user_masks.popitem(last=False)
+        return mask
+
+    def has_permission(self, user, permission_type, resource=None):
+        """
+        Check if user has a permission type, optionally on a resource.
+        Decided like check_many: dataset grants on the resource are only
+        loaded when the user's roles do not allow it.
+        """
+        with explain_step('has_permission', permission=permission_type, resource=resource) as step:
+            bits = PERMISSION_BITS.get(permission_type)
+            if not bits:
+                step.update(decision=False, source='unknown_permission_type')
+                return False
+            mask = self.user_mask(user)
+            grants = {}
+            if resource and user.pk is not None and not mask.allows(bits, resource):
+                grants = self.dataset_grants({user.pk}, {resource})
+            allowed = self._decide(mask, grants, user.pk, bits, resource)
+            if step is not NULL_STEP:
+                step.update(decision=allowed, source=self._rule(mask, bits, resource, allowed))
+            return allowed
+
+    @staticmethod
+    def dataset_grants(user_ids, resources):
+        """
+        Permission bits granted by active, unexpired dataset grants, keyed
+        by (user_id, dataset name). Grants past expires_at count as gone
+        before the expiry worker has switched them off.
+        """
+        from apps.datasets.models import DatasetAccess
+
+        grants = {}
+        rows = DatasetAccess.objects.filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+            user_id__in=user_ids,
+            dataset__name__in=resources,
+            is_active=True
+        ).values_list('user_id', 'dataset__name', 'access_level')
+        for user_id, dataset_name, access_level in rows:
+            key = (user_id, dataset_name)
+            grants[key] = grants.get(key, 0) | ACCESS_LEVEL_BITS.get(access_level, 0)
+        return grants
+
+    @staticmethod
+    def _decide(mask, grants, user_id, bits, resource):
+        return bool(bits) and (
+            mask.allows(bits, resource)
+            or bool(grants.get((user_id, resource), 0) & bits)
+        )
+
+    @staticmethod
+    def _rule(mask, bits, resource, allowed):
+        """Name the role permission or grant that decided a check, for explain mode"""
+        if not allowed:
+            return 'no_role_permission'
+        if not mask.allows(bits, resource):
+            return f'dataset_grant:{resource}'
+        if not resource:
+            return 'role_permission:any'
+        if mask.wildcard & bits:
+            return f'role_permission:{ALL_RESOURCES}'
+        return f'role_permission:{resource}'
+
+    def check_many(self, checks):
+        """
+        Answer a batch of (user_id, permission_type, resource) checks.
+
+        Role assignments (expanded to inherited roles) and dataset grants for
+        every user in the batch are loaded with one query each; role masks
+        come from the engine. Dataset grants apply when the resource names a
+        dataset. Returns a list of booleans in input order.
+        """
+        checks = list(checks)
+        with explain_step('check_many', checks=len(checks)) as step:
+            results = self._check_many(checks)
+            step.update(decision=sum(results), source='role_masks+dataset_grants')
+        return results
+
+    def _check_many(self, checks):
+        user_ids = {user_id for user_id, _, _ in checks}
+        resources = {resource for _, _, resource in checks if resource}
+
+        version = get_global_permission_version()
+        with self._lock:
+            self._refresh()
+            role_masks = self._role_masks
+
+        user_resources = {user_id: {} for user_id in user_ids}
+        # Assigned roles count even without their closure self row
+        assigned = UserRole.objects.filter(user_id__in=user_ids, is_active=True).values_list('user_id', 'role_id')
+        rows = assigned.union(RoleClosure.objects.filter(
+            descendant__userrole__user_id__in=user_ids,
+            descendant__userrole__is_active=True
+        ).values_list('descendant__userrole__user_id', 'ancestor_id'))
+        for user_id, role_id in rows:
+            resources_mask = user_resources[user_id]
+            for resource, bits in role_masks.get(role_id, {}).items():
+                resources_mask[resource] = resources_mask.get(resource, 0) | bits
+        masks = {
+            user_id: UserPermissionMask(version, resources_mask)
+            for user_id, resources_mask in user_resources.items()
+        }
+
+        grants = self.dataset_grants(user_ids, resources) if resources else {}
+        return [
+            self._decide(masks[user_id], grants, user_id, PERMISSION_BITS.get(permission_type, 0), resource)
+            for user_id, permission_type, resource in checks
+        ]
+
+permission_engine = PermissionEngine()
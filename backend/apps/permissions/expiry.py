@@ -0,0 +1,173 @@
+# apps/permissions/expiry.py
+
+"""
+Deactivation of expired role assignments and dataset grants.
+
+Active rows are read in expiry order through the (is_active, expires_at)
+indexes, so each pass only touches rows that are due. Rows are switched
+off with bulk updates, which bypass the model signals; the affected
+users' permission versions are bumped, their effective dataset access is
+refreshed and the audit entries are written here instead.
+
+Audit entries are written under the tenant they belong to: a dataset
+grant under its dataset's tenant, a role assignment (roles are global)
+under every tenant the user is an active member of.
+
+Dataset grants live in their tenant's shard, so every shard is scanned;
+an expired grant only refreshes effective access in its own shard.
+"""
+
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from apps.audit.services import log_actions
+from apps.tenants.context import tenant_context
+from apps.tenants.routers import get_shard_aliases
+from .models import UserRole
+from .cache import bump_permission_version
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_BATCH_SIZE = getattr(settings, 'GRANT_EXPIRY_BATCH_SIZE', 500)
+EXPIRY_INTERVAL = getattr(settings, 'GRANT_EXPIRY_INTERVAL', 60)
+
+def _due(queryset, now):
+    return queryset.filter(is_active=True, expires_at__lte=now).order_by('expires_at')
+
+def _expire_batch(queryset, now, batch_size, audit_entries):
+    """
+    Deactivate one batch of due rows. Returns the deactivated rows.
+    Rows locked by another worker are skipped where the database allows it.
+    """
+    database = queryset.db
+    with transaction.atomic(using=database):
+        rows = list(
+            _due(queryset, now).select_for_update(skip_locked=True, of=('self',))[:batch_size]
+        )
+        if not rows:
+            return rows
+        queryset.model.objects.using(database).filter(id__in=[row.id for row in rows]).update(is_active=False)
+        by_tenant = {}
+        for tenant_id, entry in audit_entries(rows):
+            by_tenant.setdefault(tenant_id, []).append(entry)
+        for tenant_id, entries in by_tenant.items():
+            with tenant_context(tenant_id):
+                log_actions(entries)
+    return rows
+
+def _roles_expired(user_roles):
+    """Audit entries for expired role assignments, one per tenant of the user"""
+    from apps.tenants.models import TenantUser
+
+    memberships = TenantUser.objects.filter(
+        user_id__in={user_role.user_id for user_role in user_roles}, is_active=True
+    ).values_list('user_id', 'tenant_id')
+    tenants = {}
+    for user_id, tenant_id in memberships:
+        tenants.setdefault(user_id, []).append(tenant_id)
+    for user_role in user_roles:
+        entry = (None, 'EXPIRE_ROLE', user_role.user, {
+            'role': user_role.role.name,
+            'expires_at': user_role.expires_at.isoformat()
+        })
+        for tenant_id in tenants.get(user_role.user_id, [None]):
+            yield tenant_id, entry
+
+def _accesses_expired(accesses):
+    """Audit entries for expired dataset grants, under the dataset's tenant"""
+    for access in accesses:
+        yield access.dataset.tenant_id, (None, 'EXPIRE_ACCESS', access.dataset, {
+            'target_user': access.user.username,
+            'access_level': access.access_level,
+            'expires_at': access.expires_at.isoformat()
+        })
+
+def expire_due_grants(now=None, batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Deactivate every role assignment and dataset grant whose expiry has
+    passed. Returns a dict with the number of rows expired per kind.
+    """
+    from apps.datasets.models import DatasetAccess
+    from apps.datasets.services import refresh_effective_access
+
+    now = now or timezone.now()
+    # (kind, rows, audit entries, database to refresh or None for every shard)
+    sources = [('roles', UserRole.objects.select_related('user', 'role'), _roles_expired, None)]
+    sources += [
+        ('dataset_access', DatasetAccess.objects.using(alias).select_related('user', 'dataset'),
+         _accesses_expired, alias)
+        for alias in get_shard_aliases()
+    ]
+
+    counts = {'roles': 0, 'dataset_access': 0}
+    refresh = {}
+    for kind, queryset, audit_entries, database in sources:
+        while True:
+            rows = _expire_batch(queryset, now, batch_size, audit_entries)
+            counts[kind] += len(rows)
+            refresh.setdefault(database, set()).update(row.user_id for row in rows)
+            if len(rows) < batch_size:
+                break
+
+    for user_id in set().union(*refresh.values()):
+        bump_permission_version(user_id=user_id)
+    for database, user_ids in refresh.items():
+        if user_ids:
+            refresh_effective_access(user_ids=user_ids, databases=[database] if database else None)
+
+    if any(counts.values()):
+        logger.info("Expired grants: %s", counts)
+    return counts
+
+def next_expiry():
+    """Earliest expiry among active grants, or None when nothing is scheduled"""
+    from apps.datasets.models import DatasetAccess
+
+    querysets = [UserRole.objects.all()] + [DatasetAccess.objects.using(alias) for alias in get_shard_aliases()]
+    upcoming = [
+        queryset.filter(is_active=True, expires_at__isnull=False)
+        .order_by('expires_at').values_list('expires_at', flat=True).first()
+        for queryset in querysets
+    ]
+    upcoming = [expires_at for expires_at in upcoming if expires_at is not None]
+    return min(upcoming) if upcoming else None
+
+def run_expiry_worker(interval=EXPIRY_INTERVAL, batch_size=EXPIRY_BATCH_SIZE, stop_event=None):
+    """
+    Expire grants as they come due until stop_event is set. Sleeps until
+    the next scheduled expiry, checking at least every interval seconds so
+    grants added meanwhile are picked up.
+    """
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            expire_due_grants(batch_size=batch_size)
+            upcoming = next_expiry()
+        except Exception:
+            logger.exception("Grant expiry pass failed")
+            upcoming = None
+
+        timeout = interval
+        if upcoming is not None:
+            timeout = min(interval, max((upcoming - timezone.now()).total_seconds(), 0))
+        stop_event.wait(timeout)
+
+def start_expiry_worker(interval=EXPIRY_INTERVAL, batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Run the expiry worker on a daemon thread in this process.
+    Returns (thread, stop_event).
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=run_expiry_worker,
+        kwargs={'interval': interval, 'batch_size': batch_size, 'stop_event': stop_event},
+        name='grant-expiry',
+        daemon=True
+    )
+    thread.start()
+    return thread, stop_event
@@ -0,0 +1,176 @@
+# apps/permissions/explain.py
+
+"""
+Tracing of authorization decisions for explain mode.
+
+A trace is bound to the current request through a context variable.
+Authorization code wraps each check in explain_step(); when no trace is
+active the step is a shared no-op, so normal requests pay one context
+variable lookup per check. While a trace is active every step records its
+decision, the rule that produced it, whether cached state was hit, the SQL
+it issued and how long it took.
+"""
+
+import contextvars
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_HEADER = 'HTTP_X_AUTHZ_EXPLAIN'
+EXPLAIN_PAYLOAD_KEY = '_authz_explain'
+
+_current_trace = contextvars.ContextVar('authz_trace', default=None)
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 3)
+
+class TraceStep:
+    """One authorization sub-decision"""
+    __slots__ = ('check', 'depth', 'decision', 'source', 'cache', 'detail', 'queries', 'elapsed_ms', '_started')
+
+    def __init__(self, check, depth, detail):
+        self.check = check
+        self.depth = depth
+        self.decision = None
+        self.source = None
+        self.cache = None
+        self.detail = detail
+        self.queries = []
+        self.elapsed_ms = None
+        self._started = time.perf_counter()
+
+    def update(self, decision=None, source=None, cache=None, **detail):
+        if decision is not None:
+            self.decision = decision
+        if source is not None:
+            self.source = source
+        if cache is not None:
+            self.cache = cache
+        self.detail.update(detail)
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'ms': _elapsed_ms(started)})
+
+    def finish(self):
+        self.elapsed_ms = _elapsed_ms(self._started)
+
+    def as_dict(self):
+        return {
+            'check': self.check,
+            'depth': self.depth,
+            'decision': self.decision,
+            'source': self.source,
+            'cache': self.cache,
+            'detail': self.detail,
+            'queries': self.queries,
+            'elapsed_ms': self.elapsed_ms,
+        }
+
+class _NullStep:
+    """Stand-in used when no trace is active"""
+    __slots__ = ()
+
+    def update(self, decision=None, source=None, cache=None, **detail):
+        pass
+
+NULL_STEP = _NullStep()
+
+class AuthorizationTrace:
+    """Every authorization step taken while handling one request"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.steps = []
+        self._depth = 0
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def step(self, check, detail):
+        step = TraceStep(check, self._depth, detail)
+        self.steps.append(step)
+        self._depth += 1
+        try:
+            with connection.execute_wrapper(step.record_query):
+                yield step
+        finally:
+            self._depth -= 1
+            step.finish()
+
+    def as_dict(self, user=None):
+        return {
+            'path': self.path,
+            'user_id': getattr(user, 'pk', None),
+            'elapsed_ms': _elapsed_ms(self._started),
+            'checks': len(self.steps),
+            'query_count': sum(len(step.queries) for step in self.steps if step.depth == 0),
+            'authz_ms': round(sum(step.elapsed_ms or 0 for step in self.steps if step.depth == 0), 3),
+            'steps': [step.as_dict() for step in self.steps],
+        }
+
+@contextmanager
+def explain_step(check, **detail):
+    """Trace an authorization check if explain mode is on for this request"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield NULL_STEP
+        return
+    with trace.step(check, detail) as step:
+        yield step
+
+def is_explaining():
+    return _current_trace.get() is not None
+
+def start_trace(path=None):
+    """Begin tracing; returns (trace, token) for stop_trace"""
+    trace = AuthorizationTrace(path)
+    return trace, _current_trace.set(trace)
+
+def stop_trace(token):
+    _current_trace.reset(token)
+
+def explain_requested(request):
+    return request.META.get(EXPLAIN_HEADER, '').lower() in ('1', 'true', 'yes', 'on')
+
+def can_explain(request):
+    """Explain output is only ever shown to superusers and Data Administrators"""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return False
+    if user.is_superuser:
+        return True
+    from .context import get_authz
+    return get_authz(request).is_data_admin
+
+def log_trace(payload):
+    """Write a finished trace as one structured log line"""
+    logger.info("authz explain %s", json.dumps(payload, default=str), extra={'authz_explain': payload})
+
+def attach_trace(response, payload):
+    """
+    Add the trace to a JSON object response body under _authz_explain.
+    Other responses are left untouched.
+    """
+    if getattr(response, 'streaming', False):
+        return response
+    if 'application/json' not in response.get('Content-Type', ''):
+        return response
+    try:
+        data = json.loads(response.content or b'{}')
+    except ValueError:
+        return response
+    if not isinstance(data, dict):
+        return response
+    data[EXPLAIN_PAYLOAD_KEY] = payload
+    response.content = json.dumps(data, default=str)
+    if response.has_header('Content-Length'):
+        response['Content-Length'] = str(len(response.content))
+    return response
@@ -0,0 +1,91 @@
+# apps/permissions/hierarchy.py
+
+from django.db import transaction
+
+from .models import Role, RoleClosure
+
+class RoleCycleError(ValueError):
+    """Raised when the stored role hierarchy contains a cycle"""
+
+def would_create_cycle(role, parent_id):
+    """Check if making parent_id the parent of role would close a loop"""
+    if role.pk is None:
+        # A role that is not saved yet has no descendants
+        return False
+    if parent_id == role.pk:
+        return True
+    return RoleClosure.objects.filter(ancestor_id=role.pk, descendant_id=parent_id).exists()
+
+def insert_role(role):
+    """Add closure rows for a newly created role"""
+    links = [RoleClosure(ancestor_id=role.pk, descendant_id=role.pk, depth=0)]
+    if role.parent_id:
+        links += [
+            RoleClosure(ancestor_id=ancestor_id, descendant_id=role.pk, depth=depth + 1)
+            for ancestor_id, depth in RoleClosure.objects.filter(
+                descendant_id=role.parent_id
+            ).values_list('ancestor_id', 'depth')
+        ]
+    RoleClosure.objects.bulk_create(links)
+
+def move_role(role):
+    """
+    Re-attach a role and its subtree under role.parent_id. Links from the
+    subtree to its old ancestors are dropped and links to the new parent's
+    ancestors are added; links inside the subtree are kept.
+    """
+    subtree = list(RoleClosure.objects.filter(ancestor_id=role.pk).values_list('descendant_id', 'depth'))
+    subtree_ids = [descendant_id for descendant_id, _ in subtree]
+
+    RoleClosure.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+
+    if role.parent_id:
+        ancestors = RoleClosure.objects.filter(descendant_id=role.parent_id).values_list('ancestor_id', 'depth')
+        RoleClosure.objects.bulk_create([
+            RoleClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + descendant_depth + 1)
+            for ancestor_id, ancestor_depth in ancestors
+            for descendant_id, descendant_depth in subtree
+        ])
+
+def detach_children(role):
+    """Make the children of a role being deleted into roots"""
+    for child in Role.objects.filter(parent=role).only('id'):
+        child.parent_id = None
+        move_role(child)
+
+def descendant_role_ids(role_id):
+    """Ids of a role and every role that inherits from it"""
+    return list(RoleClosure.objects.filter(ancestor_id=role_id).values_list('descendant_id', flat=True))
+
+def compute_role_closure():
+    """
+    Compute the closure of the stored parent links.
+    Returns a list of (ancestor_id, descendant_id, depth).
+    """
+    parents = dict(Role.objects.values_list('id', 'parent_id'))
+    links = []
+    for role_id in parents:
+        seen = set()
+        node, depth = role_id, 0
+        while node is not None:
+            if node in seen:
+                raise RoleCycleError(f"Role {role_id} is part of a cycle through role {node}")
+            seen.add(node)
+            links.append((node, role_id, depth))
+            node = parents.get(node)
+            depth += 1
+    return links
+
+def rebuild_role_closure():
+    """Replace the closure table with one computed from parent links"""
+    links = compute_role_closure()
+    with transaction.atomic():
+        RoleClosure.objects.all().delete()
+        RoleClosure.objects.bulk_create(
+            [
+                RoleClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=depth)
+                for ancestor_id, descendant_id, depth in links
+            ],
+            batch_size=1000
+        )
+    return len(links)
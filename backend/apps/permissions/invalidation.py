@@ -0,0 +1,321 @@
+# apps/permissions/invalidation.py
+
+"""
+Cross-worker invalidation bus for in-process authorization caches.
+
+Every cached thing is stamped with the version of a scope: the whole
+permission catalogue ("global"), the policy set ("policy"), or one user,
+role, tenant or dataset. Versions only ever move forward and live in a
+shared backend, so every worker agrees on them:
+
+    the configured Django cache, when it is shared between processes
+    (memcached, redis, database); or
+    a local SQLite file, used when the cache is per-process (locmem or
+    dummy), which is shared by every worker on the host.
+
+Each bump also advances a global sequence number and records which key
+moved. Workers keep the versions they have seen in memory and poll the
+sequence at most every INVALIDATION_POLL_INTERVAL seconds; when it moved
+they fetch just the changed keys and notify subscribers. Between polls a
+version lookup never leaves the process. Bumps made in this process are
+visible to it immediately.
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ('global', 'policy', 'user', 'role', 'tenant', 'dataset')
+
+SEQUENCE_KEY = 'seq'
+
+POLL_INTERVAL = getattr(settings, 'INVALIDATION_POLL_INTERVAL', 1.0)
+LOCAL_VERSIONS_SIZE = getattr(settings, 'INVALIDATION_LOCAL_SIZE', 10000)
+
+def _clock_version():
+    """
+    Seed for a missing counter. Seeding from the clock keeps a counter
+    moving forward even if the backend lost it.
+    """
+    return int(time.time() * 1000)
+
+class CacheBackend:
+    """Versions kept in a Django cache shared by every worker"""
+    PREFIX = 'invalidation:'
+    # How many change records are kept for workers catching up
+    LOG_SIZE = 1000
+    LOG_TIMEOUT = 60 * 60
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def _key(self, key):
+        return self.PREFIX + key
+
+    def _log_key(self, seq):
+        return f'{self.PREFIX}log:{seq}'
+
+    def _incr(self, key):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, _clock_version(), timeout=None)
+            return self.cache.incr(key)
+
+    def read(self, keys):
+        cache_keys = {self._key(key): key for key in keys}
+        found = self.cache.get_many(list(cache_keys))
+        versions = {cache_keys[cache_key]: version for cache_key, version in found.items()}
+        for key in keys:
+            if key not in versions:
+                self.cache.add(self._key(key), _clock_version(), timeout=None)
+                versions[key] = self.cache.get(self._key(key))
+        return versions
+
+    def bump(self, key):
+        version = self._incr(self._key(key))
+        seq = self._incr(self._key(SEQUENCE_KEY))
+        self.cache.set(self._log_key(seq), (key, version), self.LOG_TIMEOUT)
+        return version
+
+    def changes(self, since):
+        """
+        Return (seq, {key: version}) for keys bumped after since, or
+        (seq, None) when the changes cannot be told apart
+        """
+        seq = self.read([SEQUENCE_KEY])[SEQUENCE_KEY]
+        if since is None or seq == since:
+            return seq, {}
+        if seq < since or seq - since > self.LOG_SIZE:
+            return seq, None
+        log_keys = [self._log_key(number) for number in range(since + 1, seq + 1)]
+        records = self.cache.get_many(log_keys)
+        if len(records) != len(log_keys):
+            return seq, None
+        changed = {}
+        for log_key in log_keys:
+            key, version = records[log_key]
+            changed[key] = max(version, changed.get(key, version))
+        return seq, changed
+
+class SQLiteBackend:
+    """
+    Versions kept in a SQLite file shared by the workers of one host.
+    Each row remembers the sequence number of its last bump.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS versions '
+                '(key TEXT PRIMARY KEY, version INTEGER NOT NULL, seq INTEGER NOT NULL DEFAULT 0)'
+            )
+            self._local.connection = connection
+        return connection
+
+    def _next(self, connection, key):
+        return connection.execute(
+            'INSERT INTO versions (key, version) VALUES (?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET version = version + 1 RETURNING version',
+            (key, _clock_version())
+        ).fetchone()[0]
+
+    def read(self, keys):
+        connection = self._connection()
+        placeholders = ', '.join('?' * len(keys))
+        versions = dict(connection.execute(
+            f'SELECT key, version FROM versions WHERE key IN ({placeholders})', list(keys)
+        ))
+        for key in keys:
+            if key not in versions:
+                connection.execute(
+                    'INSERT OR IGNORE INTO versions (key, version) VALUES (?, ?)',
+                    (key, _clock_version())
+                )
+                versions[key] = connection.execute(
+                    'SELECT version FROM versions WHERE key = ?', (key,)
+                ).fetchone()[0]
+        return versions
+
+    def bump(self, key):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            seq = self._next(connection, SEQUENCE_KEY)
+            version = self._next(connection, key)
+            connection.execute('UPDATE versions SET seq = ? WHERE key = ?', (seq, key))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return version
+
+    def changes(self, since):
+        """Return (seq, {key: version}) for keys bumped after since"""
+        seq = self.read([SEQUENCE_KEY])[SEQUENCE_KEY]
+        if since is None or seq == since:
+            return seq, {}
+        if seq < since:
+            return seq, None
+        changed = dict(self._connection().execute(
+            'SELECT key, version FROM versions WHERE seq > ? AND key != ?', (since, SEQUENCE_KEY)
+        ))
+        return seq, changed
+
+def get_backend():
+    """Pick the backend from INVALIDATION_BACKEND ('auto', 'cache' or 'sqlite')"""
+    choice = getattr(settings, 'INVALIDATION_BACKEND', 'auto')
+    if choice == 'auto':
+        cache_backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+        per_process = cache_backend.endswith(('LocMemCache', 'DummyCache'))
+        choice = 'sqlite' if per_process else 'cache'
+    if choice == 'cache':
+        return CacheBackend()
+    path = getattr(
+        settings,
+        'INVALIDATION_SQLITE_PATH',
+        os.path.join(tempfile.gettempdir(), 'dataaccesshub-invalidation.sqlite3')
+    )
+    return SQLiteBackend(str(path))
+
+class InvalidationBus:
+    """
+    Process-local view of the shared scope versions.
+
+    Subscribers register per scope and are called with (key, version) for
+    every change seen, including changes made by other workers. A key of
+    None means every key of the scope may have changed.
+    """
+
+    def __init__(self, backend=None, poll_interval=POLL_INTERVAL, max_keys=LOCAL_VERSIONS_SIZE):
+        self._backend = backend
+        self.poll_interval = poll_interval
+        self.max_keys = max_keys
+        self._versions = OrderedDict()
+        self._seq = None
+        self._checked_at = None
+        self._listeners = {}
+        self._lock = threading.RLock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = get_backend()
+        return self._backend
+
+    @staticmethod
+    def stamp_key(scope, key=None):
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown invalidation scope: {scope}")
+        return scope if key is None else f'{scope}:{key}'
+
+    def subscribe(self, scope, callback):
+        """Call callback(key, version) whenever a key of scope changes"""
+        self.stamp_key(scope)
+        with self._lock:
+            self._listeners.setdefault(scope, []).append(callback)
+
+    def _notify(self, scope, key, version):
+        for callback in self._listeners.get(scope, ()):
+            try:
+                callback(key, version)
+            except Exception:
+                logger.exception("Invalidation listener failed for %s:%s", scope, key)
+
+    def _store(self, stamp_key, version):
+        self._versions[stamp_key] = version
+        self._versions.move_to_end(stamp_key)
+        while len(self._versions) > self.max_keys:
+            self._versions.popitem(last=False)
+
+    def sync(self, force=False):
+        """Pull changes made by other workers if the poll interval elapsed"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.poll_interval:
+                return
+            self._checked_at = now
+            seq, changed = self.backend.changes(self._seq)
+            self._seq = seq
+            if changed is None:
+                # Too far behind to tell what moved: forget everything
+                self._versions.clear()
+                for scope in list(self._listeners):
+                    self._notify(scope, None, None)
+                return
+            for stamp_key, version in changed.items():
+                known = self._versions.get(stamp_key)
+                if known is not None and known >= version:
+                    continue
+                if known is not None:
+                    self._store(stamp_key, version)
+                scope, _, key = stamp_key.partition(':')
+                self._notify(scope, key or None, version)
+
+    def versions(self, stamps):
+        """Return the versions of a list of (scope, key) stamps"""
+        self.sync()
+        stamp_keys = [self.stamp_key(scope, key) for scope, key in stamps]
+        with self._lock:
+            missing = [stamp_key for stamp_key in stamp_keys if stamp_key not in self._versions]
+            if missing:
+                for stamp_key, version in self.backend.read(missing).items():
+                    self._store(stamp_key, version)
+            result = []
+            for stamp_key in stamp_keys:
+                version = self._versions.get(stamp_key)
+                if version is None:
+                    # Evicted by a large batch: read it again
+                    version = self.backend.read([stamp_key])[stamp_key]
+                result.append(version)
+            return tuple(result)
+
+    def version(self, scope, key=None):
+        return self.versions([(scope, key)])[0]
+
+    def bump(self, scope, key=None):
+        """Move a scope version forward everywhere. Returns the new version."""
+        stamp_key = self.stamp_key(scope, key)
+        version = self.backend.bump(stamp_key)
+        with self._lock:
+            if self._versions.get(stamp_key, 0) < version:
+                self._store(stamp_key, version)
+            self._notify(scope, None if key is None else str(key), version)
+        return version
+
+    def publish(self, scope, key=None):
+        """
+        Bump a scope now, and once more when the current transaction
+        commits, so no worker rebuilds a cache from rows it cannot see yet
+        under a version that will not move again
+        """
+        version = self.bump(scope, key)
+        if connection.in_atomic_block:
+            transaction.on_commit(lambda: self.bump(scope, key))
+        return version
+
+    def reset(self):
+        """Forget the versions seen by this process"""
+        with self._lock:
+            self._versions.clear()
+            self._seq = None
+            self._checked_at = None
+
+bus = InvalidationBus()
@@ -0,0 +1,30 @@
+# apps/permissions/management/commands/expire_grants.py
+
+from django.core.management.base import BaseCommand
+
+from apps.permissions.expiry import expire_due_grants, run_expiry_worker, EXPIRY_BATCH_SIZE, EXPIRY_INTERVAL
+
+class Command(BaseCommand):
+    help = 'Deactivate role assignments and dataset grants whose expiry has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep running and expire grants as they come due')
+        parser.add_argument('--interval', type=float, default=EXPIRY_INTERVAL,
+                            help='Longest wait between passes in watch mode, in seconds')
+        parser.add_argument('--batch-size', type=int, default=EXPIRY_BATCH_SIZE,
+                            help='Rows deactivated per transaction')
+
+    def handle(self, *args, **options):
+        if options['watch']:
+            self.stdout.write(f"Watching for expired grants every {options['interval']}s")
+            try:
+                run_expiry_worker(interval=options['interval'], batch_size=options['batch_size'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        counts = expire_due_grants(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Expired {counts['roles']} role assignments and {counts['dataset_access']} dataset grants"
+        ))
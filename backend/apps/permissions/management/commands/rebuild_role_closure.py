@@ -0,0 +1,17 @@
+# apps/permissions/management/commands/rebuild_role_closure.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.permissions.cache import bump_permission_version
+from apps.permissions.hierarchy import rebuild_role_closure, RoleCycleError
+
+class Command(BaseCommand):
+    help = 'Rebuild the role closure table from Role.parent links (follow with rebuild_effective_access)'
+
+    def handle(self, *args, **options):
+        try:
+            count = rebuild_role_closure()
+        except RoleCycleError as e:
+            raise CommandError(str(e))
+        bump_permission_version()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} role closure rows'))
@@ -0,0 +1,80 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_role_closure(apps, schema_editor):
+    """Existing roles are all roots, so each only links to itself"""
+    Role = apps.get_model("permissions", "Role")
+    RoleClosure = apps.get_model("permissions", "RoleClosure")
+    RoleClosure.objects.bulk_create(
+        [
+            RoleClosure(ancestor_id=role_id, descendant_id=role_id, depth=0)
+            for role_id in Role.objects.values_list("id", flat=True)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("permissions", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="role",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="Role whose permissions this role inherits",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="children",
+                to="permissions.role",
+            ),
+        ),
+        migrations.CreateModel(
+            name="RoleClosure",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("depth", models.PositiveIntegerField()),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_links",
+                        to="permissions.role",
+                    ),
+                ),
+                (
+                    "descendant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestor_links",
+                        to="permissions.role",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["descendant", "ancestor"],
+                        name="roleclosure_desc_anc_idx",
+                    )
+                ],
+                "unique_together": {("ancestor", "descendant")},
+            },
+        ),
+        migrations.RunPython(seed_role_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("permissions", "0002_role_hierarchy"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="userrole",
+            index=models.Index(
+                fields=["is_active", "expires_at"], name="userrole_expiry_idx"
+            ),
+        ),
+    ]
@@ -1,18 +1,70 @@
 # apps/permissions/models.py
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.contrib.auth.models import Group
 
 class Role(models.Model):
     """User roles for permission management."""
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='children',
+        help_text='Role whose permissions this role inherits'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
     
     def __str__(self):
         return self.name
+    
+    def clean(self):
+        from .hierarchy import would_create_cycle
+        
+        if self.parent_id and would_create_cycle(self, self.parent_id):
+            raise ValidationError({'parent': 'A role cannot inherit from itself or its descendants.'})
+    
+    def save(self, *args, **kwargs):
+        # Keep the closure table in step with the hierarchy
+        from .hierarchy import would_create_cycle, insert_role, move_role
+        
+        with transaction.atomic():
+            is_new = self.pk is None
+            previous_parent_id = None
+            if not is_new:
+                previous_parent_id = Role.objects.filter(pk=self.pk).values_list('parent_id', flat=True).first()
+            if self.parent_id and would_create_cycle(self, self.parent_id):
+                raise ValidationError({'parent': 'A role cannot inherit from itself or its descendants.'})
+            
+            super().save(*args, **kwargs)
+            
+            if is_new:
+                insert_role(self)
+            elif previous_parent_id != self.parent_id:
+                move_role(self)
+
+class RoleClosure(models.Model):
+    """
+    Transitive closure of the role hierarchy: one row per ancestor and
+    descendant pair, including each role paired with itself at depth 0.
+    """
+    ancestor = models.ForeignKey(Role, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Role, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+    
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        indexes = [
+            models.Index(fields=['descendant', 'ancestor'], name='roleclosure_desc_anc_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.depth})"
 
 class Permission(models.Model):
     """Granular permissions for different actions."""
@@ -58,6 +110,10 @@ class UserRole(models.Model):
     
     class Meta:
         unique_together = ('user', 'role')
+        indexes = [
+            # Queue of active assignments ordered by expiry, read by the expiry scheduler
+            models.Index(fields=['is_active', 'expires_at'], name='userrole_expiry_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} -> {self.role.name}"
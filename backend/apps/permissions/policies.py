@@ -0,0 +1,330 @@
+# apps/permissions/policies.py
+
+"""
+Compiled evaluation of PermissionPolicy rules.
+
+Conditions are JSON trees over user, dataset and tenant attributes:
+
+    {"all": [cond, ...]}      every condition holds
+    {"any": [cond, ...]}      at least one condition holds
+    {"not": cond}             condition does not hold
+    {"attr": "user.department", "op": "eq", "value": "Research"}
+    {"attr": "user.department", "op": "eq", "value": {"attr": "dataset.created_by.department"}}
+    {"user.department": "Research", "dataset.is_active": true}   shorthand for "all" of "eq"
+
+Supported operators: eq, ne, in, not_in, contains, gt, gte, lt, lte, exists.
+An empty condition always holds. Relations that attribute paths follow
+(dataset.created_by above) are loaded once per evaluate_many batch.
+
+Actions select the effect and the permission types the policy covers:
+
+    {"effect": "allow", "permissions": ["DATASET_READ"]}
+
+"effect" defaults to "allow"; without "permissions" the policy covers every
+permission type. Deny decisions override allow decisions.
+"""
+
+import logging
+import operator
+import threading
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Model, prefetch_related_objects
+
+from .models import PermissionPolicy
+from .cache import get_policy_version
+from .engine import PERMISSION_BITS
+from .explain import explain_step
+
+logger = logging.getLogger(__name__)
+
+ROOTS = ('user', 'dataset', 'tenant')
+
+def _not_in(left, right):
+    return left not in right
+
+def _in(left, right):
+    return left in right
+
+def _contains(left, right):
+    return right in left
+
+OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'in': _in,
+    'not_in': _not_in,
+    'contains': _contains,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+class PolicyError(ValueError):
+    """Raised when a policy cannot be compiled"""
+
+def compile_attribute(path, paths=None):
+    """
+    Compile a dotted path like "dataset.created_by.department" into a
+    function taking the (user, dataset, tenant) tuple. The path is added
+    to paths as (subject index, names) when given.
+    """
+    parts = path.split('.')
+    if parts[0] not in ROOTS or len(parts) < 2:
+        raise PolicyError(f"Attribute must start with one of {', '.join(ROOTS)}: {path}")
+    index = ROOTS.index(parts[0])
+    names = tuple(parts[1:])
+    if paths is not None:
+        paths.add((index, names))
+
+    def resolve(subjects):
+        value = subjects[index]
+        for name in names:
+            if value is None:
+                return None
+            if isinstance(value, dict):
+                value = value.get(name)
+            else:
+                value = getattr(value, name, None)
+        return value
+    return resolve
+
+def compile_operand(value, paths=None):
+    if isinstance(value, dict) and set(value) == {'attr'}:
+        return compile_attribute(value['attr'], paths)
+    if isinstance(value, list):
+        value = frozenset(value) if all(isinstance(item, (str, int)) for item in value) else tuple(value)
+    return lambda subjects: value
+
+def compile_condition(condition, paths=None):
+    """
+    Compile a condition tree into a predicate over (user, dataset, tenant);
+    the attribute paths it reads are collected into paths when given
+    """
+    if not condition:
+        return lambda subjects: True
+    if not isinstance(condition, dict):
+        raise PolicyError(f"Condition must be an object: {condition!r}")
+
+    if 'all' in condition or 'any' in condition:
+        combine = all if 'all' in condition else any
+        children = condition['all'] if 'all' in condition else condition['any']
+        if not isinstance(children, list):
+            raise PolicyError(f"'all'/'any' must hold a list: {children!r}")
+        children = tuple(compile_condition(child, paths) for child in children)
+        return lambda subjects: combine(child(subjects) for child in children)
+
+    if 'not' in condition:
+        child = compile_condition(condition['not'], paths)
+        return lambda subjects: not child(subjects)
+
+    if 'attr' in condition:
+        left = compile_attribute(condition['attr'], paths)
+        op_name = condition.get('op', 'eq')
+        if op_name == 'exists':
+            expected = condition.get('value', True)
+            return lambda subjects: (left(subjects) is not None) == expected
+        op = OPERATORS.get(op_name)
+        if op is None:
+            raise PolicyError(f"Unknown operator: {op_name}")
+        right = compile_operand(condition.get('value'), paths)
+
+        def predicate(subjects):
+            value = left(subjects)
+            if value is None:
+                return op is operator.ne or op is _not_in
+            try:
+                return op(value, right(subjects))
+            except TypeError:
+                return False
+        return predicate
+
+    # Shorthand: {"user.department": "Research", ...}
+    return compile_condition({
+        'all': [{'attr': path, 'op': 'eq', 'value': value} for path, value in condition.items()]
+    }, paths)
+
+def _relation_lookup(model, names):
+    """Lookup of the relations a path walks through before its last name, or None"""
+    lookup = []
+    for name in names[:-1]:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            break
+        if not (field.many_to_one or field.one_to_one):
+            break
+        lookup.append(name)
+        model = field.related_model
+    return '__'.join(lookup) or None
+
+def prefetch_attributes(pairs, policies):
+    """
+    Load the relations the policies' attribute paths follow for every user
+    and dataset of a batch, one query per relation instead of one per pair
+    """
+    for index in (0, 1):
+        paths = {names for policy in policies for root, names in policy.paths if root == index}
+        if not paths:
+            continue
+        instances = {id(pair[index]): pair[index] for pair in pairs if isinstance(pair[index], Model)}
+        if not instances:
+            continue
+        model = type(next(iter(instances.values())))
+        instances = [instance for instance in instances.values() if type(instance) is model]
+        lookups = {_relation_lookup(model, names) for names in paths} - {None}
+        if lookups:
+            prefetch_related_objects(instances, *sorted(lookups))
+
+class CompiledPolicy:
+    """A policy whose condition tree has been turned into a closure"""
+    __slots__ = ('id', 'name', 'source', 'predicate', 'paths', 'allow', 'mask')
+
+    def __init__(self, policy):
+        actions = policy.actions or {}
+        if not isinstance(actions, dict):
+            raise PolicyError(f"Actions must be an object: {actions!r}")
+        effect = actions.get('effect', 'allow')
+        if effect not in ('allow', 'deny'):
+            raise PolicyError(f"Unknown effect: {effect}")
+
+        permission_types = actions.get('permissions')
+        if permission_types is None:
+            mask = sum(PERMISSION_BITS.values())
+        elif not isinstance(permission_types, list):
+            raise PolicyError(f"'permissions' must be a list: {permission_types!r}")
+        else:
+            mask = 0
+            for permission_type in permission_types:
+                if permission_type not in PERMISSION_BITS:
+                    raise PolicyError(f"Unknown permission type: {permission_type}")
+                mask |= PERMISSION_BITS[permission_type]
+
+        self.id = policy.id
+        self.name = policy.name
+        self.source = (policy.conditions, policy.actions)
+        paths = set()
+        self.predicate = compile_condition(policy.conditions, paths)
+        self.paths = frozenset(paths)
+        self.allow = effect == 'allow'
+        self.mask = mask
+
+class PolicySet:
+    """Immutable set of compiled policies at a given policy version"""
+    __slots__ = ('version', 'policies')
+
+    def __init__(self, version, policies):
+        self.version = version
+        self.policies = tuple(policies)
+
+    def _select(self, permission_type):
+        bits = PERMISSION_BITS.get(permission_type, 0)
+        policies = [policy for policy in self.policies if policy.mask & bits]
+        # Deny policies are checked first so they win on a match
+        denies = tuple(policy for policy in policies if not policy.allow)
+        allows = tuple(policy for policy in policies if policy.allow)
+        return denies, allows
+
+    @staticmethod
+    def _decide(denies, allows, subjects):
+        """Return (decision, deciding policy)"""
+        for policy in denies:
+            if policy.predicate(subjects):
+                return False, policy
+        for policy in allows:
+            if policy.predicate(subjects):
+                return True, policy
+        return None, None
+
+    def can_deny(self, permission_type='DATASET_READ'):
+        """Whether any policy may deny this permission type"""
+        return bool(self._select(permission_type)[0])
+
+    def match(self, user, dataset, permission_type='DATASET_READ', tenant=None):
+        """Like evaluate, but also return the policy that decided"""
+        denies, allows = self._select(permission_type)
+        return self._decide(denies, allows, (user, dataset, tenant))
+
+    def evaluate(self, user, dataset, permission_type='DATASET_READ', tenant=None):
+        """
+        Return True (allowed), False (denied) or None when no policy
+        applies to the pair
+        """
+        return self.match(user, dataset, permission_type, tenant)[0]
+
+    def evaluate_many(self, pairs, permission_type='DATASET_READ', tenant=None):
+        """Evaluate the policy set against many (user, dataset) pairs"""
+        denies, allows = self._select(permission_type)
+        if not denies and not allows:
+            return [None] * len(pairs)
+        prefetch_attributes(pairs, denies + allows)
+        decide = self._decide
+        return [decide(denies, allows, (user, dataset, tenant))[0] for user, dataset in pairs]
+
+class PolicyEngine:
+    """
+    Compiles active policies of one policy type and caches them by policy
+    id and creation time. The active set is reloaded only when the policy
+    version moves.
+    """
+
+    def __init__(self, policy_type='DATASET_ACCESS'):
+        self.policy_type = policy_type
+        self._compiled = {}
+        self._policy_set = None
+        self._lock = threading.Lock()
+
+    def _compile(self, policy):
+        key = (policy.id, policy.created_at)
+        compiled = self._compiled.get(key)
+        if compiled is None or compiled.source != (policy.conditions, policy.actions):
+            compiled = CompiledPolicy(policy)
+            self._compiled[key] = compiled
+        return compiled
+
+    def get_policy_set(self):
+        """Return the compiled active policy set, reloading it if stale"""
+        with explain_step('policy_set', policy_type=self.policy_type) as step:
+            version = get_policy_version()
+            policy_set = self._policy_set
+            if policy_set is not None and policy_set.version == version:
+                step.update(source='compiled_policies', cache='hit')
+                return policy_set
+            step.update(source='compiled_policies', cache='miss')
+            return self._reload(version)
+
+    def _reload(self, version):
+        with self._lock:
+            policies = PermissionPolicy.objects.filter(
+                policy_type=self.policy_type,
+                is_active=True
+            ).only('id', 'name', 'conditions', 'actions', 'created_at')
+            compiled = []
+            for policy in policies:
+                try:
+                    compiled.append(self._compile(policy))
+                except PolicyError as e:
+                    logger.error("Skipping invalid policy %s (%s): %s", policy.id, policy.name, e)
+            live_keys = {(policy.id, policy.created_at) for policy in policies}
+            for key in list(self._compiled):
+                if key not in live_keys:
+                    del self._compiled[key]
+            self._policy_set = PolicySet(version, compiled)
+        return self._policy_set
+
+    def evict(self, policy_id):
+        """Forget compiled entries of a policy"""
+        with self._lock:
+            for key in list(self._compiled):
+                if key[0] == policy_id:
+                    del self._compiled[key]
+            self._policy_set = None
+
+    def evaluate(self, user, dataset, permission_type='DATASET_READ', tenant=None):
+        return self.get_policy_set().evaluate(user, dataset, permission_type, tenant)
+
+    def evaluate_many(self, pairs, permission_type='DATASET_READ', tenant=None):
+        return self.get_policy_set().evaluate_many(pairs, permission_type, tenant)
+
+dataset_policy_engine = PolicyEngine('DATASET_ACCESS')
@@ -0,0 +1,42 @@
+# apps/permissions/signals.py
+
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Role, Permission, RolePermission, UserRole, PermissionPolicy
+from .cache import bump_permission_version, bump_role_versions, bump_policy_version
+from .policies import dataset_policy_engine
+from .hierarchy import detach_children
+
+@receiver([post_save, post_delete], sender=UserRole)
+def user_role_changed(sender, instance, **kwargs):
+    """A role assignment only affects the assigned user"""
+    bump_permission_version(user_id=instance.user_id)
+
+@receiver([post_save, post_delete], sender=RolePermission)
+def role_permission_changed(sender, instance, **kwargs):
+    """A grant change only touches one role mask"""
+    bump_permission_version()
+    bump_role_versions([instance.role_id])
+
+@receiver(pre_delete, sender=Role)
+def role_deleting(sender, instance, **kwargs):
+    """Children lose the inherited links before the parent goes away"""
+    detach_children(instance)
+
+@receiver([post_save, post_delete], sender=Role)
+def role_changed(sender, instance, **kwargs):
+    bump_permission_version()
+    bump_role_versions([instance.pk])
+
+@receiver([post_save, post_delete], sender=Permission)
+def permission_changed(sender, instance, **kwargs):
+    """A permission can be shared by any number of roles"""
+    bump_permission_version()
+    bump_role_versions(RolePermission.objects.filter(permission_id=instance.pk).values_list('role_id', flat=True))
+
+@receiver([post_save, post_delete], sender=PermissionPolicy)
+def policy_changed(sender, instance, **kwargs):
+    """Drop the compiled form and make every worker reload the active set"""
+    dataset_policy_engine.evict(instance.pk)
+    bump_policy_version()
@@ -0,0 +1,601 @@
+# apps/permissions/tests.py
+
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.test import TestCase, RequestFactory
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse
+from django.utils import timezone
+
+from apps.permissions.models import Role, Permission, RolePermission, UserRole, PermissionPolicy, RoleClosure
+from apps.permissions.cache import get_permission_snapshot, clear_local_snapshots
+from apps.permissions.context import get_authz
+from apps.permissions.engine import permission_engine, permission_mask
+from apps.permissions.policies import compile_condition, dataset_policy_engine, PolicyError
+from apps.permissions.invalidation import InvalidationBus, CacheBackend, SQLiteBackend
+from apps.permissions.explain import start_trace, stop_trace, explain_step, is_explaining, NULL_STEP
+from apps.permissions.expiry import expire_due_grants, next_expiry
+from apps.datasets.models import Dataset, DatasetAccess, EffectiveDatasetAccess
+from apps.datasets.services import refresh_effective_access
+from apps.api.v1.datasets import DatasetViewSet
+from apps.audit.models import AuditLog
+from apps.tenants.context import tenant_context
+from apps.tenants.models import Tenant, TenantUser
+from middleware.permissions import AuthorizationExplainMiddleware, PermissionInjectionMiddleware
+
+User = get_user_model()
+
+class PermissionTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_snapshots()
+        permission_engine.rebuild()
+
+        self.user = User.objects.create_user(
+            username='analyst',
+            email='analyst@test.com',
+            password='testpass123'
+        )
+        self.role = Role.objects.create(name='Analyst')
+        self.permission = Permission.objects.create(
+            name='DATASET_VIEW',
+            permission_type='DATASET_READ',
+            resource='all'
+        )
+        self.role_permission = RolePermission.objects.create(role=self.role, permission=self.permission)
+        UserRole.objects.create(user=self.user, role=self.role)
+
+class PermissionSnapshotTestCase(PermissionTestCase):
+    def test_roles_without_closure_rows_still_grant(self):
+        """Test a role created without save() grants its own permissions."""
+        reader = User.objects.create_user(username='reader', password='testpass123')
+        role = Role.objects.bulk_create([Role(name='Bulk reader')])[0]
+        self.assertFalse(RoleClosure.objects.filter(descendant=role).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            RolePermission.objects.create(role=role, permission=self.permission)
+            UserRole.objects.create(user=reader, role=role)
+            dataset = Dataset.objects.create(name='census', created_by=self.user)
+        permission_engine.rebuild()
+
+        self.assertEqual(get_permission_snapshot(reader).permissions, {'DATASET_VIEW'})
+        self.assertEqual(permission_engine.check_many([(reader.id, 'DATASET_READ', 'census')]), [True])
+        self.assertTrue(EffectiveDatasetAccess.objects.filter(
+            user=reader, dataset=dataset, source='ROLE_PERMISSION'
+        ).exists())
+
+    def test_snapshot_contents(self):
+        """Test snapshot contains role and permission names."""
+        snapshot = get_permission_snapshot(self.user)
+        self.assertEqual(snapshot.roles, {'Analyst'})
+        self.assertEqual(snapshot.permissions, {'DATASET_VIEW'})
+
+    def test_warm_snapshot_issues_no_queries(self):
+        """Test a warm snapshot is served without touching the database."""
+        get_permission_snapshot(self.user)
+        with self.assertNumQueries(0):
+            get_permission_snapshot(self.user)
+
+    def test_shared_cache_used_after_local_eviction(self):
+        """Test the shared cache serves snapshots other workers built."""
+        get_permission_snapshot(self.user)
+        clear_local_snapshots()
+        with self.assertNumQueries(0):
+            snapshot = get_permission_snapshot(self.user)
+        self.assertEqual(snapshot.roles, {'Analyst'})
+
+    def test_user_role_change_invalidates_snapshot(self):
+        """Test revoking a role is visible immediately."""
+        get_permission_snapshot(self.user)
+        user_role = UserRole.objects.get(user=self.user, role=self.role)
+        user_role.is_active = False
+        user_role.save()
+
+        snapshot = get_permission_snapshot(self.user)
+        self.assertEqual(snapshot.roles, set())
+        self.assertEqual(snapshot.permissions, set())
+
+    def test_role_permission_change_invalidates_snapshot(self):
+        """Test granting a permission to a role is visible immediately."""
+        get_permission_snapshot(self.user)
+        audit = Permission.objects.create(name='AUDIT_VIEW', permission_type='AUDIT_VIEW')
+        RolePermission.objects.create(role=self.role, permission=audit)
+
+        snapshot = get_permission_snapshot(self.user)
+        self.assertEqual(snapshot.permissions, {'DATASET_VIEW', 'AUDIT_VIEW'})
+
+class PermissionEngineTestCase(PermissionTestCase):
+    def test_wildcard_resource_grants_every_resource(self):
+        """Test a permission on 'all' matches any resource."""
+        self.assertTrue(self.user.has_permission('DATASET_READ'))
+        self.assertTrue(self.user.has_permission('DATASET_READ', 'census'))
+        self.assertFalse(self.user.has_permission('DATASET_WRITE', 'census'))
+        self.assertFalse(self.user.has_permission('UNKNOWN'))
+
+    def test_resource_specific_permission(self):
+        """Test a permission on one resource does not leak to others."""
+        write = Permission.objects.create(
+            name='CENSUS_WRITE',
+            permission_type='DATASET_WRITE',
+            resource='census'
+        )
+        RolePermission.objects.create(role=self.role, permission=write)
+
+        self.assertTrue(self.user.has_permission('DATASET_WRITE'))
+        self.assertTrue(self.user.has_permission('DATASET_WRITE', 'census'))
+        self.assertFalse(self.user.has_permission('DATASET_WRITE', 'payroll'))
+
+    def test_role_masks_are_precomputed(self):
+        """Test role masks hold the OR of their permission bits."""
+        self.user.has_permission('DATASET_READ')
+        self.assertEqual(
+            permission_engine.role_mask(self.role.id),
+            {'all': permission_mask('DATASET_READ')}
+        )
+
+    def test_warm_check_issues_no_queries(self):
+        """Test repeated checks are answered from memory."""
+        self.user.has_permission('DATASET_READ')
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                self.user.has_permission('DATASET_READ', 'census')
+
+    def test_revoked_grant_is_applied_incrementally(self):
+        """Test removing a role grant updates only that role's mask."""
+        self.user.has_permission('DATASET_READ')
+        self.role_permission.delete()
+
+        self.assertEqual(permission_engine.role_mask(self.role.id), {})
+        self.assertFalse(self.user.has_permission('DATASET_READ'))
+
+class BulkPermissionCheckTestCase(PermissionTestCase):
+    def test_check_many_mixes_roles_and_dataset_grants(self):
+        """Test role masks and dataset grants are combined per check."""
+        other = User.objects.create_user(username='other', password='testpass123')
+        dataset = Dataset.objects.create(name='census', created_by=self.user)
+        DatasetAccess.objects.create(user=other, dataset=dataset, access_level='WRITE')
+
+        results = permission_engine.check_many([
+            (self.user.id, 'DATASET_READ', 'census'),
+            (self.user.id, 'DATASET_WRITE', 'census'),
+            (other.id, 'DATASET_WRITE', 'census'),
+            (other.id, 'DATASET_ADMIN', 'census'),
+            (other.id, 'DATASET_READ', 'payroll'),
+            (other.id, 'BOGUS', 'census'),
+        ])
+        self.assertEqual(results, [True, False, True, False, False, False])
+
+    def test_expired_unswept_grants_do_not_allow(self):
+        """Test single and bulk checks agree that a grant past its expiry is gone."""
+        other = User.objects.create_user(username='other', password='testpass123')
+        dataset = Dataset.objects.create(name='census', created_by=self.user)
+        payroll = Dataset.objects.create(name='payroll', created_by=self.user)
+        DatasetAccess.objects.create(user=other, dataset=dataset, access_level='WRITE')
+        DatasetAccess.objects.create(
+            user=other, dataset=payroll, access_level='WRITE',
+            expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        checks = [(other.id, 'DATASET_WRITE', 'census'), (other.id, 'DATASET_WRITE', 'payroll')]
+        self.assertEqual(permission_engine.check_many(checks), [True, False])
+        self.assertEqual(
+            [other.has_permission(permission_type, resource) for _, permission_type, resource in checks],
+            [True, False]
+        )
+
+    def test_check_many_loads_rows_once(self):
+        """Test a large batch costs one query per source table."""
+        users = [self.user] + [
+            User.objects.create_user(username=f'user{i}', password='testpass123')
+            for i in range(5)
+        ]
+        checks = [
+            (user.id, permission_type, f'dataset-{i}')
+            for i in range(20)
+            for user in users
+            for permission_type in ('DATASET_READ', 'DATASET_WRITE')
+        ]
+        permission_engine.check_many(checks[:1])
+        with self.assertNumQueries(2):
+            results = permission_engine.check_many(checks)
+        self.assertEqual(len(results), len(checks))
+        self.assertEqual(sum(results), 20)
+
+    def test_users_reach_check_endpoint_without_permission_manage(self):
+        """Test the check endpoint is open to users who may not manage permissions."""
+        middleware = PermissionInjectionMiddleware(lambda request: JsonResponse({'ok': True}))
+        for path, status in (('/api/v1/permissions/check/', 200), ('/api/v1/permissions/roles/', 403)):
+            request = RequestFactory().post(path)
+            request.user = self.user
+            self.assertEqual(middleware(request).status_code, status)
+
+class PolicyEngineTestCase(PermissionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user.department = 'Research'
+        self.user.save()
+        self.outsider = User.objects.create_user(
+            username='outsider',
+            password='testpass123',
+            department='Finance'
+        )
+        self.dataset = Dataset.objects.create(name='census', created_by=self.user)
+        self.policy = PermissionPolicy.objects.create(
+            name='Same department read',
+            policy_type='DATASET_ACCESS',
+            conditions={
+                'all': [
+                    {'attr': 'dataset.is_active', 'op': 'eq', 'value': True},
+                    {'attr': 'user.department', 'op': 'eq', 'value': {'attr': 'dataset.created_by.department'}},
+                ]
+            },
+            actions={'effect': 'allow', 'permissions': ['DATASET_READ']},
+            created_by=self.user
+        )
+
+    def test_compiled_condition_operators(self):
+        """Test compiled predicates over user, dataset and tenant."""
+        predicate = compile_condition({
+            'any': [
+                {'attr': 'user.department', 'op': 'in', 'value': ['Research', 'Ethics']},
+                {'not': {'attr': 'tenant.settings.restricted', 'op': 'exists'}},
+            ]
+        })
+        self.assertTrue(predicate((self.user, self.dataset, None)))
+        self.assertTrue(predicate((self.outsider, self.dataset, None)))
+        with self.assertRaises(PolicyError):
+            compile_condition({'attr': 'request.path', 'op': 'eq', 'value': '/'})
+
+    def test_evaluate_many_pairs(self):
+        """Test one compiled policy set answers a batch of pairs."""
+        policy_set = dataset_policy_engine.get_policy_set()
+        decisions = policy_set.evaluate_many([
+            (self.user, self.dataset),
+            (self.outsider, self.dataset),
+        ])
+        self.assertEqual(decisions, [True, None])
+        self.assertIsNone(policy_set.evaluate(self.user, self.dataset, 'DATASET_WRITE'))
+
+    def test_evaluate_many_loads_relations_once(self):
+        """Test relations on attribute paths are loaded once per batch, not per pair."""
+        for i in range(5):
+            Dataset.objects.create(name=f'survey-{i}', created_by=self.outsider if i % 2 else self.user)
+        policy_set = dataset_policy_engine.get_policy_set()
+        datasets = list(Dataset.objects.all())
+        pairs = [(user, dataset) for user in (self.user, self.outsider) for dataset in datasets]
+        with self.assertNumQueries(1):
+            decisions = policy_set.evaluate_many(pairs)
+        self.assertEqual(decisions.count(True), 4 + 2)
+
+    def test_deny_overrides_allow(self):
+        """Test a matching deny policy wins over an allow."""
+        PermissionPolicy.objects.create(
+            name='Finance lockout',
+            policy_type='DATASET_ACCESS',
+            conditions={'user.department': 'Research'},
+            actions={'effect': 'deny'},
+            created_by=self.user
+        )
+        self.assertFalse(dataset_policy_engine.evaluate(self.user, self.dataset))
+
+    def test_deny_policy_hides_dataset_from_listing(self):
+        """Test the dataset list leaves out datasets a policy denies, like single reads do."""
+        Dataset.objects.create(name='survey', created_by=self.outsider)
+        refresh_effective_access()
+        PermissionPolicy.objects.create(
+            name='Census lockout',
+            policy_type='DATASET_ACCESS',
+            conditions={'dataset.name': 'census'},
+            actions={'effect': 'deny'},
+            created_by=self.user
+        )
+        request = RequestFactory().get('/api/v1/datasets/')
+        request.user = self.user
+        view = DatasetViewSet(request=request, action='list', format_kwarg=None)
+        self.assertEqual(list(view.get_queryset().values_list('name', flat=True)), ['survey'])
+        self.assertFalse(get_authz(request).can_read_dataset(self.dataset))
+
+    def test_compiled_policies_are_cached(self):
+        """Test policies are compiled once and reloaded only on change."""
+        first = dataset_policy_engine.get_policy_set()
+        with self.assertNumQueries(0):
+            self.assertIs(dataset_policy_engine.get_policy_set(), first)
+
+        self.policy.conditions = {'user.department': 'Finance'}
+        self.policy.save()
+        updated = dataset_policy_engine.get_policy_set()
+        self.assertIsNot(updated, first)
+        self.assertEqual(updated.evaluate_many([(self.user, self.dataset), (self.outsider, self.dataset)]), [None, True])
+
+class RoleHierarchyTestCase(PermissionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.senior = Role.objects.create(name='Senior Analyst', parent=self.role)
+        self.lead = Role.objects.create(name='Lead Analyst', parent=self.senior)
+        self.lead_user = User.objects.create_user(username='lead', password='testpass123')
+        UserRole.objects.create(user=self.lead_user, role=self.lead)
+
+    def closure(self):
+        return set(RoleClosure.objects.values_list('ancestor__name', 'descendant__name', 'depth'))
+
+    def test_closure_rows(self):
+        """Test the closure holds every ancestor pair with its depth."""
+        self.assertEqual(self.closure(), {
+            ('Analyst', 'Analyst', 0),
+            ('Senior Analyst', 'Senior Analyst', 0),
+            ('Lead Analyst', 'Lead Analyst', 0),
+            ('Analyst', 'Senior Analyst', 1),
+            ('Senior Analyst', 'Lead Analyst', 1),
+            ('Analyst', 'Lead Analyst', 2),
+        })
+
+    def test_inherited_permissions(self):
+        """Test roles inherit permissions from their ancestors."""
+        snapshot = get_permission_snapshot(self.lead_user)
+        self.assertEqual(snapshot.roles, {'Analyst', 'Senior Analyst', 'Lead Analyst'})
+        self.assertEqual(snapshot.permissions, {'DATASET_VIEW'})
+        self.assertTrue(self.lead_user.has_permission('DATASET_READ', 'census'))
+
+    def test_move_subtree(self):
+        """Test re-parenting a role moves its whole subtree."""
+        self.senior.parent = None
+        self.senior.save()
+        self.assertNotIn(('Analyst', 'Lead Analyst', 2), self.closure())
+        self.assertFalse(self.lead_user.has_permission('DATASET_READ'))
+
+        self.senior.parent = self.role
+        self.senior.save()
+        self.assertIn(('Analyst', 'Lead Analyst', 2), self.closure())
+        self.assertTrue(self.lead_user.has_permission('DATASET_READ'))
+
+    def test_cycles_are_rejected(self):
+        """Test a role cannot inherit from its own descendant."""
+        self.role.parent = self.lead
+        with self.assertRaises(ValidationError):
+            self.role.save()
+
+    def test_deleting_a_role_detaches_children(self):
+        """Test children of a deleted role stop inheriting through it."""
+        self.senior.delete()
+        self.assertEqual(self.closure(), {
+            ('Analyst', 'Analyst', 0),
+            ('Lead Analyst', 'Lead Analyst', 0),
+        })
+
+    def test_rebuild_command(self):
+        """Test the rebuild command reproduces the incremental closure."""
+        before = self.closure()
+        RoleClosure.objects.all().delete()
+        call_command('rebuild_role_closure', stdout=StringIO())
+        self.assertEqual(self.closure(), before)
+
+class GrantExpiryTestCase(PermissionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.past = timezone.now() - timedelta(minutes=5)
+        self.future = timezone.now() + timedelta(days=1)
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.dataset = Dataset.objects.create(name='census', created_by=self.owner)
+
+    def test_expired_role_is_deactivated(self):
+        """Test a due role assignment is switched off and the snapshot follows."""
+        UserRole.objects.filter(user=self.user).update(expires_at=self.past)
+        self.assertTrue(self.user.has_permission('DATASET_READ'))
+
+        counts = expire_due_grants()
+
+        self.assertEqual(counts, {'roles': 1, 'dataset_access': 0})
+        self.assertFalse(UserRole.objects.get(user=self.user).is_active)
+        self.assertFalse(self.user.has_permission('DATASET_READ'))
+        self.assertTrue(AuditLog.objects.filter(action='EXPIRE_ROLE', target_id=self.user.id).exists())
+
+    def test_expired_dataset_access_is_deactivated(self):
+        """Test a due dataset grant is switched off and effective access refreshed."""
+        reader = User.objects.create_user(username='reader', password='testpass123')
+        with self.captureOnCommitCallbacks(execute=True):
+            DatasetAccess.objects.create(user=reader, dataset=self.dataset, expires_at=self.past)
+        self.assertTrue(EffectiveDatasetAccess.objects.filter(user=reader).exists())
+
+        counts = expire_due_grants()
+
+        self.assertEqual(counts, {'roles': 0, 'dataset_access': 1})
+        self.assertFalse(EffectiveDatasetAccess.objects.filter(user=reader).exists())
+        self.assertEqual(AuditLog.objects.get(action='EXPIRE_ACCESS').metadata['target_user'], 'reader')
+
+    def test_expiry_is_audited_under_the_tenant(self):
+        """Test tenant admins see the expiry of their dataset grants and members' roles."""
+        tenant = Tenant.objects.create(name='Acme', subdomain='acme')
+        TenantUser.objects.create(tenant=tenant, user=self.user)
+        dataset = Dataset.objects.create(name='sales', created_by=self.owner, tenant=tenant)
+        DatasetAccess.objects.create(user=self.user, dataset=dataset, expires_at=self.past)
+        UserRole.objects.filter(user=self.user).update(expires_at=self.past)
+
+        expire_due_grants()
+
+        with tenant_context(tenant):
+            actions = set(AuditLog.objects.values_list('action', flat=True))
+        self.assertEqual(actions, {'EXPIRE_ACCESS', 'EXPIRE_ROLE'})
+
+    def test_future_and_open_grants_are_kept(self):
+        """Test grants not yet due or without expiry are left alone."""
+        UserRole.objects.filter(user=self.user).update(expires_at=self.future)
+        self.assertEqual(expire_due_grants(), {'roles': 0, 'dataset_access': 0})
+        self.assertTrue(UserRole.objects.get(user=self.user).is_active)
+        self.assertEqual(next_expiry(), UserRole.objects.get(user=self.user).expires_at)
+
+    def test_expires_in_batches(self):
+        """Test due rows are expired batch by batch, each audited."""
+        for index in range(5):
+            user = User.objects.create_user(username=f'temp{index}', password='testpass123')
+            UserRole.objects.create(user=user, role=self.role, expires_at=self.past)
+
+        counts = expire_due_grants(batch_size=2)
+
+        self.assertEqual(counts['roles'], 5)
+        self.assertEqual(AuditLog.objects.filter(action='EXPIRE_ROLE').count(), 5)
+        self.assertFalse(UserRole.objects.filter(is_active=True, expires_at__lte=timezone.now()).exists())
+
+class InvalidationBusTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'bus.sqlite3')
+
+    def workers(self, backend_class):
+        if backend_class is SQLiteBackend:
+            make_backend = lambda: SQLiteBackend(self.path)
+        else:
+            cache.clear()
+            make_backend = CacheBackend
+        return InvalidationBus(make_backend(), poll_interval=0), InvalidationBus(make_backend(), poll_interval=0)
+
+    def test_versions_are_shared_between_workers(self):
+        """Test a bump in one worker is seen by the other on its next poll."""
+        for backend_class in (SQLiteBackend, CacheBackend):
+            with self.subTest(backend=backend_class.__name__):
+                first, second = self.workers(backend_class)
+                before = second.version('user', 7)
+                self.assertEqual(first.version('user', 7), before)
+
+                bumped = first.bump('user', 7)
+                self.assertGreater(bumped, before)
+                self.assertEqual(second.version('user', 7), bumped)
+                self.assertEqual(second.version('user', 8), first.version('user', 8))
+
+    def test_subscribers_hear_remote_changes(self):
+        """Test listeners get the changed key from another worker's bump."""
+        for backend_class in (SQLiteBackend, CacheBackend):
+            with self.subTest(backend=backend_class.__name__):
+                first, second = self.workers(backend_class)
+                heard = []
+                second.subscribe('role', lambda key, version: heard.append(key))
+                second.sync()
+
+                first.bump('role', 3)
+                first.bump('tenant', 1)
+                second.sync()
+                self.assertEqual(heard, ['3'])
+
+    def test_poll_interval_keeps_reads_local(self):
+        """Test versions are served from memory between polls."""
+        first = InvalidationBus(SQLiteBackend(self.path), poll_interval=60)
+        second = InvalidationBus(SQLiteBackend(self.path), poll_interval=0)
+        before = first.version('dataset', 1)
+        second.bump('dataset', 1)
+        self.assertEqual(first.version('dataset', 1), before)
+        first.sync(force=True)
+        self.assertGreater(first.version('dataset', 1), before)
+
+    def test_unknown_scope_is_rejected(self):
+        with self.assertRaises(ValueError):
+            InvalidationBus(SQLiteBackend(self.path)).bump('group', 1)
+
+class AuthorizationContextTestCase(PermissionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.request = RequestFactory().get('/api/v1/datasets/')
+        self.request.user = self.user
+
+    def test_roles_resolved_once_per_request(self):
+        """Test repeated role checks share one lookup."""
+        authz = get_authz(self.request)
+        with self.assertNumQueries(1):
+            for _ in range(10):
+                self.assertFalse(authz.is_data_admin)
+                self.assertTrue(authz.has_role('Analyst'))
+        self.assertIs(get_authz(self.request), authz)
+
+    def test_dataset_grants_resolved_once_per_request(self):
+        """Test dataset grants are loaded with a single query."""
+        datasets = [
+            Dataset.objects.create(name=f'Dataset {i}', created_by=self.user)
+            for i in range(3)
+        ]
+        DatasetAccess.objects.create(user=self.user, dataset=datasets[0])
+
+        authz = get_authz(self.request)
+        with self.assertNumQueries(1):
+            grants = [authz.has_dataset_grant(dataset) for dataset in datasets]
+        self.assertEqual(grants, [True, False, False])
+
+    def test_expired_unswept_grants_do_not_allow_reads(self):
+        """Test can_read_dataset agrees with the catalog on grants past their expiry."""
+        dataset = Dataset.objects.create(name='stale', created_by=self.user)
+        DatasetAccess.objects.create(
+            user=self.user, dataset=dataset, expires_at=timezone.now() - timedelta(minutes=1)
+        )
+        authz = get_authz(self.request)
+        self.assertFalse(authz.has_dataset_grant(dataset))
+        self.assertFalse(authz.can_read_dataset(dataset))
+
+    def test_anonymous_user_has_no_roles(self):
+        """Test anonymous requests resolve to an empty context."""
+        self.request.user = AnonymousUser()
+        authz = get_authz(self.request)
+        with self.assertNumQueries(0):
+            self.assertEqual(authz.roles, frozenset())
+            self.assertEqual(authz.dataset_grants, {})
+
+class AuthorizationExplainTestCase(PermissionTestCase):
+    def setUp(self):
+        super().setUp()
+        clear_local_snapshots()
+        self.factory = RequestFactory()
+
+    def view(self, request):
+        request.user.has_permission('DATASET_READ', 'census')
+        return JsonResponse({'ok': True})
+
+    def test_trace_records_decisions_cache_and_sql(self):
+        """Test each check records its rule, cache state and queries."""
+        trace, token = start_trace()
+        try:
+            self.user.has_permission('DATASET_READ', 'census')
+            self.user.has_permission('DATASET_READ', 'census')
+        finally:
+            stop_trace(token)
+
+        checks = [step for step in trace.steps if step.check == 'has_permission']
+        self.assertEqual([step.decision for step in checks], [True, True])
+        self.assertEqual(checks[0].source, 'role_permission:all')
+
+        snapshots = [step for step in trace.steps if step.check == 'permission_snapshot']
+        self.assertEqual([step.cache for step in snapshots], ['miss', 'local'])
+        self.assertTrue(snapshots[0].queries)
+        self.assertEqual(snapshots[1].queries, [])
+        self.assertGreaterEqual(trace.as_dict()['query_count'], len(snapshots[0].queries))
+
+    def test_no_trace_without_explain_mode(self):
+        """Test checks outside explain mode record nothing."""
+        self.assertFalse(is_explaining())
+        with explain_step('has_permission') as step:
+            self.assertIs(step, NULL_STEP)
+
+    def test_middleware_returns_trace_to_admins(self):
+        """Test admins get the trace in JSON responses when asking for it."""
+        self.user.is_superuser = True
+        request = self.factory.get('/api/v1/datasets/', HTTP_X_AUTHZ_EXPLAIN='1')
+        request.user = self.user
+
+        response = AuthorizationExplainMiddleware(self.view)(request)
+
+        payload = json.loads(response.content)
+        self.assertTrue(payload['ok'])
+        explain = payload['_authz_explain']
+        self.assertEqual(explain['user_id'], self.user.id)
+        self.assertIn('has_permission', [step['check'] for step in explain['steps']])
+
+    def test_middleware_hides_trace_from_other_users(self):
+        """Test the header alone does not expose traces."""
+        for headers in ({'HTTP_X_AUTHZ_EXPLAIN': '1'}, {}):
+            request = self.factory.get('/api/v1/datasets/', **headers)
+            request.user = self.user
+            response = AuthorizationExplainMiddleware(self.view)(request)
+            self.assertNotIn('_authz_explain', json.loads(response.content))
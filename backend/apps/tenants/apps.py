@@ -0,0 +1,9 @@
+# apps/tenants/apps.py
+
+from django.apps import AppConfig
+
+class TenantsConfig(AppConfig):
+    name = 'apps.tenants'
+
+    def ready(self):
+        from . import signals  # noqa: F401
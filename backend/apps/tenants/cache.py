@@ -0,0 +1,142 @@
+# apps/tenants/cache.py
+
+"""
+In-process caches for tenant resolution.
+
+Lookups by header id, subdomain and the default tenant, and
+(user, tenant) membership checks, are kept in TTL-bounded LRU caches.
+Misses are cached too, so unknown subdomains or non-members cost one
+query per TTL. Entries are evicted in every worker through the
+invalidation bus when a Tenant or TenantUser changes; the TTL only bounds
+how long an entry survives a lost event.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from apps.permissions.explain import explain_step
+from apps.permissions.invalidation import bus
+from .models import Tenant, TenantUser
+
+TENANT_CACHE_TTL = getattr(settings, 'TENANT_CACHE_TTL', 5 * 60)
+TENANT_CACHE_SIZE = getattr(settings, 'TENANT_CACHE_SIZE', 1024)
+
+MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire after ttl seconds"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        """Return (value, hit), calling loader() and caching its result on a miss"""
+        value = self.get(key)
+        if value is not MISSING:
+            return value, True
+        value = loader()
+        self.set(key, value)
+        return value, False
+
+    def discard_where(self, predicate):
+        """Drop every entry whose key matches predicate(key)"""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# ('id', header value) / ('subdomain', name) / ('default',) -> Tenant or None
+tenant_lookups = TTLCache(TENANT_CACHE_SIZE, TENANT_CACHE_TTL)
+# (user_id, tenant_id) -> bool
+tenant_memberships = TTLCache(TENANT_CACHE_SIZE * 4, TENANT_CACHE_TTL)
+
+def _first_active(**lookup):
+    return Tenant.objects.filter(is_active=True, **lookup).first()
+
+def _lookup(key, loader):
+    with explain_step('tenant_lookup', key=key) as step:
+        tenant, hit = tenant_lookups.get_or_load(key, loader)
+        step.update(
+            decision=getattr(tenant, 'pk', None),
+            source='tenant',
+            cache='hit' if hit else 'miss'
+        )
+        return tenant
+
+def get_tenant_by_id(tenant_id):
+    """Active tenant with this id, or None"""
+    return _lookup(('id', str(tenant_id)), lambda: _first_active(id=tenant_id))
+
+def get_tenant_by_subdomain(subdomain):
+    """Active tenant with this subdomain, or None"""
+    return _lookup(('subdomain', subdomain), lambda: _first_active(subdomain=subdomain))
+
+def get_default_tenant():
+    """Active default tenant, or None"""
+    return _lookup(('default',), lambda: _first_active(is_default=True))
+
+def has_tenant_membership(user_id, tenant_id):
+    """Check if the user is an active member of the tenant"""
+    with explain_step('tenant_membership', user_id=user_id, tenant_id=tenant_id) as step:
+        member, hit = tenant_memberships.get_or_load(
+            (user_id, tenant_id),
+            lambda: TenantUser.objects.filter(user_id=user_id, tenant_id=tenant_id, is_active=True).exists()
+        )
+        step.update(decision=member, source='tenant_user', cache='hit' if hit else 'miss')
+        return member
+
+def _tenant_changed(tenant_id, version):
+    # Subdomain or default changes can move any lookup key, and tenants
+    # change rarely, so drop every lookup
+    tenant_lookups.clear()
+    if tenant_id is None:
+        tenant_memberships.clear()
+    else:
+        tenant_id = int(tenant_id)
+        tenant_memberships.discard_where(lambda key: key[1] == tenant_id)
+
+def _user_changed(user_id, version):
+    if user_id is None:
+        tenant_memberships.clear()
+    else:
+        user_id = int(user_id)
+        tenant_memberships.discard_where(lambda key: key[0] == user_id)
+
+bus.subscribe('tenant', _tenant_changed)
+bus.subscribe('user', _user_changed)
+
+def clear_tenant_caches():
+    """Drop every cached tenant lookup and membership in this process"""
+    tenant_lookups.clear()
+    tenant_memberships.clear()
@@ -0,0 +1,49 @@
+# apps/tenants/context.py
+
+"""
+Tenant of the code currently running.
+
+The tenant is held in a context variable, so it follows the request
+through threads and async tasks without being passed around. When no
+tenant is active (management commands, the admin, background workers)
+tenant-aware managers do not filter.
+"""
+
+import contextvars
+from contextlib import contextmanager
+
+_current_tenant_id = contextvars.ContextVar('current_tenant_id', default=None)
+_scoped = contextvars.ContextVar('tenant_scoped', default=True)
+
+def get_current_tenant_id():
+    """Id of the active tenant, or None"""
+    return _current_tenant_id.get()
+
+def is_tenant_scoped():
+    """Whether tenant-aware managers should filter right now"""
+    return _scoped.get() and _current_tenant_id.get() is not None
+
+def set_current_tenant(tenant):
+    """Activate a tenant (instance or id); returns a token for reset_current_tenant"""
+    return _current_tenant_id.set(getattr(tenant, 'pk', tenant))
+
+def reset_current_tenant(token):
+    _current_tenant_id.reset(token)
+
+@contextmanager
+def tenant_context(tenant):
+    """Run a block as the given tenant"""
+    token = set_current_tenant(tenant)
+    try:
+        yield
+    finally:
+        reset_current_tenant(token)
+
+@contextmanager
+def unscoped():
+    """Run a block that must see every tenant's rows"""
+    token = _scoped.set(False)
+    try:
+        yield
+    finally:
+        _scoped.reset(token)
@@ -0,0 +1,142 @@
+# apps/tenants/management/commands/move_tenant.py
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, transaction
+
+from apps.permissions.invalidation import POLL_INTERVAL
+from apps.tenants.cache import TENANT_CACHE_TTL
+from apps.tenants.models import Tenant, TenantAwareModel
+from apps.tenants.routers import (
+    DATABASE_SETTING, FROZEN_SETTING, database_for_tenant, tenant_parent_field, tenant_routed_models,
+    copy_references
+)
+
+class Command(BaseCommand):
+    help = "Move a tenant's rows to another database shard in streamed batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('tenant', help='Tenant id or subdomain')
+        parser.add_argument('target', help='Database alias to move the tenant to')
+        parser.add_argument('--source', help='Database alias to move from (defaults to the current assignment)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows copied per insert')
+        parser.add_argument('--keep-source', action='store_true',
+                            help='Leave the copied rows in the source database')
+        parser.add_argument('--settle', type=float, default=POLL_INTERVAL + TENANT_CACHE_TTL,
+                            help='Seconds to wait after freezing the tenant, so every worker has '
+                                 'dropped its cached config, before copying (default: the '
+                                 'invalidation poll interval plus the tenant cache TTL)')
+
+    def get_tenant(self, value):
+        lookup = {'pk': value} if value.isdigit() else {'subdomain': value}
+        try:
+            return Tenant.objects.get(**lookup)
+        except Tenant.DoesNotExist:
+            raise CommandError(f'Tenant not found: {value}')
+
+    def tenant_rows(self, model, tenant, alias):
+        if issubclass(model, TenantAwareModel):
+            lookup = {'tenant_id': tenant.pk}
+        else:
+            lookup = {f'{tenant_parent_field(model)}__tenant_id': tenant.pk}
+        return model._base_manager.using(alias).filter(**lookup).order_by('pk')
+
+    def copy_rows(self, model, tenant, source, target, batch_size):
+        copied = 0
+        batch = []
+        for obj in self.tenant_rows(model, tenant, source).iterator(chunk_size=batch_size):
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                copied += self.write_batch(model, batch, target)
+                batch = []
+        if batch:
+            copied += self.write_batch(model, batch, target)
+        return copied
+
+    def write_batch(self, model, batch, target):
+        copy_references(model, batch, target)
+        model._base_manager.using(target).bulk_create(batch)
+        return len(batch)
+
+    def delete_rows(self, model, tenant, source, batch_size):
+        deleted = 0
+        rows = self.tenant_rows(model, tenant, source)
+        while True:
+            pks = list(rows.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return deleted
+            # Rows of owned models were deleted first, so no cascade or signal is needed
+            model._base_manager.using(source).filter(pk__in=pks)._raw_delete(source)
+            deleted += len(pks)
+            rows = rows.filter(pk__gt=pks[-1])
+
+    def check_counts(self, tenant, database, expected):
+        """CommandError unless database holds the expected number of the tenant's rows per model"""
+        mismatches = []
+        for model, count in expected.items():
+            found = self.tenant_rows(model, tenant, database).count()
+            if found != count:
+                mismatches.append(f'{model._meta.label} {found} != {count}')
+        if mismatches:
+            raise CommandError(f"Row counts in {database} do not match the copy: {', '.join(mismatches)}")
+
+    def update_settings(self, tenant, **changes):
+        values = {**(tenant.settings or {}), **changes}
+        tenant.settings = {key: value for key, value in values.items() if value is not None}
+        tenant.save(update_fields=['settings', 'updated_at'])
+
+    def handle(self, *args, **options):
+        tenant = self.get_tenant(options['tenant'])
+        target = options['target']
+        if target not in settings.DATABASES:
+            raise CommandError(f'Unknown database alias: {target}')
+        source = options['source'] or database_for_tenant(tenant.pk)
+        if source == target:
+            raise CommandError(f'{tenant} is already on {target}')
+
+        batch_size = options['batch_size']
+        models = tenant_routed_models()
+
+        # Writes to the tenant's rows are refused from before the copy until
+        # the switch, so nothing written meanwhile is left behind on source.
+        # Workers read the flag from their cached config, so the copy waits
+        # until every cache has been refreshed.
+        self.update_settings(tenant, **{FROZEN_SETTING: True})
+        try:
+            if options['settle'] > 0:
+                self.stdout.write(f"Froze {tenant}; waiting {options['settle']}s for every worker to notice")
+                time.sleep(options['settle'])
+            copied = {}
+            with transaction.atomic(using=target):
+                for model in models:
+                    copied[model] = self.copy_rows(model, tenant, source, target, batch_size)
+                    self.stdout.write(f'Copied {copied[model]} {model._meta.label} rows')
+
+            # Explicit primary keys were inserted; move sequences past them
+            connection = connections[target]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+            self.check_counts(tenant, source, copied)
+            self.check_counts(tenant, target, copied)
+        except BaseException:
+            self.update_settings(tenant, **{FROZEN_SETTING: None})
+            raise
+
+        self.update_settings(tenant, **{DATABASE_SETTING: target, FROZEN_SETTING: None})
+
+        if not options['keep_source']:
+            # A worker that wrote to source after the copy would lose the row
+            try:
+                self.check_counts(tenant, source, copied)
+            except CommandError as e:
+                raise CommandError(f'{e}; {tenant} now lives on {target}, source rows were kept')
+            with transaction.atomic(using=source):
+                for model in reversed(models):
+                    deleted = self.delete_rows(model, tenant, source, batch_size)
+                    self.stdout.write(f'Deleted {deleted} {model._meta.label} rows from {source}')
+
+        self.stdout.write(self.style.SUCCESS(f'Moved {tenant} from {source} to {target}'))
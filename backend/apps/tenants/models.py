@@ -4,6 +4,8 @@ from django.db import models
 from django.conf import settings
 from django.core.validators import RegexValidator
 
+from .context import get_current_tenant_id, is_tenant_scoped
+
 class Tenant(models.Model):
     """
     Tenant model for multi-tenancy support
@@ -41,7 +43,18 @@ class Tenant(models.Model):
     def __str__(self):
         return self.name
     
+    def clean(self):
+        super().clean()
+        self.get_config()
+
+    def get_config(self):
+        """Parse settings into a TenantConfig, raising ValidationError on bad values"""
+        from .config import TenantConfig
+        return TenantConfig.from_settings(self.settings, tenant_id=self.pk)
+
     def save(self, *args, **kwargs):
+        # Settings are validated once here so readers can trust them
+        self.get_config()
         # Ensure only one default tenant
         if self.is_default:
             Tenant.objects.filter(is_default=True).update(is_default=False)
@@ -77,9 +90,33 @@ class TenantUser(models.Model):
     def __str__(self):
         return f"{self.user.username} @ {self.tenant.name}"
 
+class TenantManager(models.Manager):
+    """
+    Manager that limits queries to the active tenant's rows, plus global
+    rows (no tenant) when include_global is set. Without an active tenant
+    every row is returned.
+    """
+    
+    def __init__(self, include_global=True):
+        super().__init__()
+        self.include_global = include_global
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if not is_tenant_scoped():
+            return queryset
+        tenant_id = get_current_tenant_id()
+        if self.include_global:
+            return queryset.filter(models.Q(tenant_id=tenant_id) | models.Q(tenant_id__isnull=True))
+        return queryset.filter(tenant_id=tenant_id)
+
 class TenantAwareModel(models.Model):
     """
-    Abstract base model that adds tenant awareness to any model
+    Abstract base model that adds tenant awareness to any model.
+    
+    objects is scoped to the active tenant; all_objects sees every tenant
+    and is used for related object access. Subclasses should add indexes
+    led by tenant so scoped queries only touch their tenant's slice.
     """
     tenant = models.ForeignKey(
         Tenant, 
@@ -89,11 +126,16 @@ class TenantAwareModel(models.Model):
         help_text='Leave blank for global data'
     )
     
+    objects = TenantManager()
+    all_objects = models.Manager()
+    
     class Meta:
         abstract = True
+        default_manager_name = 'objects'
+        base_manager_name = 'all_objects'
     
     def save(self, *args, **kwargs):
-        # Auto-assign tenant from request context if available
-        if not self.tenant and hasattr(self, '_current_tenant'):
-            self.tenant = self._current_tenant
+        # Auto-assign the active tenant to new rows
+        if self.tenant_id is None and self._state.adding:
+            self.tenant_id = get_current_tenant_id()
         super().save(*args, **kwargs)
\ No newline at end of file
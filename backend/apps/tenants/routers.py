@@ -0,0 +1,228 @@
+# apps/tenants/routers.py
+
+"""
+Tenant sharding.
+
+Tenant-aware models, and the models owned by them through a foreign key
+(dataset fields, grants, approval steps...), live in the database of their
+tenant. A tenant's database is the alias named in Tenant.settings
+['database'] when there is one, otherwise the alias its id hashes to on a
+consistent hash ring over TENANT_SHARDS. Every other model stays on the
+default database.
+
+Queries are routed by the active tenant (see apps.tenants.context) or by
+the tenant of the instance being saved. Without either they go to the
+default database, so jobs that serve every tenant (grant expiry, the
+effective access refresh) loop over get_shard_aliases() themselves. With
+a single shard the router does nothing.
+
+Shards carry the full schema. Global rows that sharded rows point at
+(users, content types, the tenant itself) are copied into the shard on
+write by copy_references, so foreign keys hold inside each database; the
+default database stays the source of truth for them.
+
+Global rows of tenant-aware models (no tenant) that tenants read next to
+their own, through a manager with include_global, are always written to
+the default database and mirrored into every other shard under the same
+primary key by mirror_global_rows.
+
+While a tenant is frozen (see TenantConfig.frozen) writes routed to its
+rows raise TenantFrozenError; move_tenant freezes the tenant between
+copying its rows and switching it to the new shard.
+"""
+
+import bisect
+import hashlib
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connections, DatabaseError, DEFAULT_DB_ALIAS
+
+from .config import get_tenant_config
+from .context import get_current_tenant_id
+from .models import TenantAwareModel
+
+DATABASE_SETTING = 'database'
+FROZEN_SETTING = 'frozen'
+
+class TenantFrozenError(DatabaseError):
+    """A write reached a tenant whose rows are being moved to another shard"""
+
+def get_shard_aliases():
+    return list(getattr(settings, 'TENANT_SHARDS', [DEFAULT_DB_ALIAS]))
+
+class HashRing:
+    """Consistent hash ring; adding a shard only moves about 1/n of the keys"""
+
+    def __init__(self, nodes, replicas=64):
+        self.nodes = list(nodes)
+        self._points = []
+        self._owners = {}
+        for node in self.nodes:
+            for replica in range(replicas):
+                point = self._hash(f'{node}#{replica}')
+                self._points.append(point)
+                self._owners[point] = node
+        self._points.sort()
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(str(value).encode()).hexdigest()[:16], 16)
+
+    def get(self, key):
+        if not self._points:
+            raise ValueError("Hash ring has no nodes")
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+@lru_cache(maxsize=None)
+def _ring(aliases):
+    return HashRing(aliases)
+
+def database_for_tenant(tenant_id):
+    """Alias holding a tenant's rows"""
+    aliases = get_shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+    explicit = get_tenant_config(tenant_id).database
+    if explicit in settings.DATABASES:
+        return explicit
+    return _ring(tuple(aliases)).get(int(tenant_id))
+
+def tenant_parent_field(model):
+    """
+    Name of the foreign key through which a model belongs to a
+    tenant-aware model, or None
+    """
+    for field in model._meta.concrete_fields:
+        if field.many_to_one and not field.null:
+            related = field.related_model
+            if isinstance(related, type) and issubclass(related, TenantAwareModel):
+                return field.name
+    return None
+
+@lru_cache(maxsize=None)
+def is_tenant_routed(model):
+    """Whether rows of this model live in their tenant's database"""
+    return issubclass(model, TenantAwareModel) or tenant_parent_field(model) is not None
+
+def tenant_routed_models():
+    """Sharded models, tenant-aware models before the models they own"""
+    models = [model for model in apps.get_models() if is_tenant_routed(model)]
+    return sorted(models, key=lambda model: not issubclass(model, TenantAwareModel))
+
+@lru_cache(maxsize=None)
+def shares_global_rows(model):
+    """Whether tenants read this model's global rows (no tenant) next to their own"""
+    return issubclass(model, TenantAwareModel) and getattr(model._default_manager, 'include_global', False)
+
+def is_global_row(instance):
+    return isinstance(instance, TenantAwareModel) and instance.tenant_id is None and shares_global_rows(type(instance))
+
+def mirror_global_rows(model, objs, delete=False):
+    """
+    Copy global rows from the default database into every other shard
+    under the same primary key, or delete them there. Raises ValueError
+    when a shard already used one of the keys for a tenant's row.
+    """
+    pks = [obj.pk for obj in objs]
+    fields = model._meta.concrete_fields
+    for alias in get_shard_aliases():
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        shard = model._base_manager.using(alias)
+        if delete:
+            shard.filter(pk__in=pks).delete()
+            continue
+        taken = list(shard.filter(pk__in=pks, tenant__isnull=False).values_list('pk', flat=True))
+        if taken:
+            raise ValueError(
+                f"Cannot mirror global {model._meta.label} rows {taken} into {alias}: "
+                "the shard uses these keys for tenant rows"
+            )
+        copy_references(model, objs, alias)
+        shard.bulk_create(
+            [model(**{field.attname: getattr(obj, field.attname) for field in fields}) for obj in objs],
+            update_conflicts=True,
+            unique_fields=[model._meta.pk.name],
+            update_fields=[field.name for field in fields if not field.primary_key]
+        )
+        # Keep the shard from handing out the mirrored keys itself
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [model]):
+                cursor.execute(sql)
+
+def copy_references(model, objs, alias):
+    """
+    Copy the global rows that objs reference through foreign keys from the
+    default database into alias, following their own references too
+    """
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    pending = [(model, list(objs))]
+    seen = set()
+    while pending:
+        model, objs = pending.pop()
+        for field in model._meta.concrete_fields:
+            if not field.many_to_one or is_tenant_routed(field.related_model):
+                continue
+            related = field.related_model
+            ids = {getattr(obj, field.attname) for obj in objs} - {None}
+            ids = {pk for pk in ids if (related, pk) not in seen}
+            if not ids:
+                continue
+            seen.update((related, pk) for pk in ids)
+            present = set(related._base_manager.using(alias).filter(pk__in=ids).values_list('pk', flat=True))
+            missing = list(related._base_manager.using(DEFAULT_DB_ALIAS).filter(pk__in=ids - present))
+            if missing:
+                related._base_manager.using(alias).bulk_create(missing, ignore_conflicts=True)
+                pending.append((related, missing))
+
+class TenantRouter:
+    """Send reads and writes of sharded models to their tenant's database"""
+
+    def _tenant_id(self, hints):
+        instance = hints.get('instance')
+        tenant_id = getattr(instance, 'tenant_id', None)
+        if tenant_id is not None:
+            return tenant_id
+        return get_current_tenant_id()
+
+    def _route(self, model, hints):
+        if len(get_shard_aliases()) == 1:
+            return None
+        if not is_tenant_routed(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db and is_tenant_routed(type(instance)):
+            # Keep related lookups on the database the instance came from
+            return instance._state.db
+        tenant_id = self._tenant_id(hints)
+        if tenant_id is None:
+            return None
+        return database_for_tenant(tenant_id)
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        if len(get_shard_aliases()) > 1 and is_global_row(hints.get('instance')):
+            # Written once on default, then mirrored into the shards
+            return DEFAULT_DB_ALIAS
+        database = self._route(model, hints)
+        if database is not None and is_tenant_routed(model):
+            tenant_id = self._tenant_id(hints)
+            if tenant_id is not None and get_tenant_config(tenant_id).frozen:
+                raise TenantFrozenError(f"Tenant {tenant_id} is being moved to another shard; try again shortly")
+        return database
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Global rows (users, content types) are copied into shards as needed
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Every shard carries the full schema
+        return None
@@ -0,0 +1,35 @@
+# apps/tenants/signals.py
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from apps.permissions.invalidation import bus
+from .models import Tenant, TenantUser
+from .routers import get_shard_aliases, is_global_row, is_tenant_routed, copy_references, mirror_global_rows
+
+@receiver([post_save, post_delete], sender=Tenant)
+def tenant_changed(sender, instance, **kwargs):
+    """Tenant lookups and memberships are cached by every worker"""
+    bus.publish('tenant', instance.pk)
+
+@receiver([post_save, post_delete], sender=TenantUser)
+def tenant_user_changed(sender, instance, **kwargs):
+    bus.publish('user', instance.user_id)
+
+@receiver(pre_save)
+def sharded_row_saving(sender, instance, using, **kwargs):
+    """Make sure a shard holds the global rows a sharded row points at"""
+    if len(get_shard_aliases()) > 1 and is_tenant_routed(sender):
+        copy_references(sender, [instance], using)
+
+@receiver(post_save)
+def global_row_saved(sender, instance, using, raw=False, **kwargs):
+    """Every shard reads global rows next to its tenants' own"""
+    if not raw and using == DEFAULT_DB_ALIAS and len(get_shard_aliases()) > 1 and is_global_row(instance):
+        mirror_global_rows(sender, [instance])
+
+@receiver(post_delete)
+def global_row_deleted(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS and len(get_shard_aliases()) > 1 and is_global_row(instance):
+        mirror_global_rows(sender, [instance], delete=True)
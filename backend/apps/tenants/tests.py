@@ -0,0 +1,434 @@
+# apps/tenants/tests.py
+
+from collections import Counter
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase, RequestFactory, override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+from apps.tenants.models import Tenant, TenantUser
+from apps.tenants.cache import TTLCache, MISSING, clear_tenant_caches
+from apps.tenants.config import TenantConfig, get_tenant_config
+from apps.tenants.context import tenant_context, unscoped
+from apps.tenants.management.commands.move_tenant import Command as MoveTenantCommand
+from apps.tenants.routers import (
+    HashRing, TenantFrozenError, TenantRouter, database_for_tenant, shares_global_rows, tenant_routed_models
+)
+from apps.tenants.throttling import BucketRegistry, SharedCounter, TenantRateThrottle
+from apps.datasets.models import Dataset, DatasetAccess, DatasetField, EffectiveDatasetAccess
+from apps.approvals.models import ApprovalRequest, ApprovalStep
+from apps.datasets.services import refresh_effective_access
+from apps.audit.models import AuditLog
+from apps.audit.services import log_action
+from apps.audit.writer import audit_writer
+from middleware.tenant import TenantMiddleware
+
+User = get_user_model()
+
+@override_settings(ALLOWED_HOSTS=['.example.com', 'testserver'])
+class TenantResolutionCacheTestCase(TestCase):
+    def setUp(self):
+        clear_tenant_caches()
+        self.factory = RequestFactory()
+        self.middleware = TenantMiddleware(lambda request: None)
+        self.tenant = Tenant.objects.create(name='Acme', subdomain='acme')
+        self.default = Tenant.objects.create(name='Default', subdomain='www', is_default=True)
+        self.user = User.objects.create_user(username='member', password='testpass123')
+        TenantUser.objects.create(tenant=self.tenant, user=self.user)
+
+    def resolve(self, **extra):
+        return self.middleware.get_tenant(self.factory.get('/api/v1/datasets/', **extra))
+
+    def test_steady_state_issues_no_queries(self):
+        """Test repeated resolution and membership checks stay in memory."""
+        self.assertEqual(self.resolve(HTTP_X_TENANT_ID=str(self.tenant.id)), self.tenant)
+        self.assertEqual(self.resolve(HTTP_HOST='acme.example.com'), self.tenant)
+        self.assertTrue(self.middleware.user_has_tenant_access(self.user, self.tenant))
+        with self.assertNumQueries(0):
+            for _ in range(5):
+                self.assertEqual(self.resolve(HTTP_X_TENANT_ID=str(self.tenant.id)), self.tenant)
+                self.assertEqual(self.resolve(HTTP_HOST='acme.example.com'), self.tenant)
+                self.assertTrue(self.middleware.user_has_tenant_access(self.user, self.tenant))
+
+    def test_negative_lookups_are_cached(self):
+        """Test unknown subdomains fall back to the default without re-querying."""
+        self.assertEqual(self.resolve(HTTP_HOST='nobody.example.com'), self.default)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve(HTTP_HOST='nobody.example.com'), self.default)
+
+    def test_tenant_change_evicts_lookups(self):
+        """Test saving a tenant drops cached lookups that may point at it."""
+        self.assertEqual(self.resolve(HTTP_HOST='beta.example.com'), self.default)
+        self.tenant.subdomain = 'beta'
+        self.tenant.save()
+        self.assertEqual(self.resolve(HTTP_HOST='beta.example.com'), self.tenant)
+
+        self.tenant.is_active = False
+        self.tenant.save()
+        self.assertEqual(self.resolve(HTTP_HOST='beta.example.com'), self.default)
+
+    def test_membership_change_evicts_access(self):
+        """Test revoking and granting membership is seen immediately."""
+        outsider = User.objects.create_user(username='outsider', password='testpass123')
+        self.assertFalse(self.middleware.user_has_tenant_access(outsider, self.tenant))
+        TenantUser.objects.create(tenant=self.tenant, user=outsider)
+        self.assertTrue(self.middleware.user_has_tenant_access(outsider, self.tenant))
+
+        TenantUser.objects.filter(user=self.user).get().delete()
+        self.assertFalse(self.middleware.user_has_tenant_access(self.user, self.tenant))
+
+class TTLCacheTestCase(TestCase):
+    def test_entries_expire(self):
+        cache = TTLCache(max_size=10, ttl=0)
+        cache.set('key', 'value')
+        self.assertIs(cache.get('key'), MISSING)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual(len(cache), 2)
+
+class TenantScopingTestCase(TestCase):
+    def setUp(self):
+        self.acme = Tenant.objects.create(name='Acme', subdomain='acme')
+        self.globex = Tenant.objects.create(name='Globex', subdomain='globex')
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        Dataset.objects.create(name='acme-sales', created_by=self.user, tenant=self.acme)
+        self.globex_dataset = Dataset.objects.create(name='globex-sales', created_by=self.user, tenant=self.globex)
+        Dataset.objects.create(name='reference', created_by=self.user)
+
+    def names(self, queryset):
+        return set(queryset.values_list('name', flat=True))
+
+    def test_default_manager_filters_by_active_tenant(self):
+        """Test queries only see the active tenant's rows and global rows."""
+        self.assertEqual(len(Dataset.objects.all()), 3)
+        with tenant_context(self.acme):
+            self.assertEqual(self.names(Dataset.objects.all()), {'acme-sales', 'reference'})
+            self.assertEqual(len(Dataset.all_objects.all()), 3)
+            with unscoped():
+                self.assertEqual(len(Dataset.objects.all()), 3)
+
+    def test_new_rows_get_the_active_tenant(self):
+        """Test rows created inside a tenant are assigned to it."""
+        with self.captureOnCommitCallbacks(execute=True), tenant_context(self.globex):
+            dataset = Dataset.objects.create(name='globex-hr', created_by=self.user)
+            log_action(self.user, 'CREATE', dataset)
+        audit_writer.flush()
+        self.assertEqual(dataset.tenant, self.globex)
+        self.assertEqual(AuditLog.objects.get().tenant, self.globex)
+
+    def test_audit_log_excludes_global_entries(self):
+        """Test system audit entries are not shared with every tenant."""
+        with self.captureOnCommitCallbacks(execute=True):
+            log_action(self.user, 'SYSTEM', self.globex_dataset)
+            with tenant_context(self.globex):
+                log_action(self.user, 'UPDATE', self.globex_dataset)
+        audit_writer.flush()
+        with tenant_context(self.globex):
+            self.assertEqual(list(AuditLog.objects.values_list('action', flat=True)), ['UPDATE'])
+
+    def test_related_access_is_not_scoped(self):
+        """Test following a relation reaches rows of other tenants."""
+        access = DatasetAccess.objects.create(user=self.user, dataset=self.globex_dataset)
+        with tenant_context(self.acme):
+            access = DatasetAccess.objects.get(pk=access.pk)
+            self.assertEqual(access.dataset.name, 'globex-sales')
+
+    def test_effective_access_refresh_spans_tenants(self):
+        """Test a refresh triggered inside a tenant keeps other tenants' rows."""
+        with tenant_context(self.acme):
+            refresh_effective_access(user_ids=[self.user.id])
+        self.assertEqual(
+            EffectiveDatasetAccess.objects.filter(user=self.user).count(),
+            3
+        )
+
+class TenantShardingTestCase(TestCase):
+    def test_hash_ring_is_stable_and_balanced(self):
+        """Test keys map to the same shard every time and spread over all shards."""
+        ring = HashRing(['default', 'shard_1', 'shard_2'])
+        assignments = {tenant_id: ring.get(tenant_id) for tenant_id in range(3000)}
+        self.assertEqual(assignments, {tenant_id: ring.get(tenant_id) for tenant_id in range(3000)})
+        counts = Counter(assignments.values())
+        self.assertEqual(set(counts), {'default', 'shard_1', 'shard_2'})
+        self.assertGreater(min(counts.values()), 600)
+
+    def test_adding_a_shard_moves_few_tenants(self):
+        """Test a new shard only takes keys from the existing ones."""
+        before = HashRing(['default', 'shard_1', 'shard_2'])
+        after = HashRing(['default', 'shard_1', 'shard_2', 'shard_3'])
+        moved = [key for key in range(3000) if before.get(key) != after.get(key)]
+        self.assertTrue(all(after.get(key) == 'shard_3' for key in moved))
+        self.assertLess(len(moved), 1200)
+
+    @override_settings(TENANT_SHARDS=['default', 'shard_1'])
+    def test_explicit_assignment_wins(self):
+        """Test Tenant.settings['database'] overrides the hash ring."""
+        tenant = Tenant.objects.create(name='Big', subdomain='big', settings={'database': 'default'})
+        self.assertEqual(database_for_tenant(tenant.pk), 'default')
+
+        tenant.settings = {}
+        tenant.save()
+        self.assertEqual(database_for_tenant(tenant.pk), HashRing(['default', 'shard_1']).get(tenant.pk))
+
+    def test_routed_models(self):
+        """Test tenant-aware models and the models they own are sharded."""
+        routed = set(tenant_routed_models())
+        self.assertTrue({Dataset, DatasetAccess, DatasetField, AuditLog, ApprovalRequest, ApprovalStep} <= routed)
+        self.assertFalse({Tenant, User} & routed)
+
+    @override_settings(TENANT_SHARDS=['default', 'shard_1'])
+    def test_global_rows_are_written_to_default(self):
+        """Test global rows read by every tenant go to default whatever shard they were read from."""
+        user = User.objects.create_user(username='sharer', password='testpass123')
+        tenant = Tenant.objects.create(name='Pinned', subdomain='pinned', settings={'database': 'default'})
+        router = TenantRouter()
+        shared = Dataset(name='reference', created_by=user)
+        shared._state.db = 'shard_1'
+        self.assertEqual(router.db_for_write(Dataset, instance=shared), 'default')
+        self.assertEqual(router.db_for_read(Dataset, instance=shared), 'shard_1')
+        own = Dataset(name='own', created_by=user, tenant=tenant)
+        own._state.db = 'shard_1'
+        self.assertEqual(router.db_for_write(Dataset, instance=own), 'shard_1')
+        self.assertTrue(shares_global_rows(Dataset))
+        self.assertFalse(shares_global_rows(AuditLog))
+
+    @override_settings(TENANT_SHARDS=['default', 'shard_1'])
+    def test_frozen_tenant_refuses_writes(self):
+        """Test a tenant being moved can be read but not written."""
+        user = User.objects.create_user(username='mover', password='testpass123')
+        tenant = Tenant.objects.create(
+            name='Moving', subdomain='moving', settings={'database': 'default', 'frozen': True}
+        )
+        with tenant_context(tenant):
+            with self.assertRaises(TenantFrozenError):
+                Dataset.objects.create(name='late', created_by=user)
+            self.assertEqual(Dataset.objects.count(), 0)
+        with self.assertRaises(ValidationError):
+            Tenant.objects.create(name='Bad', subdomain='bad', settings={'frozen': 'yes'})
+
+    def test_move_unfreezes_tenant_after_failed_copy(self):
+        """Test the tenant is frozen during the copy and thawed when it fails."""
+        tenant = Tenant.objects.create(name='Stuck', subdomain='stuck')
+        seen = []
+
+        class FailingCopy(MoveTenantCommand):
+            def copy_rows(self, model, tenant, source, target, batch_size):
+                seen.append(Tenant.objects.get(pk=tenant.pk).settings)
+                raise RuntimeError('target went away')
+
+        with self.assertRaisesMessage(RuntimeError, 'target went away'):
+            call_command(FailingCopy(), str(tenant.pk), 'default', source='shard_1', settle=0)
+        self.assertEqual(seen, [{'frozen': True}])
+        tenant.refresh_from_db()
+        self.assertEqual(tenant.settings, {})
+        self.assertFalse(get_tenant_config(tenant).frozen)
+
+    def test_move_checks_row_counts(self):
+        """Test a source holding rows the copy did not count is reported."""
+        user = User.objects.create_user(username='counter', password='testpass123')
+        tenant = Tenant.objects.create(name='Counted', subdomain='counted')
+        for i in range(3):
+            Dataset.objects.create(name=f'counted-{i}', created_by=user, tenant=tenant)
+        command = MoveTenantCommand()
+        command.check_counts(tenant, 'default', {Dataset: 3})
+        with self.assertRaisesMessage(CommandError, 'datasets.Dataset 3 != 2'):
+            command.check_counts(tenant, 'default', {Dataset: 2})
+
+    def test_move_deletes_source_rows_in_batches(self):
+        """Test source rows are deleted a batch of keys at a time."""
+        user = User.objects.create_user(username='batcher', password='testpass123')
+        tenant = Tenant.objects.create(name='Old', subdomain='old')
+        other = Tenant.objects.create(name='Other', subdomain='other')
+        for i in range(5):
+            Dataset.objects.create(name=f'old-{i}', created_by=user, tenant=tenant)
+        Dataset.objects.create(name='other', created_by=user, tenant=other)
+        # One select and one delete per batch of 2, then an empty select
+        with self.assertNumQueries(7):
+            deleted = MoveTenantCommand().delete_rows(Dataset, tenant, 'default', 2)
+        self.assertEqual(deleted, 5)
+        self.assertEqual(list(Dataset.all_objects.values_list('name', flat=True)), ['other'])
+
+class TenantThrottleTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bucket_refuses_when_empty(self):
+        """Test a bucket allows its capacity, then asks the client to wait"""
+        registry = BucketRegistry(sync_interval=60)
+        key = ('user', '1:1', (3, 60))
+        self.assertEqual([registry.acquire([key]) for _ in range(3)], [0, 0, 0])
+        wait = registry.acquire([key])
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 20)
+
+    def test_noisy_tenant_does_not_starve_others(self):
+        """Test one tenant draining its bucket leaves other tenants untouched"""
+        registry = BucketRegistry(sync_interval=60)
+        noisy = ('tenant', 1, (5, 60))
+        quiet = ('tenant', 2, (5, 60))
+        while not registry.acquire([noisy]):
+            pass
+        self.assertEqual(registry.acquire([quiet]), 0)
+
+    def test_all_buckets_or_none(self):
+        """Test a refused request takes no token from the other buckets"""
+        registry = BucketRegistry(sync_interval=60)
+        tenant = ('tenant', 1, (10, 60))
+        user = ('user', '1:1', (1, 60))
+        registry.acquire([tenant, user])
+        registry.acquire([tenant, user])
+        self.assertEqual(registry.bucket(tenant).pending, 1)
+
+    def test_workers_share_spending_in_batches(self):
+        """Test spending in one worker is taken out of another on sync"""
+        worker_a = BucketRegistry(sync_interval=60)
+        worker_b = BucketRegistry(sync_interval=60)
+        key = ('tenant', 1, (10, 3600))
+        worker_a.acquire([key])
+        worker_b.acquire([key])
+        for _ in range(5):
+            worker_a.acquire([key])
+        self.assertEqual(worker_a.bucket(key).pending, 6)
+
+        worker_a.flush()
+        worker_b.sync_interval = 0
+        self.assertEqual(worker_b.acquire([key]), 0)
+        # 10 - 1 (own) - 6 (worker a) - 1 (this request)
+        self.assertLess(worker_b.bucket(key).tokens, 3)
+
+    def test_new_buckets_start_from_shared_level(self):
+        """Test a bucket new to a worker, or evicted, starts where the others left it"""
+        key = ('tenant', 1, (3, 3600))
+        worker_a = BucketRegistry(sync_interval=60)
+        while not worker_a.acquire([key]):
+            pass
+        worker_a.flush()
+        self.assertGreater(BucketRegistry(sync_interval=60).acquire([key]), 0)
+
+        small = BucketRegistry(max_size=1, sync_interval=60)
+        self.assertGreater(small.acquire([key]), 0)
+        small.acquire([('tenant', 2, (3, 3600))])
+        self.assertGreater(small.acquire([key]), 0)
+
+    def test_sync_runs_outside_registry_lock(self):
+        """Test cache round trips never hold the lock other requests need"""
+        test = self
+
+        class CheckedCounter(SharedCounter):
+            def add(self, amount):
+                test.assertFalse(registry._lock.locked())
+                return super().add(amount)
+
+        class CheckedRegistry(BucketRegistry):
+            def _counter(self, key):
+                return CheckedCounter(cache, f'throttle-test:{key[1]}')
+
+        registry = CheckedRegistry(sync_interval=0)
+        for _ in range(3):
+            self.assertEqual(registry.acquire([('tenant', 1, (10, 60))]), 0)
+        registry.flush()
+
+    def test_cache_failure_fails_open(self):
+        """Test a failing shared cache lets requests through and leaves no bucket stuck mid-sync"""
+        down = [True]
+
+        class FlakyCounter(SharedCounter):
+            def add(self, amount):
+                if down[0]:
+                    raise ConnectionError('cache is down')
+                return super().add(amount)
+
+        class FlakyRegistry(BucketRegistry):
+            def _counter(self, key):
+                return FlakyCounter(cache, f'throttle-test:{key[1]}')
+
+        registry = FlakyRegistry(sync_interval=0)
+        keys = [('tenant', 1, (1, 60)), ('user', '1:1', (1, 60))]
+        with self.assertLogs('apps.tenants.throttling', 'WARNING'):
+            for _ in range(3):
+                self.assertEqual(registry.acquire(keys), 0)
+        self.assertFalse(any(bucket.syncing for bucket in registry._buckets.values()))
+
+        down[0] = False
+        self.assertEqual(registry.acquire(keys), 0)
+        self.assertGreater(registry.acquire(keys), 0)
+        self.assertTrue(all(bucket.seen is not None for bucket in registry._buckets.values()))
+
+    @override_settings(TENANT_THROTTLE_RATES={'tenant': '100/min', 'user': '10/min'})
+    def test_tenant_settings_override_rates(self):
+        """Test limits come from Tenant.settings"""
+        tenant = Tenant.objects.create(name='Small', subdomain='small', settings={'throttle': {'user': '2/min'}})
+        user = User.objects.create_user(username='throttled', password='x')
+        request = RequestFactory().get('/api/v1/datasets/')
+        request.tenant = tenant
+        request.user = user
+        keys = TenantRateThrottle().get_bucket_keys(request)
+        self.assertEqual(keys, [('tenant', tenant.pk, (100, 60)), ('user', f'{tenant.pk}:{user.pk}', (2, 60))])
+
+class TenantConfigTestCase(TestCase):
+    def test_settings_are_parsed_once(self):
+        """Test settings become typed attributes with defaults."""
+        config = TenantConfig.from_settings({
+            'throttle': {'user': '5/s', 'tenant': None},
+            'audit_sample_rate': 0.25,
+            'approval_templates': {'high': 'Strict approval'},
+        }, tenant_id=7)
+        self.assertEqual(config.tenant_id, 7)
+        self.assertEqual(config.user_rate, (5, 1))
+        self.assertIsNone(config.tenant_rate)
+        self.assertEqual(config.audit_sample_rate, 0.25)
+        self.assertEqual(config.approval_templates['high'], 'Strict approval')
+        self.assertIsNone(TenantConfig.from_settings({}).database)
+
+    def test_config_is_immutable(self):
+        """Test a config cannot be changed once built."""
+        config = TenantConfig.from_settings({})
+        with self.assertRaises(AttributeError):
+            config.audit_sample_rate = 0
+        with self.assertRaises(AttributeError):
+            config.extra = 1
+        with self.assertRaises(TypeError):
+            config.approval_templates['normal'] = 'Other'
+
+    def test_invalid_settings_are_rejected_on_save(self):
+        """Test bad settings never reach the database."""
+        for bad in ({'audit_sample_rate': 2}, {'throttle': {'user': 'often'}}, {'approval_templates': ['x']}):
+            with self.assertRaises(ValidationError):
+                Tenant.objects.create(name=f'Bad {bad}', subdomain='bad', settings=bad)
+        self.assertFalse(Tenant.objects.filter(subdomain='bad').exists())
+
+    def test_config_is_cached_until_tenant_changes(self):
+        """Test configs are built once per worker and rebuilt after a save."""
+        tenant = Tenant.objects.create(name='Acme', subdomain='acme', settings={'audit_sample_rate': 0.5})
+        self.assertEqual(get_tenant_config(tenant.pk).audit_sample_rate, 0.5)
+        with self.assertNumQueries(0):
+            self.assertIs(get_tenant_config(tenant.pk), get_tenant_config(tenant))
+
+        tenant.settings = {'audit_sample_rate': 0.1}
+        tenant.save()
+        self.assertEqual(get_tenant_config(tenant.pk).audit_sample_rate, 0.1)
+
+    def test_middleware_exposes_config(self):
+        """Test TenantMiddleware sets request.tenant_config."""
+        tenant = Tenant.objects.create(name='Acme', subdomain='acme', settings={'audit_sample_rate': 0.5})
+        request = RequestFactory().get('/api/v1/datasets/', HTTP_X_TENANT_ID=str(tenant.pk))
+        TenantMiddleware(lambda request: None)(request)
+        self.assertEqual(request.tenant_config.tenant_id, tenant.pk)
+        self.assertEqual(request.tenant_config.audit_sample_rate, 0.5)
+
+    def test_default_config_is_built_once(self):
+        """Test the tenantless config is shared until the settings it reads change."""
+        default = get_tenant_config(None)
+        self.assertIs(get_tenant_config(None), default)
+        with override_settings(REQUEST_LOG_SAMPLE_RATE=0.5):
+            self.assertEqual(get_tenant_config(None).audit_sample_rate, 0.5)
+        self.assertEqual(get_tenant_config(None).audit_sample_rate, default.audit_sample_rate)
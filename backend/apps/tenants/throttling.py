@@ -0,0 +1,265 @@
+# apps/tenants/throttling.py
+
+"""
+Per-tenant and per-user token-bucket throttling.
+
+Every tenant, and every user within a tenant, gets its own bucket, so a
+noisy tenant only drains its own tokens. Limits come from the tenant's
+configuration (see apps.tenants.config), which falls back to
+TENANT_THROTTLE_RATES. A bucket holds up to one period's
+worth of tokens and refills continuously.
+
+Buckets live in process. Each worker counts the tokens it spent and, at
+most every THROTTLE_SYNC_INTERVAL seconds per bucket, adds them to a
+shared counter in the cache in one incr. The counter's new value tells
+the worker how many tokens the other workers spent since its last sync,
+and those are taken out of the local bucket, whose level is then
+published next to the counter. A bucket new to the worker, or evicted
+and created again, starts from that published level rather than full.
+Syncs never hold the registry lock, so a request only waits on the cache
+for its own due buckets, never behind another request's; between syncs a
+bucket can overshoot by at most what the other workers spend in one
+interval. When the shared cache fails, the error is logged and requests
+are let through until it is back.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+from .config import get_tenant_config
+
+logger = logging.getLogger(__name__)
+
+SYNC_INTERVAL = getattr(settings, 'THROTTLE_SYNC_INTERVAL', 1.0)
+BUCKETS_SIZE = getattr(settings, 'THROTTLE_BUCKETS_SIZE', 10000)
+COUNTER_TIMEOUT = 24 * 60 * 60
+
+class TokenBucket:
+    """A token bucket whose spending is shared with other workers"""
+    __slots__ = ('capacity', 'refill_rate', 'tokens', 'updated', 'pending', 'seen', 'synced_at', 'syncing')
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.refill_rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        # Tokens spent here and not yet pushed, and the shared counter at the last sync
+        self.pending = 0
+        self.seen = None
+        self.synced_at = self.updated
+        self.syncing = False
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def wait(self):
+        """Seconds until one token is available"""
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.refill_rate
+
+    def take(self):
+        self.tokens -= 1
+        self.pending += 1
+
+    def claim(self):
+        """Start a sync: hand over the pending spending"""
+        self.syncing = True
+        pending, self.pending = self.pending, 0
+        return pending
+
+    def unclaim(self, pending):
+        """A sync failed; keep its spending for the next one"""
+        self.pending += pending
+        self.syncing = False
+
+    def synced(self, pending, total, level=None):
+        """
+        Finish a sync that pushed pending and read the counter's new total:
+        take out what the other workers spent since the last sync. A new
+        bucket starts from the level another worker published, if any,
+        instead of full.
+        """
+        if self.seen is not None:
+            others = total - self.seen - pending
+            if others > 0:
+                self.tokens = max(self.tokens - others, -self.capacity)
+        elif level is not None:
+            tokens, published_at = level
+            refilled = tokens + max(0.0, time.time() - published_at) * self.refill_rate
+            self.tokens = min(self.tokens, refilled, self.capacity)
+        self.seen = total
+        self.synced_at = time.monotonic()
+        self.syncing = False
+        return self.tokens
+
+class SharedCounter:
+    """A monotonic counter in the shared cache, plus the last published bucket level"""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+
+    def add(self, amount):
+        """Add amount and return the new total"""
+        self.cache.add(self.key, 0, timeout=COUNTER_TIMEOUT)
+        if not amount:
+            return self.cache.get(self.key, 0)
+        return self.cache.incr(self.key, amount)
+
+    def level(self):
+        """(tokens, wall clock time) last published by any worker, or None"""
+        return self.cache.get(f'{self.key}:level')
+
+    def publish(self, tokens):
+        self.cache.set(f'{self.key}:level', (tokens, time.time()), timeout=COUNTER_TIMEOUT)
+
+class BucketRegistry:
+    """
+    In-process buckets keyed by (scope, id, rate), least recently used
+    dropped first. The lock only guards in-memory state; syncs with the
+    shared cache run outside it, one at a time per bucket.
+    """
+
+    def __init__(self, max_size=BUCKETS_SIZE, sync_interval=SYNC_INTERVAL, cache_alias='default'):
+        self.max_size = max_size
+        self.sync_interval = sync_interval
+        self.cache_alias = cache_alias
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _counter(self, key):
+        scope, ident, (num, period) = key
+        return SharedCounter(caches[self.cache_alias], f'throttle:{scope}:{ident}:{num}/{period}')
+
+    def bucket(self, key, evicted=None):
+        """The bucket for key; buckets evicted to make room are appended to evicted"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            _, _, (num, period) = key
+            bucket = self._buckets[key] = TokenBucket(num, period)
+            while len(self._buckets) > self.max_size:
+                evicted_key, evicted_bucket = self._buckets.popitem(last=False)
+                if evicted is not None and evicted_bucket.pending and not evicted_bucket.syncing:
+                    evicted.append((evicted_key, evicted_bucket, evicted_bucket.claim()))
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _sync(self, key, bucket, pending):
+        """
+        Push claimed spending and publish the resulting level; called
+        without the lock. Returns False when the shared cache failed.
+        """
+        counter = self._counter(key)
+        try:
+            total = counter.add(pending)
+            level = counter.level() if bucket.seen is None else None
+        except Exception:
+            logger.warning("Could not sync throttle bucket %s with the shared cache", key, exc_info=True)
+            with self._lock:
+                bucket.unclaim(pending)
+            return False
+        with self._lock:
+            tokens = bucket.synced(pending, total, level)
+        try:
+            counter.publish(tokens)
+        except Exception:
+            logger.warning("Could not publish the level of throttle bucket %s", key, exc_info=True)
+        return True
+
+    def _sync_all(self, claimed):
+        """Sync claimed buckets; returns False if any failed. None is left claimed."""
+        ok = True
+        try:
+            for key, bucket, pending in claimed:
+                ok = self._sync(key, bucket, pending) and ok
+        finally:
+            with self._lock:
+                for _, bucket, pending in claimed:
+                    if bucket.syncing:
+                        # Interrupted before its sync finished
+                        bucket.unclaim(pending)
+        return ok
+
+    def acquire(self, keys):
+        """
+        Take a token from every bucket, or from none of them.
+        Returns the seconds to wait when a bucket is empty, else 0.
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            buckets = [self.bucket(key, evicted) for key in keys]
+            due = [
+                (key, bucket, bucket.claim())
+                for key, bucket in zip(keys, buckets)
+                if not bucket.syncing and (bucket.seen is None or now - bucket.synced_at >= self.sync_interval)
+            ]
+        # New buckets are seeded before their first decision; the others
+        # sync in whichever request finds them due
+        if not self._sync_all(evicted + due):
+            # Fail open: without the shared counts the request is allowed
+            return 0
+        with self._lock:
+            for bucket in buckets:
+                bucket.refill(now)
+            wait = max((bucket.wait() for bucket in buckets), default=0)
+            if wait:
+                return wait
+            for bucket in buckets:
+                bucket.take()
+            return 0
+
+    def flush(self):
+        """Push every bucket's pending spending to the shared cache"""
+        with self._lock:
+            due = [
+                (key, bucket, bucket.claim())
+                for key, bucket in self._buckets.items()
+                if bucket.pending and not bucket.syncing
+            ]
+        self._sync_all(due)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+buckets = BucketRegistry()
+
+class TenantRateThrottle(BaseThrottle):
+    """
+    Limit authenticated requests per tenant and per user within the tenant.
+    Anonymous requests are left to AnonRateThrottle.
+    """
+
+    def get_bucket_keys(self, request):
+        config = getattr(request, 'tenant_config', None)
+        if config is None:
+            config = get_tenant_config(getattr(request, 'tenant', None))
+        keys = []
+        if config.tenant_id is not None and config.tenant_rate:
+            keys.append(('tenant', config.tenant_id, config.tenant_rate))
+        if config.user_rate:
+            keys.append(('user', f'{config.tenant_id}:{request.user.pk}', config.user_rate))
+        return keys
+
+    def allow_request(self, request, view):
+        self._wait = 0
+        if not request.user or not request.user.is_authenticated:
+            return True
+        keys = self.get_bucket_keys(request)
+        if not keys:
+            return True
+        self._wait = buckets.acquire(keys)
+        return not self._wait
+
+    def wait(self):
+        return self._wait
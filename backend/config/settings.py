@@ -66,6 +66,8 @@ SIMPLE_JWT = {
 }
 
 MIDDLEWARE = [
+    # First, so its latency covers the whole stack and early denials are sampled
+    'middleware.permissions.RequestLoggingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -76,10 +78,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
     # Custom middlewares
+    'middleware.permissions.AuthorizationExplainMiddleware',
     'middleware.tenant.TenantMiddleware',
-    # 'middleware.tenant.TenantIsolationMiddleware',  # Disabled temporarily
+    'middleware.tenant.TenantIsolationMiddleware',
     'middleware.permissions.PermissionInjectionMiddleware',
-    # 'middleware.permissions.RequestLoggingMiddleware',  # Disabled temporarily
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -101,6 +103,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+TEST_RUNNER = 'config.test_runner.TestRunner'
 
 
 # Database
@@ -111,6 +114,25 @@ DATABASES = {
     }
 }
 
+# Tenant shards. Locally every extra alias is its own SQLite file,
+# e.g. TENANT_SHARDS=default,shard_1,shard_2 (migrate each with --database).
+TENANT_SHARDS = config('TENANT_SHARDS', default='default').split(',')
+for shard_alias in TENANT_SHARDS:
+    DATABASES.setdefault(shard_alias, {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{shard_alias}.sqlite3',
+    })
+DATABASE_ROUTERS = ['apps.tenants.routers.TenantRouter']
+
+# Request log sampling (see apps.audit.request_log); tenants can override
+# the default rate with Tenant.settings['audit_sample_rate']
+REQUEST_LOG_SAMPLE_RATE = config('REQUEST_LOG_SAMPLE_RATE', default=0.1, cast=float)
+REQUEST_LOG_PATH_RATES = {
+    '/static/': 0,
+    '/api/v1/permissions/': 1.0,
+    '/api/v1/auth/': 1.0,
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -146,6 +168,22 @@ LOGOUT_REDIRECT_URL = '/admin/login/'
 
 # Audit log default config
 AUDIT_LOGGING_ENABLED = True
+# Each worker flushes queued audit entries from a background thread; the
+# test runner (config.test_runner) turns it off and tests flush explicitly
+AUDIT_FLUSH_THREAD = config('AUDIT_FLUSH_THREAD', default=True, cast=bool)
+# Entries older than this many months are compacted into columnar segment
+# files by `manage.py audit_archive compact`
+AUDIT_ARCHIVE_DIR = config('AUDIT_ARCHIVE_DIR', default=str(BASE_DIR / 'var' / 'audit-archive'))
+AUDIT_ARCHIVE_AFTER_MONTHS = config('AUDIT_ARCHIVE_AFTER_MONTHS', default=12, cast=int)
+AUDIT_ARCHIVE_SEGMENT_ROWS = 100000
+# Metadata keys copied into indexed AuditLog columns (apps.audit.metadata)
+AUDIT_PROMOTED_METADATA = ['target_user', 'ip_address', 'name']
+
+# Cross-worker invalidation of in-process authorization caches.
+# 'auto' uses the default cache when it is shared between processes and a
+# SQLite file under the temp directory when it is per-process (locmem).
+INVALIDATION_BACKEND = 'auto'
+INVALIDATION_POLL_INTERVAL = 1.0  # seconds a worker may lag behind other workers' changes
 
 # Security settings for production
 if not DEBUG:
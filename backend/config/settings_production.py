@@ -24,6 +24,9 @@ DATABASES = {
     }
 }
 
+# Tenant shards must be declared in DATABASES above to be used
+TENANT_SHARDS = [alias for alias in TENANT_SHARDS if alias in DATABASES]
+
 # Security settings
 SECURE_SSL_REDIRECT = True
 SECURE_HSTS_SECONDS = 31536000
@@ -81,6 +84,11 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'apps.permissions.explain': {
+            'handlers': ['console', 'file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 
@@ -127,14 +135,28 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_THROTTLE_CLASSES': [
         'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle'
+        'apps.tenants.throttling.TenantRateThrottle'
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '100/day',
-        'user': '1000/day'
     }
 }
 
+# Token buckets per tenant and per user; tenants override them in
+# Tenant.settings['throttle']
+TENANT_THROTTLE_RATES = {
+    'tenant': config('TENANT_THROTTLE_RATE', default='20000/day'),
+    'user': config('USER_THROTTLE_RATE', default='1000/day'),
+}
+THROTTLE_SYNC_INTERVAL = config('THROTTLE_SYNC_INTERVAL', default=1.0, cast=float)
+
+# Buffered audit writer
+AUDIT_BATCH_SIZE = config('AUDIT_BATCH_SIZE', default=500, cast=int)
+AUDIT_FLUSH_INTERVAL = config('AUDIT_FLUSH_INTERVAL', default=1.0, cast=float)
+AUDIT_FLUSH_THREAD = True
+# Entries are spooled to local disk first; keep this on a persistent volume
+AUDIT_SPOOL_DIR = config('AUDIT_SPOOL_DIR', default=str(BASE_DIR / 'var' / 'audit-spool'))
+
 # JWT Settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -0,0 +1,18 @@
+# backend/config/test_runner.py
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+class TestRunner(DiscoverRunner):
+    """Test runner that keeps audit writes on the test's own thread and connection"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        # A flush thread would write on its own connection, outside the
+        # transaction each test rolls back
+        self._audit_settings = override_settings(AUDIT_FLUSH_THREAD=False)
+        self._audit_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._audit_settings.disable()
+        super().teardown_test_environment(**kwargs)
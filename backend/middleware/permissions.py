@@ -1,10 +1,53 @@
 # middleware/permissions.py
 
+import logging
+import time
+
 from django.http import JsonResponse
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.contrib.auth.models import AnonymousUser
-from apps.permissions.models import UserRole, Permission
+from apps.audit.request_log import log_request
+from apps.permissions.cache import get_permission_snapshot
+from apps.permissions.context import AuthorizationContext
+from apps.permissions.explain import (
+    explain_requested, can_explain, start_trace, stop_trace, log_trace, attach_trace, explain_step
+)
+
+logger = logging.getLogger(__name__)
+
+class AuthorizationExplainMiddleware:
+    """
+    Explain mode for authorization. Requests sent with an
+    X-Authz-Explain: 1 header have every authorization check traced: the
+    rule that decided it, cache hits and misses, the SQL it ran and how
+    long it took. For superusers and Data Administrators the trace is
+    logged and added to JSON object responses under "_authz_explain";
+    for anyone else it is dropped.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not explain_requested(request):
+            return self.get_response(request)
+        
+        trace, token = start_trace(request.path)
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_trace(token)
+        
+        # The user is only known once the view has authenticated the request
+        if not can_explain(request):
+            return response
+        
+        payload = trace.as_dict(request.user)
+        payload['method'] = request.method
+        payload['status'] = response.status_code
+        log_trace(payload)
+        return attach_trace(response, payload)
 
 class PermissionInjectionMiddleware:
     """
@@ -30,9 +73,19 @@ class PermissionInjectionMiddleware:
             '/api/v1/approvals/': ['APPROVAL_VIEW', 'APPROVAL_SUBMIT'],
             '/api/v1/datasets/': ['DATASET_VIEW', 'DATASET_MANAGE'],
             '/api/v1/permissions/': ['PERMISSION_MANAGE'],
+            '/api/v1/audit/': ['AUDIT_VIEW'],
         }
+        
+        # API endpoints open to any authenticated user; the view checks who
+        # may ask what, e.g. users checking their own access
+        self.self_service_urls = [
+            '/api/v1/permissions/check/',
+        ]
 
     def __call__(self, request):
+        # Authorization facts are resolved lazily and shared by the whole request
+        request.authz = AuthorizationContext(request)
+        
         # Skip middleware for public URLs
         if any(request.path.startswith(url) for url in self.public_urls):
             return self.get_response(request)
@@ -40,8 +93,8 @@ class PermissionInjectionMiddleware:
         try:
             # Inject user permissions into request
             if hasattr(request, 'user') and request.user.is_authenticated:
-                request.user_permissions = self.get_user_permissions(request.user)
-                request.user_roles = self.get_user_roles(request.user)
+                request.user_permissions = request.authz.permissions
+                request.user_roles = request.authz.roles
             else:
                 request.user_permissions = set()
                 request.user_roles = set()
@@ -67,74 +120,68 @@ class PermissionInjectionMiddleware:
     
     def get_user_permissions(self, user):
         """Get all permissions for the user"""
-        permissions = set()
-        
-        # Get permissions through roles
-        user_roles = UserRole.objects.filter(user=user, is_active=True)
-        for user_role in user_roles:
-            role_permissions = Permission.objects.filter(
-                rolepermission__role=user_role.role
-            ).values_list('name', flat=True)
-            permissions.update(role_permissions)
-        
-        return permissions
+        return get_permission_snapshot(user).permissions
     
     def get_user_roles(self, user):
         """Get all active roles for the user"""
-        return set(
-            UserRole.objects.filter(user=user, is_active=True)
-            .values_list('role__name', flat=True)
-        )
+        return get_permission_snapshot(user).roles
     
     def check_api_permissions(self, request):
         """Check if user has permission to access API endpoint"""
-        if isinstance(request.user, AnonymousUser):
-            return False
-        
-        # Check specific API permissions
-        for url_pattern, required_permissions in self.api_permissions.items():
-            if request.path.startswith(url_pattern):
-                # Check if user has any of the required permissions
-                if not any(perm in request.user_permissions for perm in required_permissions):
-                    return False
-        
-        return True
+        with explain_step('api_permissions', path=request.path) as step:
+            if isinstance(request.user, AnonymousUser):
+                step.update(decision=False, source='anonymous')
+                return False
+            
+            if any(request.path.startswith(url) for url in self.self_service_urls):
+                step.update(decision=True, source='self_service')
+                return True
+            
+            # Check specific API permissions
+            for url_pattern, required_permissions in self.api_permissions.items():
+                if request.path.startswith(url_pattern):
+                    # Check if user has any of the required permissions
+                    if not any(perm in request.user_permissions for perm in required_permissions):
+                        step.update(decision=False, source=f'api_permissions:{url_pattern}', required=required_permissions)
+                        return False
+            
+            step.update(decision=True, source='api_permissions')
+            return True
     
     def check_web_permissions(self, request):
         """Check if user has permission to access web interface"""
-        if isinstance(request.user, AnonymousUser):
-            return False
-        
-        # Users with any role can access basic web interface
-        return len(request.user_roles) > 0
+        with explain_step('web_permissions', path=request.path) as step:
+            if isinstance(request.user, AnonymousUser):
+                step.update(decision=False, source='anonymous')
+                return False
+            
+            # Users with any role can access basic web interface
+            allowed = len(request.user_roles) > 0
+            step.update(decision=allowed, source='any_role')
+            return allowed
 
 class RequestLoggingMiddleware:
     """
-    Middleware to log all requests for audit purposes
+    Middleware to log a sample of requests for audit purposes
+    See apps.audit.request_log for how requests are sampled
     """
     
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        # Import here to avoid circular imports
-        from apps.audit.services import log_action
-        
-        # Log request if user is authenticated
-        if hasattr(request, 'user') and not isinstance(request.user, AnonymousUser):
-            log_action(
-                user=request.user,
-                action='REQUEST',
-                obj=None,
-                metadata={
-                    'method': request.method,
-                    'path': request.path,
-                    'user_agent': request.META.get('HTTP_USER_AGENT', ''),
-                    'ip_address': self.get_client_ip(request),
-                }
-            )
-        
+        started = time.perf_counter()
         response = self.get_response(request)
+        try:
+            log_request(
+                request,
+                response.status_code,
+                (time.perf_counter() - started) * 1000,
+                self.get_client_ip(request)
+            )
+        except Exception:
+            # Request logging must never break the request
+            logger.exception("Request logging failed for %s", request.path)
         return response
     
     def get_client_ip(self, request):
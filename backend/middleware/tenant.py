@@ -3,7 +3,11 @@
 from django.http import JsonResponse
 from django.shortcuts import redirect
 from django.contrib.auth.models import AnonymousUser
-from apps.tenants.models import Tenant, TenantUser
+from apps.tenants.context import set_current_tenant, reset_current_tenant
+from apps.tenants.config import get_tenant_config
+from apps.tenants.cache import (
+    get_tenant_by_id, get_tenant_by_subdomain, get_default_tenant, has_tenant_membership
+)
 
 class TenantMiddleware:
     """
@@ -19,14 +23,16 @@ class TenantMiddleware:
         if (request.path.startswith('/admin/') or 
             request.path.startswith('/static/') or
             request.path.startswith('/api/v1/auth/')):
+            request.tenant_config = get_tenant_config(None)
             return self.get_response(request)
         
         try:
             # Determine tenant
             tenant = self.get_tenant(request)
             
-            # Add tenant to request
+            # Add tenant and its parsed settings to request
             request.tenant = tenant
+            request.tenant_config = get_tenant_config(tenant)
             
             # Check if user has access to this tenant
             if (tenant and hasattr(request, 'user') and 
@@ -43,6 +49,7 @@ class TenantMiddleware:
         except Exception as e:
             # If tenant processing fails, continue without tenant context
             request.tenant = None
+            request.tenant_config = get_tenant_config(None)
         
         response = self.get_response(request)
         return response
@@ -55,25 +62,20 @@ class TenantMiddleware:
         # Try to get tenant from header (for API requests)
         tenant_id = request.META.get('HTTP_X_TENANT_ID')
         if tenant_id:
-            try:
-                return Tenant.objects.get(id=tenant_id, is_active=True)
-            except Tenant.DoesNotExist:
-                pass
+            tenant = get_tenant_by_id(tenant_id)
+            if tenant is not None:
+                return tenant
         
         # Try to get tenant from subdomain
         host = request.get_host()
         if '.' in host:
             subdomain = host.split('.')[0]
-            try:
-                return Tenant.objects.get(subdomain=subdomain, is_active=True)
-            except Tenant.DoesNotExist:
-                pass
+            tenant = get_tenant_by_subdomain(subdomain)
+            if tenant is not None:
+                return tenant
         
         # Return default tenant or None
-        try:
-            return Tenant.objects.get(is_default=True, is_active=True)
-        except Tenant.DoesNotExist:
-            return None
+        return get_default_tenant()
     
     def user_has_tenant_access(self, user, tenant):
         """Check if user has access to the specified tenant"""
@@ -81,16 +83,12 @@ class TenantMiddleware:
             return True  # No tenant restriction
         
         # Check if user is assigned to this tenant
-        return TenantUser.objects.filter(
-            user=user, 
-            tenant=tenant, 
-            is_active=True
-        ).exists()
+        return has_tenant_membership(user.pk, tenant.pk)
 
 class TenantIsolationMiddleware:
     """
     Middleware to ensure data isolation between tenants
-    Adds tenant filtering to database queries
+    Activates the request's tenant so tenant-aware managers filter by it
     """
     
     def __init__(self, get_response):
@@ -108,5 +106,9 @@ class TenantIsolationMiddleware:
         else:
             request.tenant_id = None
         
-        response = self.get_response(request)
+        token = set_current_tenant(request.tenant_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            reset_current_tenant(token)
         return response
\ No newline at end of file